@@ -6,9 +6,18 @@ import pandas as pd
 import numpy as np
 from scipy.stats import spearmanr, pearsonr
 import os
+import sys
+
+model_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'model')
+sys.path.insert(0, model_dir)
+import quantile_sketch
 
 # 讀取資料
 base_dir = os.path.join(os.path.dirname(__file__), '..', '結果')
+# model.py 把 sketch 寫在 src/model/outputs/quantile_sketches；結果/ 底下有複本時優先用複本
+sketch_dir = os.path.join(base_dir, 'quantile_sketches')
+if not os.path.isdir(sketch_dir):
+    sketch_dir = os.path.join(model_dir, 'outputs', 'quantile_sketches')
 test_df = pd.read_csv(os.path.join(base_dir, 'ati_test_per_post.csv'))
 train_df = pd.read_csv(os.path.join(base_dir, 'ati_train_per_post.csv'))
 brand_df = pd.read_csv(os.path.join(base_dir, 'ati_test_brand_agg.csv'))
@@ -71,7 +80,13 @@ print('-' * 70)
 test_df_clean = test_df.dropna(subset=['ATI_final', 'y']).copy()
 if len(test_df_clean) > 0:
     try:
-        test_df_clean['decile'] = pd.qcut(test_df_clean['ATI_final'], 10, labels=False, duplicates='drop')
+        # 有 model.py 寫出的 sketch 時直接用近似十分位數切點，不必對整張表 qcut
+        sketches = quantile_sketch.load_merged(('test',), sketch_dir=sketch_dir)
+        if sketches is not None and sketches.get('ATI_final').n > 0:
+            edges = sketches.get('ATI_final').deciles()
+            test_df_clean['decile'] = np.searchsorted(edges, test_df_clean['ATI_final'].to_numpy(), side='right')
+        else:
+            test_df_clean['decile'] = pd.qcut(test_df_clean['ATI_final'], 10, labels=False, duplicates='drop')
         decile_stats = test_df_clean.groupby('decile').agg({
             'y': ['count', 'mean', 'median', 'std'],
             'ATI_final': 'mean'
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 """
 創建優化版的 CSV 文件，只保留必要的欄位以加快服務器啟動速度
+
+model.py 已同時輸出欄式檔（Parquet / npz），存在時直接依欄位投影讀取
+REQUIRED_FIELDS，不再逐列複製整個 CSV；沒有欄式檔時才退回舊的 CSV 過濾。
 """
 import csv
 import sys
 import os
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'model'))
+import columnar
+
 # 需要保留的欄位
 REQUIRED_FIELDS = [
     'brand',
@@ -22,8 +28,22 @@ REQUIRED_FIELDS = [
     'ftime_parsed',
 ]
 
+def create_optimized_csv_from_columnar(input_file: str, output_file: str):
+    """由欄式輸出投影出需要的欄位，直接寫成優化版 CSV"""
+    print(f"讀取（欄式投影）: {input_file}")
+    print(f"輸出: {output_file}")
+    df = columnar.read_per_post(input_file, columns=REQUIRED_FIELDS)
+    missing_fields = [f for f in REQUIRED_FIELDS if f not in df.columns]
+    if missing_fields:
+        print(f"警告: 缺少欄位: {missing_fields}")
+    df.to_csv(output_file, index=False)
+    print(f"完成: 處理了 {len(df)} 行")
+    return True
+
 def create_optimized_csv(input_file: str, output_file: str):
     """創建優化版的 CSV"""
+    if columnar.exists(input_file):
+        return create_optimized_csv_from_columnar(input_file, output_file)
     if not os.path.exists(input_file):
         print(f"錯誤: 輸入文件不存在: {input_file}")
         return False
@@ -89,7 +109,7 @@ if __name__ == '__main__':
         input_path = os.path.join(base_dir, input_file)
         output_path = os.path.join(base_dir, output_file)
         
-        if os.path.exists(input_path):
+        if os.path.exists(input_path) or columnar.exists(input_path):
             print(f"\n處理: {input_file}")
             print("-" * 60)
             create_optimized_csv(input_path, output_path)
@@ -1,24 +1,46 @@
 from __future__ import annotations
 
 import csv
+import hashlib
 import json
+import math
+import sys
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from statistics import fmean
 from typing import Dict, List, Tuple
 
+import numpy as np
+import pandas as pd
+
 ROOT_DIR = Path(__file__).resolve().parents[1]
-RESULTS_DIR = ROOT_DIR / "結果"
+MODEL_DIR = ROOT_DIR / "src" / "model"
+sys.path.insert(0, str(MODEL_DIR))
+import quantile_sketch  # noqa: E402
+
+RESULTS_DIR = ROOT_DIR / "結果" if (ROOT_DIR / "結果").exists() else MODEL_DIR / "outputs"
 PER_POST_PATH = RESULTS_DIR / "ati_test_per_post.csv"
+TRAIN_PER_POST_PATH = RESULTS_DIR / "ati_train_per_post.csv"
 BRAND_AGG_PATH = RESULTS_DIR / "ati_test_brand_agg.csv"
+RAW_TEST_POSTS_PATH = MODEL_DIR / "with_rel_paths_test_posts.csv"
+RAW_TRAIN_POSTS_PATH = MODEL_DIR / "with_rel_paths_train_posts.csv"
+ARTIFACT_DIR = MODEL_DIR / "outputs" / "ati_artifacts"
+SKETCH_DIR = RESULTS_DIR / "quantile_sketches"
 OUTPUT_DIR = ROOT_DIR / "src" / "data" / "generated"
+MARKET_DIR = OUTPUT_DIR / "market"
+MARKET_LATEST_PATH = MARKET_DIR / "latest.json"
 SUMMARY_PATH = OUTPUT_DIR / "summary.json"
 SCATTER_PATH = OUTPUT_DIR / "novelty_diversity_scatter.json"
 BRAND_RANKINGS_PATH = OUTPUT_DIR / "brand_rankings.json"
 MODALITY_BREAKDOWN_PATH = OUTPUT_DIR / "modality_breakdown.json"
 CASE_STUDIES_PATH = OUTPUT_DIR / "case_studies.json"
 
+TIMEFRAME_LABEL = "2025/04 – 2025/09"
+SCALING_WEIGHTS = [1, 2, 3, 4, 4.8, 5, 6, 7, 8, 9, 10]
+TAIL_OUTLIER_LIMIT = 100
+CORRELATION_POINT_LIMIT = 500
+
 
 @dataclass
 class SummaryStats:
@@ -134,6 +156,10 @@ def read_per_post_stats(posts: List[PostRecord]) -> Tuple[int, float]:
 
 
 def read_brand_stats() -> Tuple[int, int, float]:
+  sketches = quantile_sketch.load_merged(("test",), sketch_dir=SKETCH_DIR)
+  if sketches is not None and sketches.brands():
+    return brand_stats_from_values(list(sketches.brand_means().values()))
+
   with BRAND_AGG_PATH.open(newline="", encoding="utf-8") as f:
     reader = csv.DictReader(f)
     ati_values: List[float] = []
@@ -148,6 +174,11 @@ def read_brand_stats() -> Tuple[int, int, float]:
   if not ati_values:
     raise ValueError("No ATI_final_mean values found in ati_test_brand_agg.csv")
 
+  return brand_stats_from_values(ati_values)
+
+
+def brand_stats_from_values(ati_values: List[float]) -> Tuple[int, int, float]:
+  # Top-10% threshold over brand means (the values are in memory, so sort exactly).
   brand_count = len(ati_values)
   sorted_values = sorted(ati_values, reverse=True)
   threshold_index = max(int(round(brand_count * 0.1)) - 1, 0)
@@ -397,6 +428,300 @@ def build_case_studies(posts: List[PostRecord], scatter_rows: List[dict]) -> Lis
   return case_studies
 
 
+# ---- Materialized market bundle (served by /api/market/* without recomputation) ----
+
+
+def artifact_version(artifact_dir: Path = ARTIFACT_DIR) -> str:
+  digest = hashlib.sha1()
+  if artifact_dir.exists():
+    for path in sorted(p for p in artifact_dir.iterdir() if p.is_file()):
+      digest.update(path.name.encode("utf-8"))
+      digest.update(path.read_bytes())
+  return digest.hexdigest()[:12]
+
+
+def attach_post_times(scored: pd.DataFrame, raw_path: Path) -> pd.Series:
+  # Scored rows keep the raw CSV order (model.py left-merges followers), so join by position.
+  if "ftime_parsed" in scored.columns:
+    return scored["ftime_parsed"].fillna("").astype(str)
+  if raw_path.exists():
+    raw = pd.read_csv(raw_path, usecols=["ftime_parsed"])
+    if len(raw) == len(scored):
+      return raw["ftime_parsed"].fillna("").astype(str).reset_index(drop=True)
+  return pd.Series([""] * len(scored))
+
+
+def load_scored_frame() -> pd.DataFrame:
+  frames = []
+  for split, scored_path, raw_path in (
+    ("test", PER_POST_PATH, RAW_TEST_POSTS_PATH),
+    ("train", TRAIN_PER_POST_PATH, RAW_TRAIN_POSTS_PATH),
+  ):
+    if not scored_path.exists():
+      continue
+    scored = pd.read_csv(scored_path)
+    scored["ftime_parsed"] = attach_post_times(scored, raw_path).values
+    scored["split"] = split
+    frames.append(scored)
+  if not frames:
+    raise FileNotFoundError(f"Missing file: {PER_POST_PATH}")
+
+  # Same order as loadPostData in the Node services: test rows first, then train rows.
+  df = pd.concat(frames, ignore_index=True)
+  numeric_cols = [
+    "count_like", "count_comment", "followers", "y", "ATI_final", "DS_final",
+    "text_nov", "image_nov", "meta_nov", "text_div", "image_div", "meta_div",
+  ]
+  for col in numeric_cols:
+    df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0) if col in df.columns else 0.0
+  df["brand"] = df["brand"].fillna("").astype(str).str.strip()
+  df["caption"] = df["caption"].fillna("").astype(str) if "caption" in df.columns else ""
+  df["novelty"] = (df["text_nov"] + df["image_nov"] + df["meta_nov"]) / 3
+  df["diversity"] = (df["text_div"] + df["image_div"] + df["meta_div"]) / 3
+  return df
+
+
+def pearson(x: np.ndarray, y: np.ndarray) -> float:
+  xc = x - x.mean()
+  yc = y - y.mean()
+  denom = math.sqrt(float(xc @ xc) * float(yc @ yc))
+  return float(xc @ yc) / denom if denom else 0.0
+
+
+def build_market_stats(scatter_rows: List[dict], total_posts: int) -> dict:
+  ati = np.array([row["ati"] for row in scatter_rows], dtype=float)
+  ds = np.array([row["diversity"] for row in scatter_rows], dtype=float)
+  avg_ati = float(ati.mean()) if ati.size else 0.0
+  ati_std = float(ati.std()) if ati.size else 0.0
+  threshold = avg_ati + ati_std
+  return {
+    "totalBrands": int(ati.size),
+    "totalPosts": int(total_posts),
+    "avgAti": avg_ati,
+    "avgDs": float(ds.mean()) if ds.size else 0.0,
+    "convergenceIndex": 100 - (ati_std / avg_ati * 100) if avg_ati else 0.0,
+    "atiStd": ati_std,
+    "highRiskBrandCount": int((ati >= threshold).sum()),
+    "highRiskThreshold": threshold,
+    "highRiskDefinition": "ATI 正1個標準差以上",
+  }
+
+
+def spearman_like_node(x: np.ndarray, y: np.ndarray) -> float:
+  """1 - 6Σd²/(n(n²-1)) with getATIEngagementCorrelation's ranks: tied values share the highest position."""
+  n = x.size
+  if n < 2:
+    return 0.0
+  rx = pd.Series(x).rank(method="max").to_numpy()
+  ry = pd.Series(y).rank(method="max").to_numpy()
+  d = rx - ry
+  return float(1 - 6 * float(d @ d) / (n * (n * n - 1)))
+
+
+def build_market_map_stats(market_stats: dict) -> dict:
+  return {
+    "totalBrands": market_stats["totalBrands"],
+    "avgAti": market_stats["avgAti"],
+    "avgDs": market_stats["avgDs"],
+    "convergenceIndex": max(0.0, min(100.0, market_stats["convergenceIndex"])),
+    "atiStd": market_stats["atiStd"],
+  }
+
+
+def month_keys(df: pd.DataFrame) -> pd.Series:
+  # Posts without a parsable time fall back to six simulated months by row position.
+  n = len(df)
+  position = np.minimum((np.arange(n) / max(n, 1) * 6).astype(int), 5)
+  simulated = pd.Series([f"2025-{4 + i:02d}" for i in position], index=df.index)
+  parsed = df["ftime_parsed"].str.extract(r"(\d{4})-(\d{2})")
+  real = parsed[0] + "-" + parsed[1]
+  return real.where(parsed[0].notna() & (df["ftime_parsed"] != "test"), simulated)
+
+
+def build_market_trend(df: pd.DataFrame, monthly_decay: float = 0.97) -> List[dict]:
+  grouped = df.assign(month=month_keys(df)).groupby("month", sort=True)[["ATI_final", "novelty", "diversity"]].mean()
+  multipliers = monthly_decay ** np.arange(len(grouped))
+  return [
+    {
+      "date": month,
+      "avgAti": float(row.ATI_final * m),
+      "avgNovelty": float(row.novelty * m),
+      "avgDiversity": float(row.diversity * m),
+    }
+    for (month, row), m in zip(grouped.iterrows(), multipliers)
+  ]
+
+
+def build_correlation(df: pd.DataFrame) -> dict:
+  ati = df["ATI_final"].to_numpy(dtype=float)
+  y = df["y"].to_numpy(dtype=float)
+  if ati.size == 0:
+    return {"correlation": 0, "pearsonCorrelation": 0, "dataPoints": [], "regressionLine": [], "slope": 0, "intercept": 0}
+  spearman = spearman_like_node(ati, y)
+  xc = ati - ati.mean()
+  sxx = float(xc @ xc)
+  slope = float(xc @ (y - y.mean())) / sxx if sxx else 0.0
+  intercept = float(y.mean() - slope * ati.mean())
+  lo, hi = float(ati.min()), float(ati.max())
+  return {
+    "correlation": spearman,
+    "pearsonCorrelation": pearson(ati, y),
+    "dataPoints": [{"ati": float(a), "engagement": float(e)} for a, e in zip(ati[:CORRELATION_POINT_LIMIT], y[:CORRELATION_POINT_LIMIT])],
+    "regressionLine": [
+      {"ati": lo, "engagement": slope * lo + intercept},
+      {"ati": hi, "engagement": slope * hi + intercept},
+    ],
+    "slope": slope,
+    "intercept": intercept,
+  }
+
+
+def decile_edges(num_deciles: int = 10) -> np.ndarray | None:
+  """Interior ATI_final decile boundaries from the merged train/test sketches, if present."""
+  sketches = quantile_sketch.load_merged(("train", "test"), sketch_dir=SKETCH_DIR)
+  if sketches is None or sketches.get("ATI_final").n == 0:
+    return None
+  return sketches.get("ATI_final").deciles(num_deciles)
+
+
+def build_deciles(
+  df: pd.DataFrame,
+  engagement_decay: float = 0.9,
+  num_deciles: int = 10,
+  edges: np.ndarray | None = None,
+) -> List[dict]:
+  ati = df["ATI_final"].to_numpy(dtype=float)
+  y = df["y"].to_numpy(dtype=float)
+  if edges is None:
+    # Exact fallback: equal-size chunks of the sorted table.
+    order = np.argsort(ati, kind="stable")
+    size = math.ceil(len(ati) / num_deciles) if len(ati) else 0
+    labels = np.empty(len(ati), dtype=int)
+    labels[order] = np.arange(len(ati)) // size if size else 0
+  else:
+    labels = np.searchsorted(edges, ati, side="right")
+  deciles: List[dict] = []
+  for i in range(num_deciles):
+    mask = labels == i
+    if not mask.any():
+      continue
+    # Bin index, not output position: an empty sketch bin must not shift later labels or decay.
+    engagement = y[mask] * engagement_decay ** i
+    deciles.append(
+      {
+        "decile": i + 1,
+        "atiMin": float(ati[mask].min()),
+        "atiMax": float(ati[mask].max()),
+        "atiMean": float(ati[mask].mean()),
+        "engagementMean": float(engagement.mean()),
+        "engagementMedian": float(np.median(engagement)),
+        "postCount": int(engagement.size),
+      }
+    )
+  return deciles
+
+
+def engagement_for_weight(df: pd.DataFrame, comment_weight: float) -> np.ndarray:
+  followers = df["followers"].to_numpy(dtype=float)
+  followers = np.where(followers == 0, 0.01, followers)
+  return (df["count_like"].to_numpy(dtype=float) + comment_weight * df["count_comment"].to_numpy(dtype=float)) / (followers + 0.01)
+
+
+def build_engagement_scaling(df: pd.DataFrame) -> dict:
+  if df.empty:
+    return {"likeWeight": 1, "commentWeight": 5.0, "correlationWithAti": 0, "note": "無數據可用"}
+  ati = df["ATI_final"].to_numpy(dtype=float)
+  correlations = [{"weight": w, "correlation": pearson(ati, engagement_for_weight(df, w))} for w in SCALING_WEIGHTS]
+  best = min(correlations, key=lambda item: abs(item["correlation"]))
+  return {
+    "likeWeight": 1,
+    "commentWeight": best["weight"],
+    "correlationWithAti": best["correlation"],
+    "note": f"留言權重估計為 {best['weight']:.1f}x 時，ATI 與互動表現的相關性最平衡。",
+    "allCorrelations": correlations,
+  }
+
+
+def build_tail_outliers(df: pd.DataFrame, limit: int = TAIL_OUTLIER_LIMIT) -> List[dict]:
+  top = df.iloc[np.argsort(-df["y"].to_numpy(), kind="stable")[:limit]]
+  dates = top["ftime_parsed"].str.extract(r"(\d{4}-\d{2}-\d{2})")[0].fillna("2025-01-01")
+  return [
+    {
+      "postId": f"{row.brand}_{rank}",
+      "brandName": row.brand,
+      "date": date,
+      "ati": float(row.ATI_final),
+      "novelty": float(row.novelty),
+      "diversity": float(row.diversity),
+      "likeCount": int(row.count_like),
+      "commentCount": int(row.count_comment),
+      "followerCount": float(row.followers),
+      "engagementRate": float(row.y),
+      "captionSnippet": row.caption[:100].replace("\n", " "),
+    }
+    for rank, (row, date) in enumerate(zip(top.itertuples(index=False), dates))
+  ]
+
+
+def build_tail_analysis(df: pd.DataFrame) -> dict:
+  train_brands = set(df.loc[df["split"] == "train", "brand"])
+  late_mask = ~df["brand"].isin(train_brands).to_numpy()
+  y = df["y"].to_numpy(dtype=float)
+  late_std = float(y[late_mask].std()) if late_mask.any() else 0.0
+  other_std = float(y[~late_mask].std()) if (~late_mask).any() else 0.0
+  extreme_count = math.ceil(len(y) * 0.05)
+  sorted_y = -np.sort(-y)
+  return {
+    "lateEntryBrandCount": int(df.loc[late_mask, "brand"].nunique()),
+    "lateEntryPostCount": int(late_mask.sum()),
+    "lateEntryStdDev": late_std,
+    "otherStdDev": other_std,
+    "stdDevRatio": late_std / other_std if other_std > 0 else 0,
+    "extremePostCount": int(extreme_count),
+    "extremePostThreshold": float(sorted_y[extreme_count - 1]) if extreme_count > 0 else 0,
+  }
+
+
+def materialize_market(scatter_rows: List[dict]) -> Tuple[str, Dict[str, object]]:
+  df = load_scored_frame()
+  stats = build_market_stats(scatter_rows, total_posts=len(df))
+  bundle: Dict[str, object] = {
+    "stats": stats,
+    "summary": {
+      "timeframeLabel": TIMEFRAME_LABEL,
+      **{key: stats[key] for key in ("totalBrands", "totalPosts", "avgAti", "highRiskBrandCount", "highRiskThreshold", "highRiskDefinition")},
+      "lastUpdated": datetime.now(timezone.utc).isoformat(),
+    },
+    "map_stats": build_market_map_stats(stats),
+    "trend": build_market_trend(df),
+    "correlation": build_correlation(df),
+    "deciles": build_deciles(df, edges=decile_edges()),
+    "engagement_scaling": build_engagement_scaling(df),
+    "tail_outliers": build_tail_outliers(df),
+    "tail_analysis": build_tail_analysis(df),
+  }
+  return artifact_version(), bundle
+
+
+def write_market_bundle(version: str, bundle: Dict[str, object]) -> Path:
+  version_dir = MARKET_DIR / version
+  version_dir.mkdir(parents=True, exist_ok=True)
+  for name, payload in bundle.items():
+    with (version_dir / f"{name}.json").open("w", encoding="utf-8") as f:
+      json.dump(payload, f, ensure_ascii=False)
+  latest = {
+    "version": version,
+    "generatedAt": datetime.now(timezone.utc).isoformat(),
+    "artifacts": sorted(bundle.keys()),
+  }
+  # Point readers at the new version only after every file is in place.
+  tmp_path = MARKET_LATEST_PATH.with_suffix(".tmp")
+  with tmp_path.open("w", encoding="utf-8") as f:
+    json.dump(latest, f, ensure_ascii=False, indent=2)
+  tmp_path.replace(MARKET_LATEST_PATH)
+  return version_dir
+
+
 def main() -> None:
   if not PER_POST_PATH.exists():
     raise FileNotFoundError(f"Missing file: {PER_POST_PATH}")
@@ -409,7 +734,7 @@ def main() -> None:
   stats = build_summary(posts)
 
   summary_payload = {
-    "timeframeLabel": "2025/04 – 2025/09",
+    "timeframeLabel": TIMEFRAME_LABEL,
     "totalBrands": stats.total_brands,
     "totalPosts": stats.total_posts,
     "avgAti": round(stats.avg_ati, 2),
@@ -438,11 +763,15 @@ def main() -> None:
   with CASE_STUDIES_PATH.open("w", encoding="utf-8") as f:
     json.dump(case_studies_payload, f, ensure_ascii=False, indent=2)
 
+  version, market_bundle = materialize_market(scatter_payload)
+  market_version_dir = write_market_bundle(version, market_bundle)
+
   print(f"Summary written to {SUMMARY_PATH.relative_to(ROOT_DIR)}")
   print(f"Scatter data written to {SCATTER_PATH.relative_to(ROOT_DIR)}")
   print(f"Brand rankings written to {BRAND_RANKINGS_PATH.relative_to(ROOT_DIR)}")
   print(f"Modality breakdown written to {MODALITY_BREAKDOWN_PATH.relative_to(ROOT_DIR)}")
   print(f"Case studies written to {CASE_STUDIES_PATH.relative_to(ROOT_DIR)}")
+  print(f"Market bundle ({len(market_bundle)} artifacts) written to {market_version_dir.relative_to(ROOT_DIR)}")
 
 
 if __name__ == "__main__":
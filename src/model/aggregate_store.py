@@ -0,0 +1,215 @@
+# src/model/aggregate_store.py
+"""
+增量的品牌彙總（SQLite，outputs/aggregates.sqlite）。
+
+每列是 (source, brand, metric, bucket) 的 n / sum / sumsq，bucket 為月份
+('YYYY-MM'，無時間則 'unknown')。任何打分路徑寫出 per-post 結果時，
+先在記憶體 groupby 成少量列，再在單一交易裡 UPSERT 累加；
+品牌排名、時間趨勢、ati_test_brand_agg.csv 的欄位都直接由彙總列算出，
+不必重讀 per-post 表。
+
+source：'train' / 'test'（model.py 全量重建）或 'infer'（infer_ati.py 逐批累加）。
+batch_id 有給時會記在 batches 表，同一批重送不會重複累加。
+"""
+import sqlite3, pathlib, argparse, json
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+BASE_DIR = "./src/model"
+AGG_DB = pathlib.Path(BASE_DIR) / "outputs" / "aggregates.sqlite"
+METRICS = ("ATI_final", "DS_final", "y",
+           "text_ATI", "image_ATI", "meta_ATI",
+           "text_DS", "image_DS", "meta_DS")
+# infer_ati.py 的欄位命名
+METRIC_ALIASES = {"DS_text": "text_DS", "DS_image": "image_DS", "DS_meta": "meta_DS"}
+UNKNOWN_BUCKET = "unknown"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agg (
+    source TEXT NOT NULL,
+    brand  TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    n      INTEGER NOT NULL,
+    sum    REAL NOT NULL,
+    sumsq  REAL NOT NULL,
+    PRIMARY KEY (source, brand, metric, bucket)
+);
+CREATE TABLE IF NOT EXISTS brands (
+    source     TEXT NOT NULL,
+    brand      TEXT NOT NULL,
+    late_entry INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, brand)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id   TEXT PRIMARY KEY,
+    source     TEXT NOT NULL,
+    n_rows     INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+UPSERT_AGG = """
+INSERT INTO agg (source, brand, metric, bucket, n, sum, sumsq) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (source, brand, metric, bucket) DO UPDATE SET
+    n = n + excluded.n, sum = sum + excluded.sum, sumsq = sumsq + excluded.sumsq
+"""
+UPSERT_BRAND = """
+INSERT INTO brands (source, brand, late_entry) VALUES (?, ?, ?)
+ON CONFLICT (source, brand) DO UPDATE SET late_entry = MAX(late_entry, excluded.late_entry)
+"""
+
+
+def month_bucket(values):
+    t = pd.to_datetime(pd.Series(values), errors="coerce")
+    return t.dt.strftime("%Y-%m").fillna(UNKNOWN_BUCKET).to_numpy()
+
+
+def brand_values(df, brand_col="brand"):
+    """品牌欄（去頭尾空白）；沒有這一欄時（例如 infer 的 CSV）全部歸到空字串品牌。"""
+    if brand_col not in df.columns:
+        return pd.Series("", index=df.index)
+    return df[brand_col].fillna("").astype(str).str.strip()
+
+
+def summarize(df, brand_col="brand", time_col="ftime_parsed", metrics=METRICS):
+    """per-post → (brand, metric, bucket, n, sum, sumsq) 列；缺值不計入。"""
+    df = df.rename(columns=METRIC_ALIASES)
+    base = pd.DataFrame({
+        "brand": brand_values(df, brand_col).to_numpy(),
+        "bucket": month_bucket(df[time_col]) if time_col in df.columns else UNKNOWN_BUCKET,
+    })
+    rows = []
+    for m in metrics:
+        if m not in df.columns:
+            continue
+        x = pd.to_numeric(df[m], errors="coerce").to_numpy(dtype=np.float64)
+        g = base.assign(x=x, xx=x * x)[np.isfinite(x)].groupby(["brand", "bucket"], sort=False)
+        stats = g.agg(n=("x", "size"), sum=("x", "sum"), sumsq=("xx", "sum")).reset_index()
+        rows += [(b, m, k, int(n), float(s), float(ss))
+                 for b, k, n, s, ss in stats.itertuples(index=False)]
+    return rows
+
+
+def _moments(frame):
+    n = frame["n"].to_numpy(dtype=np.float64)
+    mean = frame["sum"].to_numpy() / np.maximum(n, 1)
+    var = frame["sumsq"].to_numpy() / np.maximum(n, 1) - mean ** 2
+    return frame.assign(mean=mean, std=np.sqrt(np.maximum(var, 0.0)))
+
+
+class AggregateStore:
+    def __init__(self, path=AGG_DB):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @staticmethod
+    def _prepare(df, source, brand_col="brand", time_col="ftime_parsed", late_col="is_late_entry_brand"):
+        rows = summarize(df, brand_col=brand_col, time_col=time_col)
+        brands = brand_values(df, brand_col)
+        late = (pd.to_numeric(df[late_col], errors="coerce").fillna(0).astype(int)
+                if late_col in df.columns else pd.Series(0, index=df.index))
+        brand_rows = [(source, b, int(v)) for b, v in late.groupby(brands.to_numpy()).max().items()]
+        return rows, brand_rows
+
+    def _apply(self, source, rows, brand_rows):
+        """呼叫端負責交易（with self.conn）。"""
+        self.conn.executemany(UPSERT_AGG, [(source, *r) for r in rows])
+        self.conn.executemany(UPSERT_BRAND, brand_rows)
+
+    def update(self, df, source, brand_col="brand", time_col="ftime_parsed",
+               late_col="is_late_entry_brand", batch_id=None):
+        """累加一批打分結果（單一交易）；batch_id 已處理過則回傳 False。"""
+        rows, brand_rows = self._prepare(df, source, brand_col, time_col, late_col)
+        with self.conn:
+            if batch_id is not None:
+                seen = self.conn.execute("SELECT 1 FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+                if seen:
+                    return False
+                self.conn.execute("INSERT INTO batches VALUES (?, ?, ?, ?)",
+                                  (batch_id, source, len(df), datetime.now(timezone.utc).isoformat()))
+            self._apply(source, rows, brand_rows)
+        return True
+
+    def replace_source(self, df, source, brand_col="brand", time_col="ftime_parsed",
+                       late_col="is_late_entry_brand"):
+        """全量重建某個 source（model.py 重跑時用），刪除與寫入在同一交易。"""
+        rows, brand_rows = self._prepare(df, source, brand_col, time_col, late_col)
+        with self.conn:
+            self.conn.execute("DELETE FROM agg WHERE source = ?", (source,))
+            self.conn.execute("DELETE FROM brands WHERE source = ?", (source,))
+            self.conn.execute("DELETE FROM batches WHERE source = ?", (source,))
+            self._apply(source, rows, brand_rows)
+        return True
+
+    def _query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def _sources_clause(self, sources):
+        sources = [sources] if isinstance(sources, str) else list(sources)
+        return f"source IN ({','.join('?' * len(sources))})", sources
+
+    def brand_stats(self, metric="ATI_final", sources=("test",)):
+        where, params = self._sources_clause(sources)
+        frame = self._query(
+            f"SELECT brand, SUM(n) AS n, SUM(sum) AS sum, SUM(sumsq) AS sumsq "
+            f"FROM agg WHERE metric = ? AND {where} GROUP BY brand", (metric, *params))
+        return _moments(frame)
+
+    def brand_agg(self, sources=("test",)):
+        """與 ati_test_brand_agg.csv 相同欄位。"""
+        ati = self.brand_stats("ATI_final", sources)
+        out = pd.DataFrame({"brand": ati["brand"], "n_posts": ati["n"].astype(int), "ATI_final_mean": ati["mean"]})
+        for metric, col in (("DS_final", "DS_final_mean"), ("y", "y_mean")):
+            s = self.brand_stats(metric, sources)
+            out = out.merge(s[["brand", "mean"]].rename(columns={"mean": col}), on="brand", how="left")
+        where, params = self._sources_clause(sources)
+        late = self._query(f"SELECT brand, MAX(late_entry) AS late_entry_brand FROM brands WHERE {where} GROUP BY brand", params)
+        return out.merge(late, on="brand", how="left").fillna({"late_entry_brand": 0})
+
+    def brand_ranking(self, metric="ATI_final", sources=("test",), top=None, ascending=False, min_posts=1):
+        frame = self.brand_stats(metric, sources)
+        frame = frame[frame["n"] >= min_posts].sort_values("mean", ascending=ascending, kind="stable")
+        return (frame if top is None else frame.head(top)).reset_index(drop=True)
+
+    def trend(self, metric="ATI_final", sources=("train", "test"), brand=None):
+        """依月份的 n / mean / std；brand=None 為全市場。"""
+        where, params = self._sources_clause(sources)
+        brand_sql, brand_params = ("AND brand = ?", (brand,)) if brand is not None else ("", ())
+        frame = self._query(
+            f"SELECT bucket, SUM(n) AS n, SUM(sum) AS sum, SUM(sumsq) AS sumsq FROM agg "
+            f"WHERE metric = ? AND {where} {brand_sql} AND bucket != ? GROUP BY bucket ORDER BY bucket",
+            (metric, *params, *brand_params, UNKNOWN_BUCKET))
+        return _moments(frame)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查詢增量品牌彙總")
+    parser.add_argument("--ranking", type=str, default=None, help="依此 metric 排名品牌")
+    parser.add_argument("--trend", type=str, default=None, help="此 metric 的月趨勢")
+    parser.add_argument("--sources", type=str, default="test")
+    parser.add_argument("--brand", type=str, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    sources = args.sources.split(",")
+    with AggregateStore() as store:
+        if args.ranking:
+            frame = store.brand_ranking(args.ranking, sources, top=args.top)
+        elif args.trend:
+            frame = store.trend(args.trend, sources, brand=args.brand)
+        else:
+            frame = store.brand_agg(sources)
+        print(json.dumps(frame.to_dict(orient="records"), ensure_ascii=False))
@@ -0,0 +1,95 @@
+# src/model/anchor_index.py
+"""
+大量錨點（K 數千）的兩層索引：coarse 中心（約 √K 個）底下掛 fine 錨點。
+
+查詢時先算 n 筆 × C 個 coarse 的 sims，只展開最相近的 n_probe 個 coarse 格，
+每筆查詢約 C + n_probe·K/C = O(√K) 次內積，回傳 top-k sims 給
+novelty（取最大值）與 diversity（top-k 上的 softmax entropy）使用。
+"""
+import math, pathlib
+import numpy as np
+
+from spherical_kmeans import spherical_kmeans
+
+_EPS = 1e-9
+
+
+def _norm_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + _EPS)
+
+
+class AnchorIndex:
+    def __init__(self, coarse, fine, offsets):
+        """
+        coarse : [C, d] coarse 中心（L2-normalized）
+        fine   : [K, d] fine 錨點，依所屬 coarse 格排序
+        offsets: [C+1]  第 c 格的 fine 錨點為 fine[offsets[c]:offsets[c+1]]
+        """
+        self.coarse = np.asarray(coarse, dtype=np.float32)
+        self.fine = np.asarray(fine, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @property
+    def n_fine(self): return int(self.fine.shape[0])
+
+    @property
+    def n_coarse(self): return int(self.coarse.shape[0])
+
+    @classmethod
+    def build(cls, X, k_fine, k_coarse=None, sample_weight=None, random_state=None, mode='minibatch'):
+        """以球面 K-means 擬合 k_fine 個錨點，再把錨點本身分成 k_coarse（預設 √K）格。"""
+        fine, _ = spherical_kmeans(X, k_fine, sample_weight=sample_weight, mode=mode,
+                                   batch_size=max(1024, 4 * k_fine), random_state=random_state)
+        if k_coarse is None:
+            k_coarse = max(1, int(round(math.sqrt(k_fine))))
+        k_coarse = min(k_coarse, k_fine)
+        coarse, _ = spherical_kmeans(fine, k_coarse, mode='full', random_state=random_state)
+        labels = (fine @ coarse.T).argmax(axis=1)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(k_coarse + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=k_coarse))
+        return cls(coarse, fine[order], offsets)
+
+    def query(self, X, topk=32, n_probe=None):
+        """
+        回傳 [n, topk] 的 top-k cosine sims（每列遞減排序）。
+        n_probe 預設為 max(2, C/8)；n_probe == C 時等同暴力全掃。
+        沒有足夠候選時以 -1 補齊（cosine 下界，不影響 max，softmax 權重趨近 0）。
+        """
+        Xn = _norm_rows(X)
+        n = Xn.shape[0]
+        C = self.n_coarse
+        n_probe = max(2, C // 8) if n_probe is None else n_probe
+        n_probe = min(n_probe, C)
+        sizes = np.diff(self.offsets)
+        max_cell = int(sizes.max()) if C else 0
+        topk = min(topk, self.n_fine)
+
+        sims_c = Xn @ self.coarse.T                                  # [n, C]
+        if n_probe < C:
+            probe = np.argpartition(-sims_c, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probe = np.broadcast_to(np.arange(C), (n, C))
+        cand = np.full((n, max(n_probe * max_cell, topk)), -1.0, dtype=np.float32)
+        # 依 coarse 格分批：同一格的查詢一起對該格 fine 錨點做 GEMM
+        for j in range(n_probe):
+            col = probe[:, j]
+            for c in np.unique(col):
+                lo, hi = self.offsets[c], self.offsets[c + 1]
+                if hi == lo:
+                    continue
+                rows = np.flatnonzero(col == c)
+                base = j * max_cell
+                cand[rows, base:base + (hi - lo)] = Xn[rows] @ self.fine[lo:hi].T
+        if cand.shape[1] > topk:
+            cand = np.partition(cand, cand.shape[1] - topk, axis=1)[:, -topk:]
+        return -np.sort(-cand, axis=1)[:, :topk]
+
+    def save(self, path):
+        np.savez(pathlib.Path(path), coarse=self.coarse, fine=self.fine, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        z = np.load(pathlib.Path(path))
+        return cls(z["coarse"], z["fine"], z["offsets"])
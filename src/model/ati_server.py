@@ -0,0 +1,354 @@
+# src/model/ati_server.py
+"""
+給內部 Python 工作直接呼叫的 asyncio HTTP 打分服務（不經過 Express）。
+
+  POST /score        {"text", "rel_img", "similar", "deadline", "timings"} → compute_ati_single 的 JSON
+  POST /score/variants {"rel_img", "captions": [...]} → 同一張圖多個 caption 的排名
+  POST /score/bulk   {"posts": [{"sum", "rel_img_paths", "ftime_parsed", "brand"}, ...]}
+                     或每行一篇的 NDJSON；以 chunked NDJSON 回傳，每批完成就送出
+  GET  /health       模型產物版本、已載入的元件
+  GET  /metrics      請求計數、in-flight、排程器各 class 的佇列深度 / 等待時間；
+                     ?format=prometheus 或 Accept: text/plain 時輸出 Prometheus 文字格式
+                     （含 instrument span 的累計）
+
+/score、/score/variants 帶 "timings": true 時，回應的 timings.spans 附上這個請求的 span。
+
+- 模型運算都交給 infer_ati 的 PriorityScheduler（/score 為 interactive、/score/bulk
+  為 bulk 批次），event loop 只負責 I/O
+- 同時處理的打分請求上限 MAX_INFLIGHT；QUEUE_TIMEOUT_S 內拿不到名額回 503 + Retry-After
+- 串流時每行都 await drain()，客戶端讀得慢時不會把結果堆在記憶體
+- 一條連線一個請求（Connection: close）
+
+python src/model/ati_server.py --port 8765
+curl -s localhost:8765/score -d '{"text": "芒果冰沙"}'
+"""
+import json, time, asyncio, argparse, datetime, functools
+from urllib.parse import parse_qs
+import pandas as pd
+
+import infer_ati
+import instrument
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_INFLIGHT = 8
+QUEUE_TIMEOUT_S = 5.0
+MAX_BODY_BYTES = 32 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _row_result(i, row, version):
+    return {
+        "index": int(i),
+        "artifact_version": version,
+        "brand": row.get("brand"),
+        "ati": float(row["ATI_final"]),
+        "components": {k: float(row[k]) for k in ("DS_text", "DS_image", "DS_meta", "DS_final")},
+        "ocr_text": row.get("ocr_text", ""),
+    }
+
+
+def parse_json_object(body):
+    try:
+        req = json.loads(body or b"{}")
+    except json.JSONDecodeError as e:
+        raise HTTPError(400, f"invalid JSON: {e}")
+    if not isinstance(req, dict):
+        raise HTTPError(400, "body must be a JSON object")
+    return req
+
+
+def int_field(req, key, default):
+    """非負整數欄位；接受數字或數字字串，其他值回 400。"""
+    value = req.get(key, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{key} must be a non-negative integer")
+    if value < 0:
+        raise HTTPError(400, f"{key} must be a non-negative integer")
+    return value
+
+
+def deadline_field(req):
+    """deadline（秒）：省略或 null 為不限時；其他必須是正數。"""
+    value = req.get("deadline")
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "deadline must be a positive number of seconds")
+    if not value > 0 or value == float("inf"):
+        raise HTTPError(400, "deadline must be a positive number of seconds")
+    return value
+
+
+def rel_img_field(req):
+    value = req.get("rel_img")
+    if value is not None and not isinstance(value, str):
+        raise HTTPError(400, "rel_img must be a string")
+    return value or None
+
+
+def parse_bulk_body(body):
+    """{"posts": [...]}、JSON 陣列或 NDJSON → DataFrame（sum / rel_img_paths / ftime_parsed / brand）。"""
+    text = body.decode("utf-8").strip()
+    if not text:
+        raise HTTPError(400, "empty body")
+    try:
+        payload = json.loads(text)
+        posts = payload.get("posts") if isinstance(payload, dict) else payload
+    except json.JSONDecodeError:
+        try:
+            posts = [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise HTTPError(400, f"invalid JSON / NDJSON: {e}")
+    if not isinstance(posts, list) or not all(isinstance(p, dict) for p in posts):
+        raise HTTPError(400, "posts must be a list of objects")
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return pd.DataFrame({
+        "brand": [p.get("brand") for p in posts],
+        "sum": [str(p.get("sum", p.get("text", "")) or "") for p in posts],
+        "rel_img_paths": [p.get("rel_img_paths", p.get("rel_img")) or "" for p in posts],
+        "ftime_parsed": [p.get("ftime_parsed") or now for p in posts],
+    })
+
+
+class ATIServer:
+    def __init__(self, host=HOST, port=PORT, max_inflight=MAX_INFLIGHT, queue_timeout_s=QUEUE_TIMEOUT_S,
+                 bulk_batch=infer_ati.BULK_BATCH_ROWS, sock=None):
+        self.host, self.port = host, port
+        self.sock = sock
+        self.max_inflight = max_inflight
+        self.queue_timeout_s = queue_timeout_s
+        self.bulk_batch = bulk_batch
+        self.started = time.time()
+        self.counters = {"requests": 0, "errors": 0, "rejected": 0, "posts_scored": 0}
+        self.inflight = 0
+        self._slots = None
+        self._server = None
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        if self.sock is not None:
+            # prefork：各 worker 共用父程序建立的 listening socket
+            self._server = await asyncio.start_server(self._handle, sock=self.sock)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    # ---------- HTTP ----------
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        path, _, qs = target.partition("?")
+        query = {k: v[-1] for k, v in parse_qs(qs).items()}
+        return method.upper(), path, query, headers, body
+
+    async def _respond(self, writer, status, payload, extra_headers=(), content_type="application/json; charset=utf-8"):
+        body = payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}", "Connection: close", *extra_headers]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            req = await self._read_request(reader)
+            if req is None:
+                return
+            method, path, query, headers, body = req
+            self.counters["requests"] += 1
+            route = {("POST", "/score"): self._score, ("POST", "/score/bulk"): self._score_bulk,
+                     ("POST", "/score/variants"): self._score_variants,
+                     ("GET", "/health"): self._health, ("GET", "/metrics"): self._metrics}.get((method, path))
+            if route is None:
+                known = {"/score", "/score/bulk", "/score/variants", "/health", "/metrics"}
+                raise HTTPError(405 if path in known else 404, f"{method} {path}")
+            await route(writer, body, query, headers)
+        except HTTPError as e:
+            self.counters["errors"] += 1
+            extra = ("Retry-After: 1",) if e.status == 503 else ()
+            await self._respond(writer, e.status, {"error": str(e)}, extra)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.counters["errors"] += 1
+            await self._respond(writer, 500, {"error": "python_error", "detail": str(e)})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _acquire(self):
+        """拿不到 in-flight 名額就回 503，讓呼叫端退避，而不是無限排隊。"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.counters["rejected"] += 1
+            raise HTTPError(503, "server busy")
+        self.inflight += 1
+
+    def _release(self):
+        self.inflight -= 1
+        self._slots.release()
+
+    # ---------- routes ----------
+    async def _run_interactive(self, want_timings, fn, *args, **kwargs):
+        """排進 interactive 佇列並等結果；want_timings 時在請求自己的 recorder 下執行。"""
+        await self._acquire()
+        try:
+            if not want_timings:
+                return await asyncio.wrap_future(infer_ati.get_scheduler().submit_interactive(fn, *args, **kwargs))
+            with instrument.record() as rec:
+                fut = infer_ati.get_scheduler().submit_interactive(fn, *args, **kwargs)
+            result = await asyncio.wrap_future(fut)
+            result.setdefault("timings", {})["spans"] = rec.to_dict()
+            return result
+        finally:
+            self._release()
+
+    async def _score(self, writer, body, query, headers):
+        req = parse_json_object(body)
+        text, rel_img = str(req.get("text", "") or ""), rel_img_field(req)
+        if not text and not rel_img:
+            raise HTTPError(400, "text or rel_img required")
+        similar, deadline = int_field(req, "similar", 5), deadline_field(req)
+        result = await self._run_interactive(bool(req.get("timings")), infer_ati.compute_ati_single, text, rel_img,
+                                             top_n_similar=similar, deadline_s=deadline)
+        self.counters["posts_scored"] += 1
+        await self._respond(writer, 200, result)
+
+    async def _score_variants(self, writer, body, query, headers):
+        req = parse_json_object(body)
+        captions = req.get("captions")
+        if not isinstance(captions, list) or not captions or not all(isinstance(c, str) for c in captions):
+            raise HTTPError(400, "captions must be a non-empty list of strings")
+        rel_img, deadline = rel_img_field(req), deadline_field(req)
+        result = await self._run_interactive(bool(req.get("timings")), infer_ati.compute_ati_variants,
+                                             rel_img, captions, deadline_s=deadline)
+        self.counters["posts_scored"] += len(captions)
+        await self._respond(writer, 200, result)
+
+    async def _score_bulk(self, writer, body, query, headers):
+        df = parse_bulk_body(body)
+        await self._acquire()
+        pending = []
+        try:
+            batches = [df.iloc[i:i + self.bulk_batch] for i in range(0, len(df), self.bulk_batch)]
+            bundle = infer_ati.get_bundle()
+            score = functools.partial(infer_ati.compute_ati_for_df, bundle=bundle)
+            pending = infer_ati.get_scheduler().map_bulk(score, batches)
+            futures = [asyncio.wrap_future(f) for f in pending]
+            writer.write(("HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                          "Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n").encode("latin-1"))
+            for done in asyncio.as_completed(futures):
+                try:
+                    out = await done
+                    lines = [_row_result(i, row, bundle.version) for i, row in zip(out.index, out.to_dict("records"))]
+                except Exception as e:
+                    lines = [{"error": "python_error", "detail": str(e)}]
+                chunk = "".join(json.dumps(l, ensure_ascii=False) + "\n" for l in lines).encode("utf-8")
+                writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+                await writer.drain()
+                self.counters["posts_scored"] += sum("ati" in l for l in lines)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # 客戶端中途斷線時，還在佇列中的批次不必再跑
+            for f in pending:
+                f.cancel()
+            self._release()
+
+    async def _health(self, writer, body, query, headers):
+        artifacts = infer_ati.get_bundle_manager().status()
+        await self._respond(writer, 200, {
+            "status": "ok",
+            "uptime_s": round(time.time() - self.started, 1),
+            "artifact_version": artifacts["artifact_version"],
+            "artifacts": artifacts,
+            "loaded": sorted(infer_ati._COMPONENTS),
+        })
+
+    def _prometheus(self):
+        lines = []
+        def gauge(name, help_text, samples, kind="gauge"):
+            lines.extend([f"# HELP ati_server_{name} {help_text}", f"# TYPE ati_server_{name} {kind}"])
+            lines.extend(f"ati_server_{name}{labels} {value}" for labels, value in samples)
+        for key in ("requests", "errors", "rejected", "posts_scored"):
+            gauge(f"{key}_total", f"Server {key.replace('_', ' ')} since start", [("", self.counters[key])], "counter")
+        gauge("inflight", "Scoring requests currently holding a slot", [("", self.inflight)])
+        classes = infer_ati.get_scheduler().stats()["classes"]
+        gauge("queue_depth", "Queued scheduler work per priority class",
+              [(f'{{class="{c}"}}', s["queue_depth"]) for c, s in classes.items()])
+        gauge("queue_wait_p95_seconds", "p95 queue wait per priority class",
+              [(f'{{class="{c}"}}', s["wait_p95_s"]) for c, s in classes.items()])
+        return "\n".join(lines) + "\n" + instrument.prometheus_text()
+
+    async def _metrics(self, writer, body, query, headers):
+        if query.get("format") == "prometheus" or "text/plain" in headers.get("accept", ""):
+            await self._respond(writer, 200, self._prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+            return
+        await self._respond(writer, 200, {
+            **self.counters,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "scheduler": infer_ati.get_scheduler().stats(),
+            "load_times": dict(infer_ati.LOAD_TIMES),
+            "spans": instrument.METRICS.to_dict()["spans"],
+        })
+
+
+async def main(args):
+    if args.warmup:
+        await asyncio.get_running_loop().run_in_executor(None, infer_ati.warmup)
+    infer_ati.get_bundle_manager().watch(infer_ati.BUNDLE_POLL_S)
+    server = await ATIServer(args.host, args.port, args.max_inflight, bulk_batch=args.bulk_batch).start()
+    print(json.dumps({"listening": f"http://{server.host}:{server.port}"}), flush=True)
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="asyncio HTTP 打分服務（/score、/score/bulk、/health、/metrics）")
+    parser.add_argument("--host", type=str, default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max_inflight", type=int, default=MAX_INFLIGHT)
+    parser.add_argument("--bulk_batch", type=int, default=infer_ati.BULK_BATCH_ROWS)
+    parser.add_argument("--warmup", action="store_true", help="載入所有模型元件後才開始接受連線")
+    args = parser.parse_args()
+    asyncio.run(main(args))
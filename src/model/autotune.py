@@ -0,0 +1,214 @@
+# src/model/autotune.py
+"""
+本機推論設定的自動調校（batch size、長度排序分批、torch 執行緒數、eager / bf16）。
+
+- 以 train / test CSV 的 caption 與 input_images 中的圖片為樣本，分別對
+  embed_text_clip、embed_images_clip 跑格點；每個設定量每批延遲（p95）與吞吐量
+- bf16 autocast 的嵌入與 eager 比對，最小 cosine 低於 MIN_COSINE 的設定不採用
+- 在 p95 延遲 ≤ latency cap 的設定中取吞吐量最高者（都超過時取 p95 最低者）
+- 結果寫到 host_profiles/<hostname>.json；infer_ati.get_host_profile() 載入時自動套用
+  （ATI_HOST_PROFILE 環境變數可指定其他檔案）。沒有 profile 時的預設值與原本寫死的
+  batch_size=128 起跳、逐張圖片嵌入相同
+- max_length 固定 64（改變它會改變嵌入本身），只調「依長度排序分批」減少 padding
+- ONNX Runtime 不在此 repo 的相依中，不列入格點
+
+python src/model/autotune.py --latency_ms 300
+"""
+import os, json, time, socket, pathlib, argparse
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+BASE_DIR = "./src/model"
+PROFILE_DIR = pathlib.Path(BASE_DIR) / "host_profiles"
+SAMPLE_CSVS = (f"{BASE_DIR}/with_rel_paths_train_posts.csv", f"{BASE_DIR}/with_rel_paths_test_posts.csv")
+DEFAULT_PROFILE = {
+    "text_batch_size": 128,
+    "image_batch_size": 1,
+    "threads": None,
+    "packing": False,
+    "text_backend": "eager",
+    "image_backend": "eager",
+}
+BACKENDS = ("eager", "bf16")
+TEXT_BATCH_SIZES = (8, 16, 32, 64, 128)
+IMAGE_BATCH_SIZES = (1, 2, 4, 8, 16)
+MIN_COSINE = 0.995
+LATENCY_CAP_MS = 500.0
+
+
+def profile_path(host=None):
+    env = os.environ.get("ATI_HOST_PROFILE")
+    if env and host is None:
+        return pathlib.Path(env)
+    return PROFILE_DIR / f"{host or socket.gethostname()}.json"
+
+
+def load_profile(path=None):
+    """預設值 + profile 檔的 "config"（檔案不存在時就是預設值）。"""
+    path = pathlib.Path(path) if path else profile_path()
+    prof = dict(DEFAULT_PROFILE)
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            prof.update(json.load(f).get("config", {}))
+    return prof
+
+
+def save_profile(config, measurements, path=None):
+    path = pathlib.Path(path) if path else profile_path()
+    os.makedirs(path.parent, exist_ok=True)
+    payload = {
+        "host": socket.gethostname(),
+        "cpu_count": os.cpu_count(),
+        "tuned_at": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "measurements": measurements,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def default_thread_grid():
+    cores = os.cpu_count() or 1
+    grid = [1 << i for i in range(cores.bit_length()) if (1 << i) <= cores]
+    return tuple(sorted(set(grid + [cores])))
+
+
+# ---------- 樣本 ----------
+def sample_captions(n, csvs=SAMPLE_CSVS):
+    caps = pd.concat([pd.read_csv(p, usecols=["sum"]) for p in csvs if os.path.exists(p)], ignore_index=True)["sum"]
+    caps = caps.fillna("").astype(str)
+    caps = caps[caps.str.strip() != ""]
+    return caps.sample(n=min(n, len(caps)), random_state=0).tolist()
+
+
+def sample_images(n, csvs=SAMPLE_CSVS):
+    import infer_ati
+    rels = pd.concat([pd.read_csv(p, usecols=["rel_img_paths"]) for p in csvs if os.path.exists(p)],
+                     ignore_index=True)["rel_img_paths"]
+    ims = []
+    for cell in rels:
+        for rp in infer_ati.parse_rel_img_paths(cell):
+            p = infer_ati.resolve_image_path(rp, infer_ati.IMG_DIR)
+            im = infer_ati.load_image_for_clip(p) if p else None
+            if im is not None:
+                ims.append(im)
+            if len(ims) >= n:
+                return ims
+    return ims
+
+
+# ---------- 量測 ----------
+def _measure(fn, items, batch_size):
+    """先跑一批暖機，再逐批計時；回傳 (各批延遲秒數, 吞吐量 items/s, 輸出)。"""
+    fn(items[:batch_size])
+    lat, outs = [], []
+    for i in range(0, len(items), batch_size):
+        t0 = time.perf_counter()
+        outs.append(fn(items[i:i + batch_size]))
+        lat.append(time.perf_counter() - t0)
+    return lat, len(items) / max(sum(lat), 1e-9), np.vstack(outs)
+
+
+def _row(kind, config, lat, throughput, cosine):
+    return {
+        "kind": kind,
+        **config,
+        "p50_ms": round(float(np.percentile(lat, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(lat, 95)) * 1000, 2),
+        "throughput": round(throughput, 2),
+        "min_cosine": None if cosine is None else round(cosine, 5),
+    }
+
+
+def _min_cosine(a, b):
+    return float(np.min(np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-9)))
+
+
+def tune_text(captions, threads_grid, batch_sizes=TEXT_BATCH_SIZES, backends=BACKENDS):
+    import infer_ati
+    torch = infer_ati.get_torch()
+    rows, reference = [], None
+    for threads in threads_grid:
+        torch.set_num_threads(threads)
+        for backend in backends:
+            for packing in (False, True):
+                for bs in batch_sizes:
+                    fn = lambda xs: infer_ati.embed_text_clip(xs, batch_size=bs, packing=packing, backend=backend)
+                    try:
+                        lat, thr, out = _measure(fn, captions, bs)
+                    except RuntimeError as e:
+                        rows.append({"kind": "text", "threads": threads, "backend": backend, "packing": packing,
+                                     "batch_size": bs, "error": str(e)[:200]})
+                        continue
+                    if reference is None and backend == "eager":
+                        reference = out
+                    cos = _min_cosine(out, reference) if backend != "eager" and reference is not None else None
+                    rows.append(_row("text", {"threads": threads, "backend": backend, "packing": packing,
+                                              "batch_size": bs}, lat, thr, cos))
+    return rows
+
+
+def tune_images(images, threads, batch_sizes=IMAGE_BATCH_SIZES, backends=BACKENDS):
+    import infer_ati
+    infer_ati.get_torch().set_num_threads(threads)
+    rows, reference = [], None
+    for backend in backends:
+        for bs in batch_sizes:
+            fn = lambda xs: infer_ati.embed_images_clip(xs, backend=backend)
+            try:
+                lat, thr, out = _measure(fn, images, bs)
+            except RuntimeError as e:
+                rows.append({"kind": "image", "threads": threads, "backend": backend, "batch_size": bs,
+                             "error": str(e)[:200]})
+                continue
+            if reference is None and backend == "eager":
+                reference = out
+            cos = _min_cosine(out, reference) if backend != "eager" and reference is not None else None
+            rows.append(_row("image", {"threads": threads, "backend": backend, "batch_size": bs}, lat, thr, cos))
+    return rows
+
+
+def pick(rows, latency_cap_ms):
+    """p95 ≤ cap 且精度合格的設定中吞吐量最高者；都超過 cap 時取 p95 最低者。"""
+    ok = [r for r in rows if "error" not in r and (r["min_cosine"] is None or r["min_cosine"] >= MIN_COSINE)]
+    if not ok:
+        return None
+    within = [r for r in ok if r["p95_ms"] <= latency_cap_ms]
+    return max(within, key=lambda r: r["throughput"]) if within else min(ok, key=lambda r: r["p95_ms"])
+
+
+def run(latency_cap_ms=LATENCY_CAP_MS, n_texts=256, n_images=32, threads_grid=None,
+        batch_sizes=TEXT_BATCH_SIZES, image_batch_sizes=IMAGE_BATCH_SIZES, save=True):
+    threads_grid = threads_grid or default_thread_grid()
+    text_rows = tune_text(sample_captions(n_texts), threads_grid, batch_sizes)
+    best_text = pick(text_rows, latency_cap_ms)
+    if best_text is None:
+        raise RuntimeError("所有文字嵌入設定都失敗，無法產生 host profile")
+    config = dict(DEFAULT_PROFILE, threads=best_text["threads"], text_batch_size=best_text["batch_size"],
+                  packing=best_text["packing"], text_backend=best_text["backend"])
+    images = sample_images(n_images)
+    image_rows = tune_images(images, best_text["threads"], image_batch_sizes) if images else []
+    best_image = pick(image_rows, latency_cap_ms)
+    if best_image is not None:
+        config.update(image_batch_size=best_image["batch_size"], image_backend=best_image["backend"])
+    measurements = {"latency_cap_ms": latency_cap_ms, "text": text_rows, "image": image_rows}
+    path = save_profile(config, measurements) if save else None
+    return {"config": config, "profile": str(path) if path else None, "text_best": best_text, "image_best": best_image}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="對 embed_text_clip / embed_images_clip 跑格點並寫入 host profile")
+    parser.add_argument("--latency_ms", type=float, default=LATENCY_CAP_MS, help="每批 p95 延遲上限（毫秒）")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--threads", type=str, default=None, help="逗號分隔，例如 1,2,4,8（預設 2 的冪次到核心數）")
+    parser.add_argument("--batch_sizes", type=str, default=",".join(map(str, TEXT_BATCH_SIZES)))
+    parser.add_argument("--image_batch_sizes", type=str, default=",".join(map(str, IMAGE_BATCH_SIZES)))
+    parser.add_argument("--dry_run", action="store_true", help="只輸出結果，不寫 profile")
+    args = parser.parse_args()
+    ints = lambda s: tuple(int(x) for x in s.split(","))
+    report = run(args.latency_ms, args.texts, args.images, ints(args.threads) if args.threads else None,
+                 ints(args.batch_sizes), ints(args.image_batch_sizes), save=not args.dry_run)
+    print(json.dumps(report, ensure_ascii=False))
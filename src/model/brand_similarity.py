@@ -0,0 +1,112 @@
+# src/model/brand_similarity.py
+"""
+品牌相似度離線計算（model.py 打分後執行）。
+
+以 feature store 中真實的 CLIP / meta 嵌入建立每個品牌、每個模態的質心，
+各模態質心 L2 normalize 後乘上 √權重串接，一次 GEMM 就得到加權平均的
+brand×brand cosine 矩陣；每個品牌保留 top-K 鄰居，寫成 JSON + .npy，
+/api/brand/:brandName/similar 直接查表。
+"""
+import os, json, pathlib, argparse
+import numpy as np
+
+import feature_store
+
+BASE_DIR = "./src/model"
+SIM_DIR = pathlib.Path(BASE_DIR) / "outputs" / "brand_similarity"
+MODALITIES = ("text", "image", "meta")
+TOP_K = 10
+
+_EPS = 1e-9
+
+
+def _norm_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + _EPS)
+
+
+def load_modal_vectors(splits=("train", "test")):
+    """合併多個 split；回傳 brands [n] 與 {modality: [n, d]}（每列已 L2 normalize）。"""
+    brands, vecs = [], {m: [] for m in MODALITIES}
+    for split in splits:
+        if not feature_store.feature_path(split).exists():
+            continue
+        f = feature_store.load_split(split, fields=("brand", "cap_emb", "ocr_emb", "img_emb", "meta_vec"))
+        brands.append(f["brand"])
+        vecs["text"].append(_norm_rows(feature_store.text_vectors(f)))
+        vecs["image"].append(_norm_rows(f["img_emb"]))
+        vecs["meta"].append(_norm_rows(f["meta_vec"]))
+    if not brands:
+        raise FileNotFoundError("feature store 是空的，請先執行 model.py")
+    return np.concatenate(brands), {m: np.vstack(v) for m, v in vecs.items()}
+
+
+def brand_centroids(brands, vecs):
+    """
+    每品牌每模態的質心（單位向量平均後再 normalize）。
+    零向量列（例如無圖片）不計入；某品牌某模態完全沒有資料時質心為零向量。
+    """
+    names, inv = np.unique(brands, return_inverse=True)
+    B = len(names)
+    cents = {}
+    for m, X in vecs.items():
+        valid = (np.linalg.norm(X, axis=1) > 0.5).astype(np.float32)
+        # one-hot [B, n] @ X 一次求和
+        onehot = np.zeros((B, len(X)), dtype=np.float32)
+        onehot[inv, np.arange(len(X))] = valid
+        cents[m] = _norm_rows(onehot @ X)
+    return names, cents
+
+
+def similarity_matrix(cents, weights):
+    """串接 √w·質心後一次 GEMM：S = Σ_m w_m · cos_m / Σ_m w_m（缺資料的模態貢獻 0）。"""
+    w = np.array([weights[m] for m in MODALITIES], dtype=np.float32)
+    w = w / (w.sum() + _EPS)
+    Z = np.hstack([np.sqrt(w[i]) * cents[m] for i, m in enumerate(MODALITIES)])
+    return (Z @ Z.T).astype(np.float32)
+
+
+def top_k_neighbors(names, S, cents, k=TOP_K):
+    B = len(names)
+    k = min(k, B - 1)
+    out = {}
+    S_off = S.copy()
+    np.fill_diagonal(S_off, -np.inf)
+    top = np.argpartition(-S_off, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((B, 0), dtype=np.int64)
+    for i in range(B):
+        idx = top[i][np.argsort(-S_off[i, top[i]])]
+        out[str(names[i])] = [
+            {"brand": str(names[j]), "similarity": round(float(S[i, j]), 6),
+             **{m: round(float(cents[m][i] @ cents[m][j]), 6) for m in MODALITIES}}
+            for j in idx
+        ]
+    return out
+
+
+def build(splits=("train", "test"), weights=None, k=TOP_K, out_dir=SIM_DIR):
+    weights = weights or {m: 1.0 for m in MODALITIES}
+    brands, vecs = load_modal_vectors(splits)
+    names, cents = brand_centroids(brands, vecs)
+    S = similarity_matrix(cents, weights)
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(pathlib.Path(out_dir) / "brand_sim.npy", S)
+    payload = {
+        "brands": [str(b) for b in names],
+        "weights": weights,
+        "splits": list(splits),
+        "topK": int(k),
+        "neighbors": top_k_neighbors(names, S, cents, k=k),
+    }
+    with open(pathlib.Path(out_dir) / "brand_neighbors.json", "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    return payload
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="預先計算品牌相似度矩陣與 top-K 鄰居")
+    parser.add_argument("--top_k", type=int, default=TOP_K)
+    parser.add_argument("--weights", type=str, default="1,1,1", help="text,image,meta 權重")
+    args = parser.parse_args()
+    w = [float(x) for x in args.weights.split(",")]
+    payload = build(weights=dict(zip(MODALITIES, w)), k=args.top_k)
+    print(f"{len(payload['brands'])} brands → {SIM_DIR}")
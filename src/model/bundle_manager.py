@@ -0,0 +1,148 @@
+# src/model/bundle_manager.py
+"""
+長時間執行的打分程序中，ati_artifacts 的熱切換。
+
+- 指標檔（outputs/active_artifacts.json，{"art_dir": "...", "promoted_at": "..."}）指向目前要用的
+  產物目錄；升級新模型 = 寫好產物後改指標檔（寫暫存檔再 os.replace）。model.py 一律重訓進
+  同一個 outputs/ati_artifacts，所以重新 promote 同一個目錄（只有 promoted_at 改變）也會觸發檢查
+- watch() 起一個背景執行緒，每 poll_s 秒檢查指標檔；art_dir 或 promoted_at 變了就在背景載入，
+  內容雜湊（ArtifactBundle.version）與目前相同時不切換；不同時 validate(new, old) 通過後才
+  替換 current（單一參考的指派，請求之間原子切換）
+- 每個請求開始時取一次 current() 並一路用到結束，進行中的請求繼續用舊 bundle，
+  舊物件在沒有人參考後自然回收；CLIP 模型不受影響
+- 驗證失敗時保留舊 bundle，錯誤記在 status()["last_error"]
+"""
+import os, json, pathlib, threading
+from datetime import datetime, timezone
+
+
+def read_pointer_record(path):
+    """指標檔內容（至少有 art_dir）；檔案不存在或無法解析時為 None。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        return record if isinstance(record, dict) and record.get("art_dir") else None
+    except (OSError, ValueError):
+        return None
+
+
+def read_pointer(path):
+    """指標檔指向的產物目錄；檔案不存在或無法解析時為 None。"""
+    record = read_pointer_record(path)
+    return record["art_dir"] if record else None
+
+
+def _signature(record):
+    return (record["art_dir"], record.get("promoted_at")) if record else None
+
+
+def write_pointer(path, art_dir):
+    path = pathlib.Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"art_dir": str(art_dir), "promoted_at": datetime.now(timezone.utc).isoformat()}, f)
+    os.replace(tmp, path)
+
+
+class BundleManager:
+    def __init__(self, loader, pointer_path, default_dir, validate=None):
+        self.loader = loader
+        self.pointer_path = pathlib.Path(pointer_path)
+        self.default_dir = str(default_dir)
+        self.validate = validate
+        self._lock = threading.Lock()
+        self._current = None
+        self._art_dir = None
+        self._seen = None
+        self._loaded_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def current(self):
+        if self._current is None:
+            with self._lock:
+                if self._current is None:
+                    record = read_pointer_record(self.pointer_path)
+                    self._seen = _signature(record)
+                    art_dir = record["art_dir"] if record else self.default_dir
+                    self._install(self.loader(art_dir), art_dir)
+        return self._current
+
+    def _install(self, bundle, art_dir):
+        self._art_dir = art_dir
+        self._loaded_at = datetime.now(timezone.utc).isoformat()
+        self._current = bundle
+
+    def set(self, bundle):
+        """直接指定 bundle（例如 CLI 的 --artifacts），之後的指標檔變更仍會觸發重新載入。"""
+        with self._lock:
+            self._seen = _signature(read_pointer_record(self.pointer_path))
+            self._install(bundle, str(bundle.art_dir))
+
+    def check(self):
+        """指標檔（目錄或 promoted_at）變了就載入；內容雜湊不同且驗證通過才切換。回傳是否切換。"""
+        record = read_pointer_record(self.pointer_path)
+        signature = _signature(record)
+        if signature is None or signature == self._seen:
+            return False
+        old = self.current()
+        self._seen = signature  # 同一個指標內容只處理一次；驗證失敗要重新 promote 才會再載入
+        art_dir = record["art_dir"]
+        try:
+            new = self.loader(art_dir)
+            if new.version == old.version:
+                return False
+            if self.validate is not None:
+                self.validate(new, old)
+        except Exception as e:
+            with self._lock:
+                self.rejected += 1
+                self.last_error = f"{art_dir}: {e}"
+            return False
+        with self._lock:
+            self._install(new, art_dir)
+            self.reloads += 1
+            self.last_error = None
+        return True
+
+    def watch(self, poll_s=2.0):
+        if self._thread is not None:
+            return self
+        def _loop():
+            while not self._stop.wait(poll_s):
+                self.check()
+        self._thread = threading.Thread(target=_loop, name="bundle-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        b = self._current
+        return {
+            "artifact_version": b.version if b is not None else None,
+            "art_dir": self._art_dir,
+            "loaded_at": self._loaded_at,
+            "pointer": str(self.pointer_path),
+            "watching": self._thread is not None,
+            "reloads": self.reloads,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="把指標檔指向新的 ati_artifacts 目錄（執行中的服務會在背景載入並切換）")
+    parser.add_argument("art_dir", type=str)
+    parser.add_argument("--pointer", type=str, default=str(pathlib.Path("./src/model") / "outputs" / "active_artifacts.json"))
+    args = parser.parse_args()
+    if not (pathlib.Path(args.art_dir) / "config.json").exists():
+        raise SystemExit(f"{args.art_dir} 中沒有 config.json")
+    write_pointer(args.pointer, args.art_dir)
+    print(json.dumps({"pointer": args.pointer, "art_dir": args.art_dir}))
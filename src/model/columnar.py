@@ -0,0 +1,152 @@
+# src/model/columnar.py
+"""
+Per-post 輸出的欄式格式。
+
+- 有 pyarrow 時寫 Parquet；沒有則退回 numpy .npz（每欄一個陣列，讀取時逐欄解壓）
+- 分數欄位（*_nov / *_div / *_DS / *_ATI / ATI_final / DS_final）存 float32
+- brand 以字典編碼（Parquet dictionary / npz 的 codes + categories）
+- 長文字欄位（caption、ocr_text）另存 <base>_text.*，只看分數時不必讀進來
+
+讀取端 read_per_post(base, columns=[...]) 只載入需要的欄位。
+"""
+import os, pathlib, re
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+TEXT_COLUMNS = ("caption", "ocr_text")
+DICT_COLUMNS = ("brand",)
+SCORE_PAT = re.compile(r'(_nov|_div|_DS|_ATI)$|^(ATI_final|DS_final)$')
+
+
+def _paths(base):
+    base = pathlib.Path(base)
+    base = base.with_name(base.name.removesuffix(".csv"))
+    return {
+        "parquet": base.with_name(base.name + ".parquet"),
+        "parquet_text": base.with_name(base.name + "_text.parquet"),
+        "npz": base.with_name(base.name + ".npz"),
+        "npz_text": base.with_name(base.name + "_text.npz"),
+    }
+
+
+def _encode(df):
+    out = df.copy()
+    for c in out.columns:
+        if SCORE_PAT.search(c):
+            out[c] = pd.to_numeric(out[c], errors="coerce").astype(np.float32)
+        elif c in DICT_COLUMNS:
+            out[c] = out[c].astype("category")
+    return out
+
+
+def _write_npz(df, path):
+    arrays = {}
+    for c in df.columns:
+        col = df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            arrays[f"{c}__codes"] = col.cat.codes.to_numpy(dtype=np.int32)
+            arrays[f"{c}__categories"] = np.asarray([str(x) for x in col.cat.categories])
+        elif pd.api.types.is_numeric_dtype(col):
+            arrays[c] = col.to_numpy()
+        else:
+            arrays[c] = np.asarray(["" if x is None or x != x else str(x) for x in col])
+    np.savez(path, **arrays)
+
+
+def _read_npz(path, columns=None):
+    with np.load(path) as z:
+        names = []
+        for k in z.files:
+            name = k.split("__")[0]
+            if name not in names:
+                names.append(name)
+        wanted = names if columns is None else [c for c in columns if c in names]
+        data = {}
+        for c in wanted:
+            if f"{c}__codes" in z.files:
+                data[c] = pd.Categorical.from_codes(z[f"{c}__codes"], categories=z[f"{c}__categories"])
+            else:
+                data[c] = z[c]
+        return pd.DataFrame(data)
+
+
+def write_per_post(df, base, text_columns=TEXT_COLUMNS, fmt=None):
+    """
+    base: 輸出路徑（可含 .csv 副檔名，會自動去掉）
+    fmt : 'parquet' / 'npz'；預設有 pyarrow 用 parquet
+    回傳實際寫出的檔案路徑 list
+    """
+    fmt = fmt or ("parquet" if HAS_ARROW else "npz")
+    p = _paths(base)
+    os.makedirs(p["npz"].parent, exist_ok=True)
+    text_cols = [c for c in text_columns if c in df.columns]
+    scores = _encode(df.drop(columns=text_cols))
+    texts = df[text_cols].fillna("").astype(str)
+    if fmt == "parquet":
+        scores.to_parquet(p["parquet"], index=False)
+        written = [p["parquet"]]
+        if text_cols:
+            texts.to_parquet(p["parquet_text"], index=False)
+            written.append(p["parquet_text"])
+    elif fmt == "npz":
+        _write_npz(scores, p["npz"])
+        written = [p["npz"]]
+        if text_cols:
+            _write_npz(texts, p["npz_text"])
+            written.append(p["npz_text"])
+    else:
+        raise ValueError(f"未知的欄式格式：{fmt}")
+    return written
+
+
+def exists(base):
+    p = _paths(base)
+    return p["parquet"].exists() or p["npz"].exists()
+
+
+def _columns(path):
+    """檔案裡實際有的欄位名稱（不解開資料）。"""
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    with np.load(path) as z:
+        return list(dict.fromkeys(k.split("__")[0] for k in z.files))
+
+
+def _read_parquet(path, columns=None):
+    if columns is not None:
+        names = set(_columns(path))
+        columns = [c for c in columns if c in names]
+    return pd.read_parquet(path, columns=columns)
+
+
+def read_per_post(base, columns=None):
+    """
+    columns=None 讀全部（含文字檔）；否則只讀需要的欄位，
+    不需要文字欄位時只看 _text 檔的欄位清單，不解開資料。
+    """
+    p = _paths(base)
+    if p["parquet"].exists():
+        main, text, reader = p["parquet"], p["parquet_text"], _read_parquet
+    elif p["npz"].exists():
+        main, text, reader = p["npz"], p["npz_text"], _read_npz
+    else:
+        raise FileNotFoundError(f"找不到欄式輸出：{p['parquet']} / {p['npz']}")
+    text_names = _columns(text) if text.exists() else []
+    want_text = text_names if columns is None else [c for c in columns if c in text_names]
+    want_main = None if columns is None else [c for c in columns if c not in text_names]
+    parts = []
+    if want_main is None or want_main:
+        parts.append(reader(main, want_main).reset_index(drop=True))
+    if want_text:
+        parts.append(reader(text, want_text).reset_index(drop=True))
+    frame = pd.concat(parts, axis=1) if parts else pd.DataFrame()
+    if columns is not None:
+        frame = frame[[c for c in columns if c in frame.columns]]
+    return frame
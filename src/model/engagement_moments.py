@@ -0,0 +1,194 @@
+# src/model/engagement_moments.py
+"""
+留言權重 w 的相關係數查詢（充分統計量）。
+
+y(w) = (likes + w·comments) / (followers + 0.01) = a + w·b，
+其中 a = likes / (followers + 0.01)、b = comments / (followers + 0.01)。
+所以對任一分數 x：
+
+    Pearson(x, y(w)) = (C_xa + w·C_xb) / sqrt(C_xx · (C_aa + 2w·C_ab + w²·C_bb))
+
+只要每組（split × brand）預先存好 (x_1..x_m, a, b) 的平均與中心化共變異
+矩陣，任何 w 都是 O(1)。Spearman 無封閉解，改為預先在 w 網格上算好精確值，
+查詢時線性內插。輸出 JSON 給儀表板直接使用。
+"""
+import os, json, pathlib, argparse
+import numpy as np
+import pandas as pd
+
+BASE_DIR = "./src/model"
+OUT_DIR = pathlib.Path(BASE_DIR) / "outputs"
+EXPORT_PATH = pathlib.Path("./src/data/generated") / "engagement_moments.json"
+METRICS = ("ATI_final", "DS_final", "text_DS", "image_DS", "meta_DS")
+SPLITS = ("train", "test")
+ALL = "__all__"
+SPEARMAN_GRID = tuple(np.round(np.arange(0.0, 20.0 + 1e-9, 0.25), 4))
+MIN_SPEARMAN_N = 3
+
+
+class Moments:
+    """(x_1..x_m, a, b) 的 n、平均、中心化共變異和（co-moment）；可合併（Chan et al.）。"""
+    def __init__(self, n, mean, comoment):
+        self.n = int(n)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.comoment = np.asarray(comoment, dtype=np.float64)
+
+    @classmethod
+    def from_columns(cls, Z):
+        Z = np.asarray(Z, dtype=np.float64)
+        mean = Z.mean(axis=0)
+        Zc = Z - mean
+        return cls(len(Z), mean, Zc.T @ Zc)
+
+    def merge(self, other):
+        if self.n == 0: return other
+        if other.n == 0: return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        mean = self.mean + delta * (other.n / n)
+        com = self.comoment + other.comoment + np.outer(delta, delta) * (self.n * other.n / n)
+        return Moments(n, mean, com)
+
+    def pearson(self, w, i=0):
+        """第 i 個分數欄位與 y(w) 的 Pearson；a、b 為最後兩欄。"""
+        C = self.comoment
+        a, b = -2, -1
+        cov = C[i, a] + w * C[i, b]
+        var_y = C[a, a] + 2 * w * C[a, b] + w * w * C[b, b]
+        denom = np.sqrt(max(C[i, i], 0.0) * max(var_y, 0.0))
+        return float(cov / denom) if denom > 0 else 0.0
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean.tolist(), "comoment": self.comoment.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["n"], d["mean"], d["comoment"])
+
+
+def engagement_parts(df):
+    f = df["followers"].to_numpy(dtype=np.float64)
+    f = np.where(np.isfinite(f) & (f != 0), f, 0.01) + 0.01  # 同 Node：(followers || 0.01) + 0.01
+    a = df["count_like"].fillna(0).to_numpy(dtype=np.float64) / f
+    b = df["count_comment"].fillna(0).to_numpy(dtype=np.float64) / f
+    return a, b
+
+
+def _spearman_grid(x, a, b, grid=SPEARMAN_GRID):
+    """各 w 的精確 Spearman（平均名次）；x 的名次只算一次。"""
+    rx = pd.Series(x).rank().to_numpy()
+    rx = rx - rx.mean()
+    out = []
+    for w in grid:
+        ry = pd.Series(a + w * b).rank().to_numpy()
+        ry = ry - ry.mean()
+        denom = np.sqrt((rx @ rx) * (ry @ ry))
+        out.append(float(rx @ ry / denom) if denom > 0 else 0.0)
+    return out
+
+
+class MomentTable:
+    def __init__(self, metrics, groups, spearman, grid=SPEARMAN_GRID):
+        """groups: {(split, brand): Moments}；spearman: {(split, brand): {metric: [grid values]}}"""
+        self.metrics = list(metrics)
+        self.groups = groups
+        self.spearman = spearman
+        self.grid = np.asarray(grid, dtype=np.float64)
+
+    @classmethod
+    def build(cls, frames, metrics=METRICS, grid=SPEARMAN_GRID):
+        """frames: {split: per-post DataFrame}；另外合併出 split = '__all__'。"""
+        groups, spearman = {}, {}
+        per_split = {}
+        # 各 split 共用同一組欄位順序（只取每個 split 都有的指標）
+        metrics = [m for m in metrics if all(m in df.columns for df in frames.values())]
+        for split, df in frames.items():
+            a, b = engagement_parts(df)
+            Z = np.column_stack([df[m].to_numpy(dtype=np.float64) for m in metrics] + [a, b])
+            brands = df["brand"].astype(str).to_numpy()
+            per_split[split] = (Z, brands)
+        for split, (Z, brands) in per_split.items():
+            groups[(split, ALL)] = Moments.from_columns(Z)
+            for brand in np.unique(brands):
+                groups[(split, brand)] = Moments.from_columns(Z[brands == brand])
+        # 全部 split 合併：直接 merge moments，不必重掃
+        for key in [k for k in groups if k[0] != ALL]:
+            merged_key = (ALL, key[1])
+            groups[merged_key] = groups[key] if merged_key not in groups else groups[merged_key].merge(groups[key])
+        all_Z = np.vstack([Z for Z, _ in per_split.values()])
+        all_brands = np.concatenate([br for _, br in per_split.values()])
+        for (split, brand) in groups:
+            Z, br = (all_Z, all_brands) if split == ALL else per_split[split]
+            rows = Z if brand == ALL else Z[br == brand]
+            if len(rows) < MIN_SPEARMAN_N:
+                continue
+            spearman[(split, brand)] = {m: _spearman_grid(rows[:, i], rows[:, -2], rows[:, -1], grid)
+                                        for i, m in enumerate(metrics)}
+        return cls(metrics, groups, spearman, grid)
+
+    def correlation(self, w, split=ALL, brand=ALL, metric="ATI_final"):
+        """O(1)：Pearson 由 moments 直接算，Spearman 由 w 網格內插（超出網格取端點）。"""
+        mom = self.groups.get((split, brand))
+        if mom is None:
+            raise KeyError(f"沒有 ({split}, {brand}) 的統計量")
+        i = self.metrics.index(metric)
+        grid_vals = self.spearman.get((split, brand), {}).get(metric)
+        spearman = float(np.interp(w, self.grid, grid_vals)) if grid_vals else None
+        return {"weight": float(w), "correlation": mom.pearson(w, i), "spearman": spearman, "n": mom.n}
+
+    def curve(self, weights, **kw):
+        return [self.correlation(w, **kw) for w in weights]
+
+    def to_dict(self):
+        return {
+            "formula": "y(w) = (likes + w*comments) / (followers + 0.01)",
+            "metrics": self.metrics,
+            "columns": self.metrics + ["a", "b"],
+            "spearmanGrid": self.grid.tolist(),
+            "groups": [
+                {"split": s, "brand": b, **m.to_dict(),
+                 "spearman": self.spearman.get((s, b))}
+                for (s, b), m in sorted(self.groups.items())
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        groups = {(g["split"], g["brand"]): Moments.from_dict(g) for g in d["groups"]}
+        spearman = {(g["split"], g["brand"]): g["spearman"] for g in d["groups"] if g.get("spearman")}
+        return cls(d["metrics"], groups, spearman, d["spearmanGrid"])
+
+
+def load_split_frames(out_dir=OUT_DIR):
+    import columnar
+    cols = ["brand", "count_like", "count_comment", "followers", *METRICS]
+    frames = {}
+    for split in SPLITS:
+        base = pathlib.Path(out_dir) / f"ati_{split}_per_post.csv"
+        if columnar.exists(base):
+            frames[split] = columnar.read_per_post(base, columns=cols)
+        elif base.exists():
+            frames[split] = pd.read_csv(base, usecols=lambda c: c in cols)
+    if not frames:
+        raise FileNotFoundError(f"{out_dir} 中找不到 per-post 輸出，請先執行 model.py")
+    return frames
+
+
+def build_and_export(out_dir=OUT_DIR, export_path=EXPORT_PATH):
+    table = MomentTable.build(load_split_frames(out_dir))
+    os.makedirs(pathlib.Path(export_path).parent, exist_ok=True)
+    with open(export_path, "w", encoding="utf-8") as f:
+        json.dump(table.to_dict(), f, ensure_ascii=False)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="預先計算留言權重相關係數的充分統計量")
+    parser.add_argument("--weight", type=float, action="append", help="查詢的留言權重（可重複）")
+    parser.add_argument("--brand", type=str, default=ALL)
+    parser.add_argument("--split", type=str, default=ALL)
+    parser.add_argument("--metric", type=str, default="ATI_final")
+    args = parser.parse_args()
+    table = build_and_export()
+    for row in table.curve(args.weight or [1, 5, 10], split=args.split, brand=args.brand, metric=args.metric):
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,52 @@
+# src/model/feature_store.py
+"""
+訓練期三模態特徵的落地儲存（每個 split 一個 .npz）。
+
+model.py 算完嵌入後寫入，之後的索引、品牌相似度、市場地圖等離線工作
+直接讀這裡，不必重跑 OCR / CLIP。字串欄位以 numpy unicode 陣列存放，
+讀取不需要 allow_pickle。
+"""
+import os, pathlib
+import numpy as np
+
+BASE_DIR = "./src/model"
+FEATURE_DIR = pathlib.Path(BASE_DIR) / "outputs" / "features"
+
+VECTOR_FIELDS = ("cap_emb", "ocr_emb", "img_emb", "meta_vec")
+TEXT_FIELDS = ("brand", "caption", "ftime_parsed")
+
+
+def feature_path(split, feature_dir=FEATURE_DIR):
+    return pathlib.Path(feature_dir) / f"features_{split}.npz"
+
+
+def save_split(split, brand, caption, ftime_parsed, cap_emb, ocr_emb, img_emb, meta_vec, feature_dir=FEATURE_DIR):
+    """所有陣列需同樣列數；向量一律存成 float32。"""
+    n = len(brand)
+    arrays = {"cap_emb": cap_emb, "ocr_emb": ocr_emb, "img_emb": img_emb, "meta_vec": meta_vec}
+    for k, v in arrays.items():
+        if len(v) != n:
+            raise ValueError(f"feature_store: {k} 列數 {len(v)} 與 brand 列數 {n} 不符")
+    os.makedirs(feature_dir, exist_ok=True)
+    np.savez(
+        feature_path(split, feature_dir),
+        **{k: np.asarray(v, dtype=np.float32) for k, v in arrays.items()},
+        brand=np.asarray([str(x) for x in brand]),
+        caption=np.asarray(["" if x is None or x != x else str(x) for x in caption]),
+        ftime_parsed=np.asarray(["" if x is None or x != x else str(x) for x in ftime_parsed]),
+    )
+
+
+def load_split(split, fields=None, feature_dir=FEATURE_DIR):
+    """fields=None 載入全部；npz 為延遲讀取，只會解開要求的欄位。"""
+    path = feature_path(split, feature_dir)
+    if not path.exists():
+        raise FileNotFoundError(f"找不到特徵檔 {path}，請先執行 model.py")
+    with np.load(path) as z:
+        names = list(z.files) if fields is None else list(fields)
+        return {k: z[k] for k in names}
+
+
+def text_vectors(feats):
+    """Text 模態 = caption ⊕ OCR 嵌入（與 model.py / infer_ati.py 一致）。"""
+    return np.hstack([feats["cap_emb"], feats["ocr_emb"]]).astype(np.float32)
@@ -1,15 +1,22 @@
 # src/model/infer_ati.py
-import os, sys, json, argparse, datetime
-import ast, joblib, re, pathlib, math
+import os, sys, json, argparse, datetime, time, threading, importlib, functools, subprocess
+import ast, joblib, re, pathlib, math, hashlib
 import numpy as np
 import pandas as pd
-import easyocr
 from PIL import Image, UnidentifiedImageError
-import torch
-from transformers import (
-    CLIPModel, CLIPProcessor,
-    ChineseCLIPModel, ChineseCLIPProcessor,
-)
+from anchor_index import AnchorIndex
+from post_index import PostIndex, INDEX_DIR as POST_INDEX_DIR, index_version
+import columnar
+import quantile_sketch
+import aggregate_store
+import model_snapshot
+import autotune
+import result_cache
+import bundle_manager
+import instrument
+from stage_graph import StageGraph, summarize as summarize_stages
+import scheduler
+from concurrent.futures import ThreadPoolExecutor
 
 # ---------- existing constants (kept) ----------
 BASE_DIR = "./src/model"
@@ -26,24 +33,54 @@ def has_any(text, keywords):
     low = text.lower()
     return int(any(kw in low for kw in keywords))
 
-def load_artifacts():
+def load_artifacts(art_dir=ART_DIR):
     centers = {
-        "text":  np.load(ART_DIR / "centers_text.npy"),
-        "image": np.load(ART_DIR / "centers_image.npy"),
-        "meta":  np.load(ART_DIR / "centers_meta.npy"),
+        "text":  np.load(art_dir / "centers_text.npy"),
+        "image": np.load(art_dir / "centers_image.npy"),
+        "meta":  np.load(art_dir / "centers_meta.npy"),
     }
-    scaler = joblib.load(ART_DIR / "numeric_scaler.joblib")
-    with open(ART_DIR / "config.json", "r", encoding="utf-8") as f:
+    scaler = joblib.load(art_dir / "numeric_scaler.joblib")
+    with open(art_dir / "config.json", "r", encoding="utf-8") as f:
         cfg = json.load(f)
     return centers, scaler, cfg
 
+def load_anchor_indexes(cfg, art_dir=ART_DIR):
+    """大 K 兩層索引（訓練時 ANCHOR_INDEX_K > 0 才會存在）；回傳 {modality: AnchorIndex}。"""
+    if not cfg.get("ANCHOR_INDEX"): return {}
+    return {m: AnchorIndex.load(art_dir / f"anchor_index_{m}.npz")
+            for m in ("text", "image", "meta") if (art_dir / f"anchor_index_{m}.npz").exists()}
+
+def artifact_version(art_dir=ART_DIR):
+    """artifact 目錄內容的 sha1 前 12 碼（與 scripts/generate_summary.py 相同算法）。"""
+    digest = hashlib.sha1()
+    for path in sorted(p for p in pathlib.Path(art_dir).iterdir() if p.is_file()):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+_POST_INDEX = (None, None)
+def get_post_index():
+    """歷史貼文近鄰索引（outputs/post_index）；不存在時回傳 None。
+    程序內快取，index_version 改變（索引重建）時重新載入。"""
+    global _POST_INDEX
+    version = index_version(POST_INDEX_DIR)
+    if not version:
+        return None
+    if _POST_INDEX[0] != version:
+        _POST_INDEX = (version, PostIndex.load(POST_INDEX_DIR))
+    return _POST_INDEX[1]
+
 def _norm_rows(x): n = np.linalg.norm(x, axis=1, keepdims=True) + 1e-9; return (x / n).astype(np.float32)
 def _softmax_rows(x, tau):
     z = (x - x.max(axis=1, keepdims=True)) / max(tau, 1e-8)
     e = np.exp(z); return e / (e.sum(axis=1, keepdims=True) + 1e-9)
 
-def compute_DS_for_modality(X, centers, wN, wD, nov_min, nov_max, tau):
-    Xn = _norm_rows(X); sims = Xn @ centers.T
+def compute_DS_for_modality(X, centers, wN, wD, nov_min, nov_max, tau, topk_sims=None):
+    """topk_sims: 大 K 索引查詢得到的 [n, k] top-k sims；給定時不再對全部 centers 做內積。"""
+    if topk_sims is None:
+        Xn = _norm_rows(X); sims = Xn @ centers.T
+    else:
+        sims = np.asarray(topk_sims, dtype=np.float32)
     max_sim = sims.max(axis=1)
     nov_raw = 1.0 - max_sim
     if nov_max - nov_min < 1e-9:
@@ -67,13 +104,30 @@ def parse_rel_img_paths(cell):
     if ',' in s: return [x.strip() for x in s.split(',') if x.strip()]
     return [s]
 
-    reader = easyocr.Reader(['ch_tra','en'], gpu=False)
+def resolve_image_path(rp, base_dir):
+    if rp is None: return None
+    p = os.path.join(base_dir, rp)
+    if os.path.exists(p): return p
+    p2 = os.path.join(base_dir, os.path.basename(rp))
+    return p2 if os.path.exists(p2) else None
 
 def ocr_single_image(p):
-    try: return " ".join([r.strip() for r in reader.readtext(p, detail=0, paragraph=True) if isinstance(r, str)])
+    try: return " ".join([r.strip() for r in get_ocr_reader().readtext(p, detail=0, paragraph=True) if isinstance(r, str)])
     except Exception: return ""
 
-def ocr_post(rel_paths, base_dir, cache_key):
+def ocr_cache_key(paths):
+    """以圖片內容雜湊當快取鍵：同一張圖換檔名也命中，不同請求的圖不會互相覆蓋。"""
+    h = hashlib.sha1()
+    for p in paths:
+        with open(p, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def ocr_post(rel_paths, base_dir, cache_key=None):
+    """沒有可讀圖片時直接回傳 ""，不載入 OCR 模型。"""
+    paths = [p for p in (resolve_image_path(rp, base_dir) for rp in rel_paths[:OCR_MAX_IMAGES]) if p]
+    if not paths: return ""
+    cache_key = cache_key or ocr_cache_key(paths)
     cache_file = os.path.join(CACHE_DIR, f'ocr_{cache_key}.json')
     if os.path.exists(cache_file):
         try:
@@ -81,14 +135,10 @@ def ocr_post(rel_paths, base_dir, cache_key):
                 return json.load(f).get('text','')
         except Exception: pass
     texts = []
-    for rp in rel_paths[:OCR_MAX_IMAGES]:
-        p = os.path.join(base_dir, rp)
-        if not os.path.exists(p):
-            p2 = os.path.join(base_dir, os.path.basename(rp))
-            if os.path.exists(p2): p = p2
-            else: continue
-        t = ocr_single_image(p)
-        if t: texts.append(t)
+    with instrument.span("ocr", items=len(paths)):
+        for p in paths:
+            t = ocr_single_image(p)
+            if t: texts.append(t)
     final_text = " ".join(texts).strip()
     with open(cache_file,'w',encoding='utf-8') as f:
         json.dump({'text':final_text}, f, ensure_ascii=False)
@@ -109,6 +159,7 @@ CTA_WORDS    = ['快來','立刻','今天','現在','一起','打卡','留言','
 PRICE_PAT    = r'(nt\$|n\$|\$|元)\s*\d+'
 PCT_PAT      = r'\d+\s*%'
 
+@instrument.timed("numeric_features", items=lambda df, *a: len(df))
 def build_numeric_features(df, text_col, ocr_col, time_col):
     caps = df[text_col].fillna('').astype(str)
     ocrs = df[ocr_col].fillna('').astype(str) if (ocr_col and ocr_col in df.columns) else pd.Series(['']*len(df), index=df.index)
@@ -137,143 +188,537 @@ def build_numeric_features(df, text_col, ocr_col, time_col):
     feat['time_sin'] = np.sin(2*np.pi*hours/24); feat['time_cos'] = np.cos(2*np.pi*hours/24)
     return pd.DataFrame(feat, index=df.index)
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
+# ---------- lazily loaded inference components ----------
+# 匯入本模組不載入 torch / transformers / easyocr；各元件第一次用到時才載入，
+# 純文字請求不會碰到 OCR 與 image processor。LOAD_TIMES 記錄每個元件的載入秒數。
 MODEL_BACKEND='chinese-clip'; MODEL_ID_CN='OFA-Sys/chinese-clip-vit-base-patch16'; MODEL_ID_EN='openai/clip-vit-base-patch32'
-if MODEL_BACKEND == 'chinese-clip':
-    clip_model = ChineseCLIPModel.from_pretrained(MODEL_ID_CN).to(device)
-    clip_processor = ChineseCLIPProcessor.from_pretrained(MODEL_ID_CN)
-    PROJ_DIM = clip_model.config.projection_dim
-else:
-    clip_model = CLIPModel.from_pretrained(MODEL_ID_EN).to(device)
-    clip_processor = CLIPProcessor.from_pretrained(MODEL_ID_EN)
-    PROJ_DIM = clip_model.config.projection_dim
-
-@torch.no_grad()
-def embed_text_clip(texts, batch_size=64, max_length=64, device_override=None, use_fp16=True):
-    dev = device_override if device_override is not None else device
+MODEL_ID = MODEL_ID_CN if MODEL_BACKEND == 'chinese-clip' else MODEL_ID_EN
+COMPONENTS = ("torch", "tokenizer", "clip_model", "image_processor", "ocr", "empty_text_emb")
+
+_COMPONENTS = {}
+_COMPONENT_LOCKS = {name: threading.Lock() for name in COMPONENTS + ("device", "snapshot", "bundle_manager", "scheduler", "host_profile", "result_cache")}
+LOAD_TIMES = {}
+
+def _component(name, loader):
+    if name in _COMPONENTS: return _COMPONENTS[name]
+    with _COMPONENT_LOCKS[name]:
+        if name not in _COMPONENTS:
+            t0 = time.perf_counter()
+            _COMPONENTS[name] = loader()
+            LOAD_TIMES[name] = round(time.perf_counter() - t0, 4)
+    return _COMPONENTS[name]
+
+def get_host_profile():
+    """autotune 產生的本機設定（host_profiles/<hostname>.json）；沒有時為與原本相同的預設值。"""
+    return _component("host_profile", autotune.load_profile)
+
+def _load_torch():
+    torch = importlib.import_module("torch")
+    threads = get_host_profile().get("threads")
+    if threads:
+        torch.set_num_threads(int(threads))
+    return torch
+
+def get_torch():
+    return _component("torch", _load_torch)
+
+def get_device():
+    return _component("device", lambda: 'cuda' if get_torch().cuda.is_available() else 'cpu')
+
+def get_snapshot():
+    """--prepare_models 記錄的本地權重快照；沒有時為 None，改從 hub 載入。"""
+    return _component("snapshot", lambda: model_snapshot.snapshot_info(art_dir=ART_DIR))
+
+def _pretrained_source():
+    snap = get_snapshot()
+    return (snap["clip_dir"], {"local_files_only": True}) if snap else (MODEL_ID, {})
+
+def _load_clip_model():
+    dev = get_device()
+    from transformers import CLIPModel, ChineseCLIPModel
+    cls = ChineseCLIPModel if MODEL_BACKEND == 'chinese-clip' else CLIPModel
+    snap = get_snapshot()
+    if snap and snap.get("state_file") and model_snapshot.USE_STATE_FILE:
+        return model_snapshot.load_clip_from_state(cls, snap, dev)
+    src, kw = _pretrained_source()
+    return cls.from_pretrained(src, **kw).to(dev)
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    src, kw = _pretrained_source()
+    return AutoTokenizer.from_pretrained(src, **kw)
+
+def _load_image_processor():
+    from transformers import AutoImageProcessor
+    src, kw = _pretrained_source()
+    return AutoImageProcessor.from_pretrained(src, **kw)
+
+def _load_ocr_reader():
+    import easyocr
+    snap = get_snapshot()
+    if snap:
+        return easyocr.Reader(snap["ocr_langs"], gpu=False, model_storage_directory=snap["ocr_dir"], download_enabled=False)
+    return easyocr.Reader(['ch_tra','en'], gpu=False)
+
+def get_clip_model(): return _component("clip_model", _load_clip_model)
+def get_tokenizer(): return _component("tokenizer", _load_tokenizer)
+def get_image_processor(): return _component("image_processor", _load_image_processor)
+def get_ocr_reader(): return _component("ocr", _load_ocr_reader)
+
+def proj_dim(): return get_clip_model().config.projection_dim
+
+_LOADERS = {"torch": get_torch, "tokenizer": get_tokenizer, "clip_model": get_clip_model,
+            "image_processor": get_image_processor, "ocr": get_ocr_reader,
+            "empty_text_emb": lambda: get_empty_text_embedding()}
+
+def warmup(components=COMPONENTS):
+    """預先載入指定元件；回傳 {component: 載入秒數}（已載入過的沿用第一次的時間）。"""
+    for name in components:
+        _LOADERS[name]()
+    return {name: LOAD_TIMES.get(name) for name in components}
+
+class _nullctx:
+    def __enter__(self): return None
+    def __exit__(self, *args): return False
+
+def _autocast(torch, dev, use_fp16, backend):
+    if dev == "cuda" and use_fp16: return torch.amp.autocast('cuda', dtype=torch.float16)
+    if dev == "cpu" and backend == "bf16": return torch.amp.autocast('cpu', dtype=torch.bfloat16)
+    return _nullctx()
+
+@instrument.timed("text_embedding", items=lambda texts, *a, **k: len(texts))
+def embed_text_clip(texts, batch_size=None, max_length=64, device_override=None, use_fp16=True, packing=None, backend=None):
+    """batch_size / packing / backend 未指定時用 host profile。
+    packing：依長度排序後分批，同一批 padding 較少；輸出仍依輸入順序。"""
+    torch = get_torch(); model = get_clip_model(); tokenizer = get_tokenizer()
+    prof = get_host_profile()
+    batch_size = batch_size or prof["text_batch_size"]
+    packing = prof["packing"] if packing is None else packing
+    backend = backend or prof["text_backend"]
+    dev = device_override if device_override is not None else get_device()
+    cleaned = [ (s if isinstance(s, str) and s.strip() != "" else "。")[:512] for s in texts ]
+    order = np.argsort([len(s) for s in cleaned], kind="stable") if packing else np.arange(len(cleaned))
     feats_all = []
-    for i in range(0, len(texts), batch_size):
-        raw_chunk = texts[i:i+batch_size]
-        chunk = [ (s if isinstance(s, str) and s.strip() != "" else "。")[:512] for s in raw_chunk ]
-        inputs = clip_processor(text=chunk, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
-        if inputs["input_ids"].numel() == 0:
-            feats_all.append(np.zeros((len(chunk), PROJ_DIM), dtype=np.float32)); continue
-        inputs = {k: v.to(dev) for k, v in inputs.items()}
-        class _nullctx:
-            def __enter__(self): return None
-            def __exit__(self, *args): return False
-        ctx = torch.amp.autocast('cuda', dtype=torch.float16) if (dev == "cuda" and use_fp16) else _nullctx()
-        with ctx:
-            try:
-                feats = clip_model.get_text_features(**inputs)
-            except TypeError:
-                out = []
-                for j in range(inputs["input_ids"].shape[0]):
-                    sub = {k: v[j:j+1] for k, v in inputs.items()}
-                    try: out.append(clip_model.get_text_features(**sub))
-                    except Exception: out.append(torch.zeros((1, PROJ_DIM), device=dev))
-                feats = torch.cat(out, dim=0)
-        arr = feats.detach().cpu().numpy()
-        arr = arr / (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-9)
-        feats_all.append(arr.astype(np.float32))
-        if dev == "cuda":
-            del feats, inputs; torch.cuda.empty_cache()
-    return np.vstack(feats_all) if feats_all else np.zeros((0, PROJ_DIM), dtype=np.float32)
-
-@torch.no_grad()
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            chunk = [cleaned[j] for j in order[i:i+batch_size]]
+            inputs = tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
+            if inputs["input_ids"].numel() == 0:
+                feats_all.append(np.zeros((len(chunk), proj_dim()), dtype=np.float32)); continue
+            inputs = {k: v.to(dev) for k, v in inputs.items()}
+            with _autocast(torch, dev, use_fp16, backend):
+                try:
+                    feats = model.get_text_features(**inputs)
+                except TypeError:
+                    out = []
+                    for j in range(inputs["input_ids"].shape[0]):
+                        sub = {k: v[j:j+1] for k, v in inputs.items()}
+                        try: out.append(model.get_text_features(**sub))
+                        except Exception: out.append(torch.zeros((1, proj_dim()), device=dev))
+                    feats = torch.cat(out, dim=0)
+            arr = feats.detach().float().cpu().numpy()
+            arr = arr / (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-9)
+            feats_all.append(arr.astype(np.float32))
+            if dev == "cuda":
+                del feats, inputs; torch.cuda.empty_cache()
+    if not feats_all: return np.zeros((0, proj_dim()), dtype=np.float32)
+    out = np.empty((len(texts), feats_all[0].shape[1]), dtype=np.float32)
+    out[order] = np.vstack(feats_all)
+    return out
+
 def embed_text_clip_safe(texts):
-    for bs in [128,64,32,16,8,4,2,1]:
+    """CUDA OOM 時由 host profile 的 batch size 逐次減半重試。"""
+    torch = get_torch()
+    bs = int(get_host_profile()["text_batch_size"])
+    for bs in [bs >> i for i in range(bs.bit_length())]:
         try: return embed_text_clip(texts, batch_size=bs, max_length=64, device_override=None, use_fp16=True)
         except RuntimeError as e:
             if 'CUDA out of memory' in str(e): torch.cuda.empty_cache(); continue
             raise
     return embed_text_clip(texts, batch_size=64, max_length=64, device_override='cpu', use_fp16=False)
 
-@torch.no_grad()
-def embed_images_clip(pil_images):
-    if len(pil_images) == 0: return np.zeros((0, PROJ_DIM), dtype=np.float32)
-    inputs = clip_processor(images=pil_images, return_tensors='pt').to(device)
-    arr = clip_model.get_image_features(**inputs).detach().cpu().numpy()
+@instrument.timed("image_embedding", items=lambda pil_images, *a, **k: len(pil_images))
+def embed_images_clip(pil_images, backend=None):
+    if len(pil_images) == 0: return np.zeros((0, proj_dim()), dtype=np.float32)
+    torch = get_torch(); model = get_clip_model(); dev = get_device()
+    backend = backend or get_host_profile()["image_backend"]
+    with torch.no_grad(), _autocast(torch, dev, False, backend):
+        inputs = get_image_processor()(images=pil_images, return_tensors='pt').to(dev)
+        arr = model.get_image_features(**inputs).detach().float().cpu().numpy()
     arr = arr / (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-9)
     return arr.astype(np.float32)
 
-def compute_ati_for_df(df: pd.DataFrame) -> pd.DataFrame:
-    centers, scaler, cfg = load_artifacts()
-    TAU = cfg["TAU"]; v = np.array(cfg["phase2_v"], dtype=np.float32)
+def empty_text_embedding_path():
+    """佔位嵌入的磁碟快取；依 backend / 模型 / 快照 revision 分檔，換模型不會讀到舊的。"""
+    snap = get_snapshot() or {}
+    key = hashlib.sha1(f"{MODEL_BACKEND}\x00{MODEL_ID}\x00{snap.get('revision')}".encode("utf-8")).hexdigest()[:12]
+    return pathlib.Path(CACHE_DIR) / f"empty_text_emb_{key}.npy"
 
-    rel_lists = df["rel_img_paths"].apply(parse_rel_img_paths).tolist()
-    ocr_texts = []
-    for i, rels in enumerate(rel_lists):
-        key = f"infer_{i}"
-        ocr_texts.append(ocr_post(rels, IMG_DIR, key))
-    cap_texts = df["sum"].fillna("").astype(str).tolist()
-    cap_emb = embed_text_clip_safe(cap_texts)
-    ocr_emb = embed_text_clip_safe(ocr_texts)
-    text_vec = np.hstack([cap_emb, ocr_emb]).astype(np.float32)
+def _load_empty_text_embedding():
+    path = empty_text_embedding_path()
+    try:
+        return np.load(path).astype(np.float32)
+    except (OSError, ValueError):
+        pass
+    emb = embed_text_clip_safe([""])[0]
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp, emb)
+    os.replace(tmp, path)
+    return emb
 
-    img_vecs = []
-    for rels in rel_lists:
-        vecs = []
-        for rp in rels[:cfg["IMG_MAX_IMAGES"]]:
-            p = os.path.join(IMG_DIR, rp)
-            if not os.path.exists(p):
-                p2 = os.path.join(IMG_DIR, os.path.basename(rp))
-                if os.path.exists(p2): p = p2
-                else: continue
-            im = load_image_for_clip(p)
-            if im is None: continue
-            vimg = embed_images_clip([im])[0]; vecs.append(vimg)
+def get_empty_text_embedding():
+    """空字串（編碼時換成「。」）的 CLIP 文字嵌入；沒有 OCR 文字的貼文都用它。
+    存在 CACHE_DIR，Node 每次請求起的新程序直接讀檔，不再做這次 forward。"""
+    return _component("empty_text_emb", _load_empty_text_embedding)
+
+def embed_texts_or_placeholder(texts):
+    """空白文字直接套用快取的佔位嵌入，只對有內容的文字做 forward。"""
+    empty = np.array([not (isinstance(t, str) and t.strip() != "") for t in texts], dtype=bool)
+    if empty.all():
+        return np.tile(get_empty_text_embedding(), (len(texts), 1)).astype(np.float32)
+    filled = embed_text_clip_safe([t for t, e in zip(texts, empty) if not e])
+    if not empty.any():
+        return filled
+    out = np.empty((len(texts), filled.shape[1]), dtype=np.float32)
+    out[~empty] = filled
+    out[empty] = get_empty_text_embedding()
+    return out
+
+class ArtifactBundle:
+    """
+    一組 ati_artifacts（centers / numeric scaler / config / 大 K 索引），程序內載入一次。
+    version 為目錄內容雜湊；「無圖片」的 image DS（零向量）在載入時就先算好。
+    """
+    def __init__(self, art_dir=ART_DIR, label=None):
+        self.art_dir = pathlib.Path(art_dir)
+        self.label = label or self.art_dir.name
+        self.centers, self.scaler, self.cfg = load_artifacts(self.art_dir)
+        self.indexes = load_anchor_indexes(self.cfg, self.art_dir)
+        self.version = artifact_version(self.art_dir)
+        self.tau = self.cfg["TAU"]
+        self.v = np.array(self.cfg["phase2_v"], dtype=np.float32)
+        self.ds_no_image = float(self.ds("image", np.zeros((1, self.centers["image"].shape[1]), dtype=np.float32))[0])
+
+    def backbone(self):
+        """嵌入相關的設定；相同才能共用同一份 CLIP 嵌入與圖片 / OCR 結果。"""
+        c = self.cfg
+        model_id = c.get("MODEL_ID_CN") if c.get("MODEL_BACKEND", MODEL_BACKEND) == "chinese-clip" else c.get("MODEL_ID_EN")
+        return (c.get("MODEL_BACKEND", MODEL_BACKEND), model_id or MODEL_ID, int(c["PROJ_DIM"]),
+                int(c["IMG_MAX_IMAGES"]), int(c.get("OCR_MAX_IMAGES", OCR_MAX_IMAGES)))
+
+    def _topk(self, m, X):
+        if m not in self.indexes: return None
+        return self.indexes[m].query(X, topk=self.cfg["ANCHOR_INDEX"]["topk"], n_probe=self.cfg["ANCHOR_INDEX"].get("n_probe"))
+
+    def ds(self, m, X):
+        p = self.cfg["phase1"][m]
+        return compute_DS_for_modality(X, self.centers[m], p["wN"], p["wD"], p["nov_min"], p["nov_max"], self.tau, self._topk(m, X))
+
+    def transform_numeric(self, numeric_df):
+        return pd.DataFrame(self.scaler.transform(numeric_df), columns=numeric_df.columns,
+                            index=numeric_df.index).values.astype(np.float32)
+
+    @instrument.timed("ds_scoring", items=lambda self, text_vec, *a: len(text_vec))
+    def score(self, text_vec, image_vec, numeric_z, has_image=None):
+        """沒有圖片的列直接套 ds_no_image，不對 centers_image 做內積。"""
+        if has_image is None:
+            has_image = np.linalg.norm(image_vec, axis=1) > 0
+        DS_text = self.ds("text", text_vec)
+        DS_image = np.full(len(image_vec), self.ds_no_image, dtype=np.float32)
+        if has_image.any():
+            DS_image[has_image] = self.ds("image", image_vec[has_image])
+        DS_meta = self.ds("meta", numeric_z)
+        DS_final = (self.v[0]*DS_text + self.v[1]*DS_image + self.v[2]*DS_meta).astype(np.float32)
+        return {"DS_text": DS_text, "DS_image": DS_image, "DS_meta": DS_meta,
+                "DS_final": DS_final, "ATI_final": 100.0*(1.0 - DS_final)}
+
+@instrument.timed("image_decode", items=lambda rels, cfg: min(len(rels), cfg["IMG_MAX_IMAGES"]))
+def decode_post_images(rels, cfg):
+    """一篇貼文最多 IMG_MAX_IMAGES 張可讀的 PIL 圖片。"""
+    ims = []
+    for rp in rels[:cfg["IMG_MAX_IMAGES"]]:
+        p = resolve_image_path(rp, IMG_DIR)
+        if p is None: continue
+        im = load_image_for_clip(p)
+        if im is not None: ims.append(im)
+    return ims
+
+def embed_post_images(images_per_post, cfg):
+    """每篇貼文的圖片嵌入平均後 normalize；沒有圖片為零向量。回傳 (image_vec, has_image)。
+    所有貼文的圖片攤平後以 host profile 的 image_batch_size 分批嵌入。"""
+    flat = [im for ims in images_per_post for im in ims]
+    bs = int(get_host_profile()["image_batch_size"])
+    flat_vecs = [v for i in range(0, len(flat), bs) for v in embed_images_clip(flat[i:i+bs])]
+    img_vecs, k = [], 0
+    for ims in images_per_post:
+        vecs = flat_vecs[k:k+len(ims)]; k += len(ims)
         if len(vecs) == 0:
             vec_mean = np.zeros((cfg["PROJ_DIM"],), dtype=np.float32)
         else:
             arr = np.vstack(vecs); vec_mean = arr.mean(axis=0)
             vec_mean = vec_mean / (np.linalg.norm(vec_mean) + 1e-9)
         img_vecs.append(vec_mean.astype(np.float32))
-    image_vec = np.vstack(img_vecs)
+    return np.vstack(img_vecs), np.array([len(ims) > 0 for ims in images_per_post], dtype=bool)
 
-    numeric_df = build_numeric_features(df.assign(ocr_text=""), "sum", None, "ftime_parsed")
-    numeric_df = build_numeric_features(df.assign(ocr_text=ocr_texts), "sum", "ocr_text", "ftime_parsed")
-    numeric_z = pd.DataFrame(
-        joblib.load(ART_DIR / "numeric_scaler.joblib").transform(numeric_df),
-        columns=numeric_df.columns, index=df.index
-    ).values.astype(np.float32)
+# 長時間執行的服務以指標檔切換產物版本（bundle_manager）；沒有指標檔時用 ART_DIR
+ACTIVE_POINTER = pathlib.Path(BASE_DIR) / "outputs" / "active_artifacts.json"
+BUNDLE_POLL_S = 2.0
+
+def validate_bundle(new, old):
+    """新 bundle 要能共用目前的 CLIP 嵌入，且對探測輸入算得出有限的 ATI。"""
+    if new.backbone() != old.backbone():
+        raise ValueError(f"嵌入設定 {new.backbone()} 與目前的 {old.backbone()} 不同，需要重新啟動")
+    d = new.centers["text"].shape[1]
+    probe = new.score(np.ones((1, d), dtype=np.float32) / np.sqrt(d),
+                      np.zeros((1, new.centers["image"].shape[1]), dtype=np.float32),
+                      np.zeros((1, new.centers["meta"].shape[1]), dtype=np.float32), np.array([False]))
+    if not np.all(np.isfinite(probe["ATI_final"])):
+        raise ValueError("探測輸入的 ATI 不是有限值")
 
-    DS_text  = compute_DS_for_modality(text_vec,  centers["text"],  cfg["phase1"]["text"]["wN"],  cfg["phase1"]["text"]["wD"],  cfg["phase1"]["text"]["nov_min"],  cfg["phase1"]["text"]["nov_max"],  TAU)
-    DS_image = compute_DS_for_modality(image_vec, centers["image"], cfg["phase1"]["image"]["wN"], cfg["phase1"]["image"]["wD"], cfg["phase1"]["image"]["nov_min"], cfg["phase1"]["image"]["nov_max"], TAU)
-    DS_meta  = compute_DS_for_modality(numeric_z, centers["meta"],  cfg["phase1"]["meta"]["wN"],  cfg["phase1"]["meta"]["wD"],  cfg["phase1"]["meta"]["nov_min"],  cfg["phase1"]["meta"]["nov_max"],  TAU)
+def get_bundle_manager():
+    return _component("bundle_manager", lambda: bundle_manager.BundleManager(
+        ArtifactBundle, ACTIVE_POINTER, ART_DIR, validate=validate_bundle))
 
-    DS_final = (v[0]*DS_text + v[1]*DS_image + v[2]*DS_meta).astype(np.float32)
-    ATI = 100.0*(1.0 - DS_final)
+def get_bundle():
+    """目前啟用的 bundle；每個請求只取一次，熱切換時進行中的請求繼續用舊的。"""
+    return get_bundle_manager().current()
 
-    out = df[["brand","sum","rel_img_paths","ftime_parsed"]].copy()
-    out["DS_text"]=DS_text; out["DS_image"]=DS_image; out["DS_meta"]=DS_meta
-    out["DS_final"]=DS_final; out["ATI_final"]=ATI
+def load_bundles(art_dirs):
+    """多組 ati_artifacts（A/B 比較用）；第一組為主要結果。嵌入設定不同的組合無法共用嵌入，直接報錯。"""
+    bundles = []
+    for d in art_dirs:
+        b = get_bundle() if pathlib.Path(d).resolve() == pathlib.Path(ART_DIR).resolve() else ArtifactBundle(d)
+        if any(x.label == b.label for x in bundles):
+            b.label = f"{b.label}@{b.version}"
+        bundles.append(b)
+    base = bundles[0].backbone()
+    for b in bundles[1:]:
+        if b.backbone() != base:
+            raise ValueError(f"{b.art_dir} 的嵌入設定 {b.backbone()} 與 {bundles[0].art_dir} 的 {base} 不同，無法共用嵌入")
+    return bundles
+
+def score_bundles(bundles, text_vec, image_vec, numeric_df, has_image):
+    """同一份嵌入與原始 numeric 特徵，各 bundle 以自己的 scaler / centers / 權重計分。"""
+    return [(b, b.score(text_vec, image_vec, b.transform_numeric(numeric_df), has_image)) for b in bundles]
+
+def embed_df(df: pd.DataFrame, cfg):
+    """嵌入與原始 numeric 特徵（與 bundle 無關的部分）：(text_vec, image_vec, has_image, numeric_df, ocr_texts)。"""
+    # 沒有 rel_img_paths 欄位（或全空）時不會載入 OCR / image processor
+    with instrument.span("parse_rel_img", items=len(df)):
+        rel_lists = (df["rel_img_paths"].apply(parse_rel_img_paths).tolist()
+                     if "rel_img_paths" in df.columns else [[] for _ in range(len(df))])
+    # 整批先解析成絕對路徑（找不到為 None，位置不變）；ocr_post / decode_post_images 再解析時直接命中
+    with instrument.span("path_resolution", items=sum(len(rels) for rels in rel_lists)):
+        rel_lists = [[resolve_image_path(rp, IMG_DIR) for rp in rels] for rels in rel_lists]
+    ocr_texts = [ocr_post(rels, IMG_DIR) for rels in rel_lists]
+    cap_texts = df["sum"].fillna("").astype(str).tolist()
+    cap_emb = embed_text_clip_safe(cap_texts)
+    ocr_emb = embed_texts_or_placeholder(ocr_texts)
+    text_vec = np.hstack([cap_emb, ocr_emb]).astype(np.float32)
+
+    image_vec, has_image = embed_post_images([decode_post_images(rels, cfg) for rels in rel_lists], cfg)
+
+    numeric_df = build_numeric_features(df.assign(ocr_text=ocr_texts), "sum", "ocr_text", "ftime_parsed")
+    return text_vec, image_vec, has_image, numeric_df, ocr_texts
+
+def compute_ati_for_df(df: pd.DataFrame, return_vectors: bool = False, bundle: ArtifactBundle | None = None):
+    bundle = bundle or get_bundle()
+    text_vec, image_vec, has_image, numeric_df, ocr_texts = embed_df(df, bundle.cfg)
+    scores = bundle.score(text_vec, image_vec, bundle.transform_numeric(numeric_df), has_image)
+
+    out = df[[c for c in ("brand","sum","rel_img_paths","ftime_parsed") if c in df.columns]].copy()
+    for k, col in scores.items(): out[k] = col
     out["ocr_text"]=ocr_texts
+    if return_vectors:
+        return out, {"text": text_vec, "image": image_vec}
     return out
 
-def compute_ati_single(text: str, rel_img_paths: str | None = None) -> dict:
-    """Convenience wrapper: one (text, image) → ATI JSON-ready dict."""
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    df = pd.DataFrame([{
-        "brand": "user",
-        "sum": text or "",
-        "rel_img_paths": rel_img_paths or "",
-        "ftime_parsed": now,
-    }])
-    result = compute_ati_for_df(df)
-    row = result.iloc[0]
-    return {
-        "ati": float(row["ATI_final"]),
+def compute_ati_multi_df(df: pd.DataFrame, bundles: list):
+    """嵌入一次、每個 bundle 各算一次 DS：第一個 bundle 的結果欄位與 compute_ati_for_df 相同，
+    其餘 bundle 加上 <欄位>__<label> 欄（shadow scoring）。"""
+    primary = bundles[0]
+    text_vec, image_vec, has_image, numeric_df, ocr_texts = embed_df(df, primary.cfg)
+    out = df[[c for c in ("brand","sum","rel_img_paths","ftime_parsed") if c in df.columns]].copy()
+    for b, scores in score_bundles(bundles, text_vec, image_vec, numeric_df, has_image):
+        for k, col in scores.items():
+            out[k if b is primary else f"{k}__{b.label}"] = col
+    out["ocr_text"] = ocr_texts
+    return out
+
+STAGE_WORKERS = 4
+_STAGE_POOL = None
+def get_stage_pool():
+    global _STAGE_POOL
+    if _STAGE_POOL is None:
+        _STAGE_POOL = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="ati-stage")
+    return _STAGE_POOL
+
+def build_shared_image_graph(captions, rels, now, bundle, shadows=()):
+    """
+    同一組圖片、N 個 caption 的 stage 相依圖：caption 批次嵌入、圖片解碼→嵌入、OCR
+    三條同時跑，只有 OCR 文字嵌入與 numeric 特徵要等 OCR。圖片與 OCR 只算一次，
+    再展開到 N 列一起計分。shadows：共用嵌入、另外計分的 bundle（"shadow_scores" stage）。
+    """
+    cfg = bundle.cfg
+    n = len(captions)
+    rows = pd.DataFrame({"sum": list(captions), "ftime_parsed": [now] * n})
+    g = StageGraph()
+    g.add("caption_embedding", lambda r: embed_text_clip_safe(list(captions)))
+    g.add("image_decode", lambda r: decode_post_images(rels, cfg))
+    g.add("image_embedding", lambda r: embed_post_images([r["image_decode"]], cfg), deps=("image_decode",))
+    # OCR 可降級：超過期限時以 "" 計分（佔位嵌入 + 無 OCR 的 numeric 特徵），
+    # 原本的 OCR 在背景跑完並寫入快取，下一次同一張圖就會命中
+    g.add("ocr", lambda r: ocr_post(rels, IMG_DIR), fallback=lambda r: "")
+    g.add("ocr_embedding", lambda r: embed_texts_or_placeholder([r["ocr"]]), deps=("ocr",))
+    g.add("numeric_features", lambda r: build_numeric_features(
+        rows.assign(ocr_text=[r["ocr"]] * n), "sum", "ocr_text", "ftime_parsed"), deps=("ocr",))
+    def _inputs(r):
+        text_vec = np.hstack([r["caption_embedding"], np.repeat(r["ocr_embedding"], n, axis=0)]).astype(np.float32)
+        image_vec, has_image = r["image_embedding"]
+        return text_vec, np.repeat(image_vec, n, axis=0), np.repeat(has_image, n)
+    def _score(r):
+        text_vec, image_vec, has_image = _inputs(r)
+        return bundle.score(text_vec, image_vec, bundle.transform_numeric(r["numeric_features"]), has_image), text_vec, image_vec
+    deps = ("caption_embedding", "ocr_embedding", "image_embedding", "numeric_features")
+    g.add("score", _score, deps=deps)
+    def _shadow(r):
+        text_vec, image_vec, has_image = _inputs(r)
+        return score_bundles(shadows, text_vec, image_vec, r["numeric_features"], has_image)
+    if shadows:
+        g.add("shadow_scores", _shadow, deps=deps)
+    return g
+
+def build_single_graph(text, rels, now, bundle, shadows=()):
+    return build_shared_image_graph([text], rels, now, bundle, shadows)
+
+def _components_at(scores, i=0):
+    return {k: float(scores[k][i]) for k in ("DS_text", "DS_image", "DS_meta", "DS_final")}
+
+# 結果快取：記憶體 LRU + CACHE_DIR/results 的磁碟層（CLI 每次一個新程序時靠磁碟層命中）
+RESULT_CACHE_CAPACITY = result_cache.CAPACITY
+RESULT_CACHE_TTL_S = result_cache.TTL_S
+RESULT_CACHE_DISK = True
+def get_result_cache():
+    return _component("result_cache", lambda: result_cache.ResultCache(
+        RESULT_CACHE_CAPACITY, RESULT_CACHE_TTL_S, os.path.join(CACHE_DIR, "results") if RESULT_CACHE_DISK else None))
+
+def image_content_hash(rels, cfg):
+    """打分會讀到的圖片（image 與 OCR 取較多者）的內容雜湊；沒有可讀圖片為 ""。"""
+    n = max(cfg["IMG_MAX_IMAGES"], OCR_MAX_IMAGES)
+    paths = [p for p in (resolve_image_path(rp, IMG_DIR) for rp in rels[:n]) if p]
+    return ocr_cache_key(paths) if paths else ""
+
+def compute_ati_single(text: str, rel_img_paths: str | None = None, top_n_similar: int = 5,
+                       deadline_s: float | None = None, use_cache: bool = True, bundles: list | None = None) -> dict:
+    """Convenience wrapper: one (text, image) → ATI JSON-ready dict.
+    top_n_similar > 0 時附上最相似的歷史貼文（需先建立 outputs/post_index）。
+    各 stage 在 thread pool 上依相依圖並行，timings 附上各 stage 時間與 critical path。
+    deadline_s：OCR 在期限內沒完成就以無 OCR 的結果回傳，degraded=True。
+    use_cache：相同 caption / 圖片內容 / 發文小時 / 產物版本直接回傳快取結果（降級結果不寫入）。
+    bundles：load_bundles() 的多組產物；第一組為主要結果，其餘共用嵌入另外計分，並列在 "bundles"。"""
+    text = result_cache.normalize_caption(text)
+    now_dt = datetime.datetime.now()
+    now = now_dt.strftime("%Y-%m-%d %H:%M:%S")
+    bundle, shadows = (bundles[0], list(bundles[1:])) if bundles else (get_bundle(), [])
+    rels = parse_rel_img_paths(rel_img_paths or "")
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        # similar_posts 來自歷史貼文索引，索引重建後舊鍵不再命中
+        index_ver = index_version(POST_INDEX_DIR) if top_n_similar > 0 else ""
+        key = result_cache.make_key(text, image_content_hash(rels, bundle.cfg), now_dt.hour, bundle.version, top_n_similar,
+                                    index_ver, *(f"{b.label}:{b.version}" for b in shadows))
+        hit, tier = cache.get(key)
+        if hit is not None:
+            return {**hit, "rel_img_paths": rel_img_paths or "", "timestamp": now,
+                    "timings": {"cache": {"hit": True, "tier": tier, **cache.stats()}}}
+    results, timings = build_single_graph(text, rels, now, bundle, shadows).run(get_stage_pool(), deadline_s=deadline_s)
+    summary = summarize_stages(timings)
+    scores, text_vec, image_vec = results["score"]
+    index = get_post_index() if top_n_similar > 0 else None
+    similar = index.search({"text": text_vec[0], "image": image_vec[0]}, top_n=top_n_similar) if index is not None else {}
+    out = {
+        "ati": float(scores["ATI_final"][0]),
+        "artifact_version": bundle.version,
         "components": {
-            "DS_text":  float(row["DS_text"]),
-            "DS_image": float(row["DS_image"]),
-            "DS_meta":  float(row["DS_meta"]),
-            "DS_final": float(row["DS_final"]),
+            "DS_text":  float(scores["DS_text"][0]),
+            "DS_image": float(scores["DS_image"][0]),
+            "DS_meta":  float(scores["DS_meta"][0]),
+            "DS_final": float(scores["DS_final"][0]),
         },
-        "ocr_text": row["ocr_text"],
+        "ocr_text": results["ocr"],
+        "similar_posts": similar,
         "rel_img_paths": rel_img_paths or "",
         "timestamp": now,
+        "degraded": bool(summary["timed_out"] or summary["skipped"]),
     }
+    if shadows:
+        out["bundles"] = [{"label": b.label, "artifact_version": b.version, "ati": float(sc["ATI_final"][0]),
+                           "components": _components_at(sc)}
+                          for b, sc in [(bundle, scores)] + results["shadow_scores"]]
+    if cache is not None:
+        if not out["degraded"]:
+            cache.put(key, dict(out))
+        summary["cache"] = {"hit": False, "tier": None, **cache.stats()}
+    out["timings"] = summary
+    return out
+
+def compute_ati_variants(rel_img_paths: str | None, captions: list, deadline_s: float | None = None) -> dict:
+    """同一張圖的多個 caption 版本：圖片嵌入、OCR 與 OCR 嵌入只算一次，
+    caption 一次批次編碼，numeric 特徵與 DS 向量化；依 ATI 由高到低排名。"""
+    captions = [result_cache.normalize_caption(c) for c in captions]
+    if not captions:
+        raise ValueError("captions 不可為空")
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    bundle = get_bundle()
+    rels = parse_rel_img_paths(rel_img_paths or "")
+    results, timings = build_shared_image_graph(captions, rels, now, bundle).run(get_stage_pool(), deadline_s=deadline_s)
+    summary = summarize_stages(timings)
+    scores = results["score"][0]
+    order = np.argsort(-scores["ATI_final"], kind="stable")
+    ranked = [{
+        "rank": rank + 1,
+        "index": int(i),
+        "caption": captions[i],
+        "ati": float(scores["ATI_final"][i]),
+        "components": _components_at(scores, i),
+    } for rank, i in enumerate(order)]
+    return {
+        "variants": ranked,
+        "artifact_version": bundle.version,
+        "ocr_text": results["ocr"],
+        "rel_img_paths": rel_img_paths or "",
+        "timestamp": now,
+        "degraded": bool(summary["timed_out"] or summary["skipped"]),
+        "timings": summary,
+    }
+
+def load_variant_captions(path):
+    """JSON 陣列（字串或含 "caption" / "text" 的物件）或一行一個 caption 的文字檔。"""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError:
+        return [line for line in raw.splitlines() if line.strip()]
+    return [it if isinstance(it, str) else str(it.get("caption", it.get("text", ""))) for it in items]
+
+# interactive 單篇請求與 bulk CSV 批次共用同一組 warm worker；bulk 以 BULK_BATCH_ROWS
+# 篇為一個排程單位，interactive 請求在批次邊界插隊
+SCHEDULER_WORKERS = 1
+BULK_BATCH_ROWS = 32
+def get_scheduler():
+    return _component("scheduler", lambda: scheduler.PriorityScheduler(
+        workers=SCHEDULER_WORKERS, min_bulk_share=scheduler.MIN_BULK_SHARE))
+
+def score_interactive(text, rel_img_paths=None, **kwargs):
+    return get_scheduler().submit_interactive(compute_ati_single, text, rel_img_paths, **kwargs)
+
+def score_bulk(df: pd.DataFrame, batch_rows: int = BULK_BATCH_ROWS) -> pd.DataFrame:
+    # 整個 CSV 固定用同一個 bundle，批次之間熱切換也不會混用兩個版本
+    score = functools.partial(compute_ati_for_df, bundle=get_bundle())
+    batches = [df.iloc[i:i + batch_rows] for i in range(0, len(df), batch_rows)]
+    futures = get_scheduler().map_bulk(score, batches)
+    return pd.concat([f.result() for f in futures]) if futures else score(df)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -291,21 +736,108 @@ if __name__ == "__main__":
         required=False,
         help="optional legacy mode: CSV path processed with compute_ati_for_df",
     )
+    parser.add_argument("--similar", type=int, default=5, help="number of similar historical posts to return (0 = off)")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="latency budget in seconds; OCR that misses it is dropped and the result is flagged degraded")
+    parser.add_argument("--warm_ocr", action="store_true",
+                        help="only run OCR for --rel_img and write the OCR cache (started in the background after a degraded result)")
+    parser.add_argument("--bulk_batch", type=int, default=BULK_BATCH_ROWS,
+                        help="rows per scheduled bulk batch in --csv mode (interactive requests can run between batches)")
+    parser.add_argument("--variants", type=str, default=None,
+                        help="file of caption variants (JSON list or one per line) scored against --rel_img and ranked")
+    parser.add_argument("--artifacts", type=str, default=None,
+                        help="comma-separated ati_artifacts dirs scored side by side on shared embeddings (first = primary)")
+    parser.add_argument("--timings", action="store_true",
+                        help="add per-span wall/CPU time, peak RSS delta and item counts to the JSON output")
+    parser.add_argument("--no_cache", action="store_true", help="bypass the result cache for single-post scoring")
+    parser.add_argument("--warmup", action="store_true", help="preload torch, CLIP, processors and OCR and report load times")
+    parser.add_argument("--prepare_models", action="store_true",
+                        help="snapshot CLIP and EasyOCR weights locally, record them in outputs/model_snapshot.json and report cold vs warm load times")
+    parser.add_argument("--snapshot_dir", type=str, default=str(model_snapshot.SNAPSHOT_DIR))
     args = parser.parse_args()
+    rec = instrument.start_recording() if args.timings else None
+
+    def emit(payload):
+        if rec is not None:
+            payload.setdefault("timings", {})["spans"] = rec.to_dict()
+        print(json.dumps(payload, ensure_ascii=False))
+
+    def finish(payload):
+        """輸出後結束。降級時 OCR 還在 stage pool 上跑，直譯器正常結束會等它（join
+        worker thread），呼叫端（server.ts 的 runPython 等 close）就看不到期限的效果；
+        改成立刻 os._exit，OCR 交給一個脫離的 --warm_ocr 程序跑完並寫入快取。"""
+        emit(payload)
+        if not payload.get("degraded"):
+            sys.exit(0)
+        if args.rel_img:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "--warm_ocr", "--rel_img", args.rel_img],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+        sys.stdout.flush(); sys.stderr.flush()
+        os._exit(0)
+
+    if args.warm_ocr:
+        if args.rel_img:
+            ocr_post(parse_rel_img_paths(args.rel_img), IMG_DIR)
+        sys.exit(0)
+
+    if args.prepare_models:
+        report = model_snapshot.prepare(MODEL_ID, MODEL_BACKEND, snapshot_dir=args.snapshot_dir)
+        report["loads"] = model_snapshot.benchmark_loads(snapshot_dir=args.snapshot_dir)
+        warmup(("empty_text_emb",))  # 先寫好佔位嵌入，之後的請求不必再 forward
+        report["empty_text_emb"] = str(empty_text_embedding_path())
+        print(json.dumps(report, ensure_ascii=False))
+        sys.exit(0)
+
+    if args.warmup:
+        load_times = warmup()
+        if not args.csv and not args.text and not args.rel_img and not args.variants:
+            print(json.dumps({"load_times": load_times}, ensure_ascii=False))
+            sys.exit(0)
+
+    bundles = load_bundles(args.artifacts.split(",")) if args.artifacts else None
+    if bundles:
+        get_bundle_manager().set(bundles[0])  # 第一組取代預設 ART_DIR，其他模式也用它
 
     # Legacy CSV mode (if you still need it)
+    if args.csv and bundles and len(bundles) > 1:
+        # A/B 比較：只輸出並列結果，不寫入 outputs / sketch / aggregate
+        with instrument.span("read_input") as sp:
+            df = pd.read_csv(args.csv); sp.count(len(df))
+        result = compute_ati_multi_df(df, bundles)
+        emit({"ati_by_bundle": {
+            b.label: {"artifact_version": b.version,
+                      "ati_list": [float(x) for x in result["ATI_final" if i == 0 else f"ATI_final__{b.label}"]]}
+            for i, b in enumerate(bundles)}})
+        sys.exit(0)
     if args.csv:
-        df = pd.read_csv(args.csv)
-        result = compute_ati_for_df(df)
-        result.to_csv("./src/model/outputs/ati_input.csv", index=False)
+        with instrument.span("read_input") as sp:
+            df = pd.read_csv(args.csv); sp.count(len(df))
+        result = score_bulk(df, batch_rows=args.bulk_batch)
+        with instrument.span("output_writing", items=len(result)):
+            with open(args.csv, "rb") as f:
+                batch_id = hashlib.sha1(f.read()).hexdigest()
+            # 先更新彙總（單一交易），失敗時不會留下寫了一半的輸出檔；
+            # 同一份 CSV 重送時 sketch 與 aggregate 都以 batch_id 去重，兩邊保持一致
+            with aggregate_store.AggregateStore() as agg:
+                agg.update(result, "infer", batch_id=batch_id)
+            quantile_sketch.merge_into(result, "infer", batch_id=batch_id)
+            result.to_csv("./src/model/outputs/ati_input.csv", index=False)
+            columnar.write_per_post(result, "./src/model/outputs/ati_input", text_columns=("sum", "ocr_text"))
         # Just dump all ATI scores as JSON
-        print(json.dumps(
-            {"ati_list": [float(x) for x in result["ATI_final"].tolist()]},
-            ensure_ascii=False,
-        ))
+        emit({"ati_list": [float(x) for x in result["ATI_final"].tolist()],
+              **({"load_times": load_times} if args.warmup else {})})
         sys.exit(0)
 
+    if args.variants:
+        with instrument.span("read_input") as sp:
+            captions = load_variant_captions(args.variants); sp.count(len(captions))
+        finish(compute_ati_variants(args.rel_img, captions, deadline_s=args.deadline))
+
     # Single text + optional image mode
-    out = compute_ati_single(args.text, args.rel_img)
-    print(json.dumps(out, ensure_ascii=False))
+    out = compute_ati_single(args.text, args.rel_img, top_n_similar=args.similar, deadline_s=args.deadline,
+                             use_cache=not args.no_cache, bundles=bundles)
+    if args.warmup:
+        out["load_times"] = load_times
+    finish(out)
 
@@ -0,0 +1,127 @@
+# src/model/instrument.py
+"""
+輕量的計時 / 記憶體 span。
+
+  with instrument.span("ocr", items=len(paths)):
+      ...
+
+- 每個 span 記錄 wall time、CPU time（process_time，整個程序；並行的 span 會互相重疊）、
+  peak RSS 增量（ru_maxrss 在 span 內上升的 KB，只會看到新的高水位）與處理筆數
+- 同名 span 聚合成 calls / wall_s / cpu_s / items / rss_peak_delta_kb（取最大）
+- record()：在目前 context 收集 span，給單次請求 / CLI 的 timings 區塊；可巢狀，
+  span 會記進所有外層 recorder。StageGraph 以 copy_context 把 recorder 帶進 worker thread
+- METRICS：程序層級的累計（長時間執行的服務用），prometheus_text() 輸出
+  Prometheus text exposition format
+"""
+import time, functools, threading, contextvars
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_ACTIVE = contextvars.ContextVar("instrument_recorders", default=())
+
+
+def _maxrss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, wall_s, cpu_s, rss_kb, items):
+        with self._lock:
+            s = self.spans.get(name)
+            if s is None:
+                s = self.spans[name] = {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0, "rss_peak_delta_kb": 0}
+            s["calls"] += 1
+            s["wall_s"] += wall_s
+            s["cpu_s"] += cpu_s
+            s["items"] += items
+            s["rss_peak_delta_kb"] = max(s["rss_peak_delta_kb"], rss_kb)
+
+    def to_dict(self):
+        with self._lock:
+            spans = {n: {**s, "wall_s": round(s["wall_s"], 6), "cpu_s": round(s["cpu_s"], 6)}
+                     for n, s in self.spans.items()}
+        return {"spans": spans, "elapsed_s": round(time.perf_counter() - self.started, 6)}
+
+
+METRICS = Recorder()
+
+
+class Span:
+    __slots__ = ("name", "items")
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def count(self, n=1):
+        self.items += n
+
+
+@contextmanager
+def span(name, items=0):
+    """量測區塊；yield 的 Span 可用 .count(n) 在區塊內累加處理筆數。"""
+    s = Span(name, items)
+    rss0, cpu0, t0 = _maxrss_kb(), time.process_time(), time.perf_counter()
+    try:
+        yield s
+    finally:
+        wall, cpu, rss = time.perf_counter() - t0, time.process_time() - cpu0, _maxrss_kb() - rss0
+        METRICS.add(name, wall, cpu, rss, s.items)
+        for rec in _ACTIVE.get():
+            rec.add(name, wall, cpu, rss, s.items)
+
+
+@contextmanager
+def record():
+    rec = Recorder()
+    token = _ACTIVE.set(_ACTIVE.get() + (rec,))
+    try:
+        yield rec
+    finally:
+        _ACTIVE.reset(token)
+
+
+def timed(name, items=None):
+    """函式版的 span；items(*args, **kwargs) 回傳這次呼叫的處理筆數。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, items(*args, **kwargs) if items else 0):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def start_recording():
+    """在目前 context 啟用一個 recorder 直到程序結束（CLI 的 --timings 用）。"""
+    rec = Recorder()
+    _ACTIVE.set(_ACTIVE.get() + (rec,))
+    return rec
+
+
+def prometheus_text(recorder=METRICS, prefix="ati"):
+    spans = recorder.to_dict()["spans"]
+    series = (
+        ("span_calls_total", "counter", "Number of times the span ran", "calls"),
+        ("span_wall_seconds_total", "counter", "Wall time spent in the span", "wall_s"),
+        ("span_cpu_seconds_total", "counter", "Process CPU time spent in the span", "cpu_s"),
+        ("span_items_total", "counter", "Items processed in the span", "items"),
+        ("span_rss_peak_delta_kb", "gauge", "Largest peak RSS increase observed during the span", "rss_peak_delta_kb"),
+    )
+    lines = []
+    for metric, kind, help_text, key in series:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {kind}")
+        for name in sorted(spans):
+            lines.append(f'{prefix}_{metric}{{span="{name}"}} {spans[name][key]}')
+    return "\n".join(lines) + "\n"
+
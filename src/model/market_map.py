@@ -0,0 +1,174 @@
+# src/model/market_map.py
+"""
+市場地圖的離線投影與分群（取代 marketMapService.ts 請求時的 pca2D / simpleKMeans）。
+
+- 品牌向量：feature store 的 text / image / meta 嵌入質心（同 brand_similarity），
+  各模態 L2 normalize 後乘 √(1/3) 串接
+- 以 randomized SVD 取前 N_COMPONENTS 個主成分當基底（mean + components），
+  前兩軸是地圖上的嵌入座標；KMeans 在 N_COMPONENTS 維空間分 N_CLUSTERS 群
+- update()：沿用既有基底投影所有品牌（新品牌不重擬合），只有當舊基底在目前
+  資料上的解釋變異比例偏離擬合時超過 DRIFT_TOL 才整個重擬合；重擬合後對齊
+  主成分正負號，讓地圖方向穩定
+- 產物 outputs/market_map/：basis.npz（下次 update 用）與 market_map.json
+  （/api/market/map 直接回傳）；定位座標 x = 平均 diversity、y = 平均 ATI，
+  與 novelty_diversity_scatter.json 相同（測試期貼文）
+"""
+import os, json, pathlib, argparse
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from sklearn.utils.extmath import randomized_svd
+from sklearn.cluster import KMeans
+
+import brand_similarity
+
+BASE_DIR = "./src/model"
+OUT_DIR = pathlib.Path(BASE_DIR) / "outputs"
+MAP_DIR = OUT_DIR / "market_map"
+N_COMPONENTS = 8
+N_CLUSTERS = 4
+DRIFT_TOL = 0.05
+SEED = 42
+
+
+def brand_matrix(splits=("train", "test")):
+    """回傳 brands [B] 與串接後的品牌向量 [B, d]。"""
+    brands, vecs = brand_similarity.load_modal_vectors(splits)
+    names, cents = brand_similarity.brand_centroids(brands, vecs)
+    w = np.sqrt(1.0 / len(brand_similarity.MODALITIES))
+    Z = np.hstack([w * cents[m] for m in brand_similarity.MODALITIES]).astype(np.float64)
+    return [str(b) for b in names], Z
+
+
+def explained_ratio(Zc, components):
+    """基底 components [c, d] 在已中心化資料上解釋的變異比例。"""
+    total = float((Zc * Zc).sum())
+    if total <= 0:
+        return 0.0
+    P = Zc @ components.T
+    return float((P * P).sum()) / total
+
+
+class MarketMapBasis:
+    def __init__(self, mean, components, evr, cluster_centers, fitted_at):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.components = np.asarray(components, dtype=np.float64)
+        self.evr = np.asarray(evr, dtype=np.float64)
+        self.cluster_centers = np.asarray(cluster_centers, dtype=np.float64)
+        self.fitted_at = str(fitted_at)
+
+    @classmethod
+    def fit(cls, Z, n_components=N_COMPONENTS, n_clusters=N_CLUSTERS, previous=None, random_state=SEED):
+        mean = Z.mean(axis=0)
+        Zc = Z - mean
+        c = max(1, min(n_components, Z.shape[0] - 1, Z.shape[1]))
+        _, S, Vt = randomized_svd(Zc, n_components=c, n_iter=7, random_state=random_state)
+        total = float((Zc * Zc).sum())
+        evr = (S ** 2) / total if total > 0 else np.zeros_like(S)
+        if previous is not None and previous.components.shape == Vt.shape:
+            # 重擬合後主成分正負號與舊基底一致，地圖不會左右 / 上下翻轉
+            signs = np.sign(np.sum(Vt * previous.components, axis=1))
+            Vt = Vt * np.where(signs == 0, 1.0, signs)[:, None]
+        P = Zc @ Vt.T
+        k = min(n_clusters, len(Z))
+        km = KMeans(n_clusters=k, n_init=10, random_state=random_state).fit(P)
+        # 群編號依第一軸座標排序，重擬合之間保持穩定
+        order = np.argsort(km.cluster_centers_[:, 0], kind="stable")
+        return cls(mean, Vt, evr, km.cluster_centers_[order], datetime.now(timezone.utc).isoformat())
+
+    def project(self, Z):
+        return (np.asarray(Z, dtype=np.float64) - self.mean) @ self.components.T
+
+    def assign(self, P):
+        d = ((P[:, None, :] - self.cluster_centers[None, :, :]) ** 2).sum(axis=2)
+        return d.argmin(axis=1)
+
+    def drift(self, Z):
+        """目前資料上的解釋變異比例 − 擬合時的比例。"""
+        return explained_ratio(np.asarray(Z, dtype=np.float64) - self.mean, self.components) - float(self.evr.sum())
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components, evr=self.evr,
+                 cluster_centers=self.cluster_centers, fitted_at=np.asarray(self.fitted_at))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["mean"], z["components"], z["evr"], z["cluster_centers"], str(z["fitted_at"]))
+
+
+def load_positioning(out_dir=OUT_DIR):
+    """與 novelty_diversity_scatter.json 相同的品牌定位（測試期），y_mean 用 train + test。"""
+    import columnar
+    cols = ["brand", "ATI_final", "DS_final", "y", "text_div", "image_div", "meta_div"]
+    frames = {}
+    for split in ("train", "test"):
+        base = pathlib.Path(out_dir) / f"ati_{split}_per_post.csv"
+        if columnar.exists(base):
+            frames[split] = columnar.read_per_post(base, columns=cols)
+        elif base.exists():
+            frames[split] = pd.read_csv(base, usecols=lambda c: c in cols)
+    if "test" not in frames:
+        raise FileNotFoundError(f"{out_dir} 中找不到 ati_test_per_post，請先執行 model.py")
+    test = frames["test"].assign(brand=lambda d: d["brand"].astype(str).str.strip())
+    test["diversity"] = test[["text_div", "image_div", "meta_div"]].mean(axis=1)
+    pos = test.groupby("brand").agg(ati=("ATI_final", "mean"), ds=("diversity", "mean"), n_posts=("ATI_final", "size"))
+    both = pd.concat([f[["brand", "y"]] for f in frames.values()], ignore_index=True)
+    y_mean = both.assign(brand=both["brand"].astype(str).str.strip()).groupby("brand")["y"].mean()
+    return pos.join(y_mean.rename("y_mean"), how="left").fillna({"y_mean": 0.0})
+
+
+def build(refit=False, map_dir=MAP_DIR, out_dir=OUT_DIR, drift_tol=DRIFT_TOL):
+    """refit=False 且已有基底時只投影；解釋變異漂移超過 drift_tol 才重擬合。"""
+    names, Z = brand_matrix()
+    basis_path = pathlib.Path(map_dir) / "basis.npz"
+    previous = MarketMapBasis.load(basis_path) if basis_path.exists() else None
+    drift = previous.drift(Z) if previous is not None and previous.mean.shape[0] == Z.shape[1] else None
+    refitted = refit or drift is None or abs(drift) > drift_tol
+    basis = MarketMapBasis.fit(Z, previous=previous) if refitted else previous
+
+    P = basis.project(Z)
+    clusters = basis.assign(P)
+    index = {b: i for i, b in enumerate(names)}
+    pos = load_positioning(out_dir)
+    points = []
+    for brand, row in pos.sort_values("ati", ascending=False, kind="stable").iterrows():
+        i = index.get(brand)
+        points.append({
+            "brand": brand,
+            "x": round(float(row["ds"]), 4),
+            "y": round(float(row["ati"]), 2),
+            "ati": round(float(row["ati"]), 2),
+            "ds": round(float(row["ds"]), 4),
+            "y_mean": float(row["y_mean"]),
+            "n_posts": int(row["n_posts"]),
+            "cluster": int(clusters[i]) if i is not None else 0,
+            "embeddingX": round(float(P[i, 0]), 6) if i is not None else None,
+            "embeddingY": round(float(P[i, 1]), 6) if i is not None and P.shape[1] > 1 else None,
+        })
+    payload = {
+        "method": "positioning",
+        "clusters": int(len(basis.cluster_centers)),
+        "points": points,
+        "basis": {
+            "fittedAt": basis.fitted_at,
+            "refitted": bool(refitted),
+            "drift": None if drift is None else round(float(drift), 6),
+            "explainedVariance": [round(float(v), 6) for v in basis.evr],
+        },
+    }
+    os.makedirs(map_dir, exist_ok=True)
+    if refitted:
+        basis.save(basis_path)
+    with open(pathlib.Path(map_dir) / "market_map.json", "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    return payload
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="品牌嵌入的 randomized SVD 投影與分群（市場地圖）")
+    parser.add_argument("--refit", action="store_true", help="忽略既有基底，強制重擬合")
+    parser.add_argument("--drift_tol", type=float, default=DRIFT_TOL)
+    args = parser.parse_args()
+    payload = build(refit=args.refit, drift_tol=args.drift_tol)
+    print(json.dumps({"brands": len(payload["points"]), **payload["basis"]}, ensure_ascii=False))
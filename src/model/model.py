@@ -15,6 +15,18 @@ from sklearn.cluster import MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LinearRegression
 import easyocr
+from spherical_kmeans import spherical_kmeans, compare_anchor_fitters, format_comparison
+from anchor_index import AnchorIndex
+import feature_store
+from post_index import PostIndex
+import brand_similarity
+import engagement_moments
+import quantile_sketch
+import aggregate_store
+import trend_builder
+import market_map
+import columnar
+import instrument
 
 
 # 設定路徑
@@ -34,13 +46,23 @@ os.makedirs(OUT_DIR, exist_ok=True)
 CACHE_DIR = f'{BASE_DIR}/cache'
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# 各階段的 wall / CPU time、peak RSS 增量與筆數，最後寫到 outputs/model_timings.json
+_timings = instrument.start_recording()
+
 # ===================================
 # ==== Cell 3: 匯入、函式 ========
 # ===================================
 
 # ---- 有待調整!! ----
 K_CLUSTERS = 6
+ANCHOR_FITTER = 'spherical'        # 'spherical'（full-batch）/ 'spherical-minibatch' / 'minibatch-kmeans'（舊版 Euclidean）
+ANCHOR_SAMPLE_WEIGHT = True        # 錨點擬合是否使用 brand 反比權重 train_weights
+COMPARE_ANCHOR_FITTERS = False     # True 時印出各擬合方式的 fit 時間與 novelty 品質
+ANCHOR_INDEX_K = 0                 # >0 時每模態改用 K 個錨點的兩層索引（coarse/fine），取代 K_CLUSTERS 個中心
+ANCHOR_TOPK = 32                   # 大 K 時 diversity 只看 top-k sims
+ANCHOR_N_PROBE = None              # 兩層索引展開幾個 coarse 格（None = max(2, C/8)）
 TAU = 0.07                 # diversity 用的 softmax 溫度
+COMMENT_WEIGHT = 5.0       # y 中留言相對按讚的權重（其他權重的相關係數由 engagement_moments 直接查）
 OCR_MAX_IMAGES = 1         # 每篇最多 OCR 幾張
 IMG_MAX_IMAGES = 1         # 每篇最多取幾張圖算影像嵌入
 SEED = 42
@@ -441,6 +463,7 @@ def get_img_emb_with_cache(pil_img, path_hint, model_tag=""):
 # 在 Cell 6 設定的模型身分（例如 'chinese-clip' 或 'openai-clip'）
 MODEL_TAG = MODEL_BACKEND  # 也可用 MODEL_ID_CN/MODEL_ID_EN 更細
 
+@instrument.timed('embedding', items=lambda df, *a, **k: len(df))
 def build_modal_embeddings(df, img_dir, split_name='train'):
     """
     回傳：
@@ -538,20 +561,33 @@ image_test_vec  = img_test.astype(np.float32)
 meta_train_vec  = num_train_vec_scaled.astype(np.float32)
 meta_test_vec   = num_test_vec_scaled.astype(np.float32)
 
+# 特徵落地（近鄰索引、品牌相似度等離線工作直接讀，不必重跑 OCR / CLIP）
+feature_store.save_split('train', train[brand_col], train[caption_col], train[time_col],
+                         cap_train, ocr_train, img_train, meta_train_vec)
+feature_store.save_split('test',  test[brand_col],  test[caption_col],  test[time_col],
+                         cap_test,  ocr_test,  img_test,  meta_test_vec)
+
 # =======================================
 # ==== Cell 10: Novelty / Diversity  ====
 # =======================================
-def fit_anchors(X, k=K_CLUSTERS, random_state=SEED):
+def fit_anchors(X, k=K_CLUSTERS, random_state=SEED, sample_weight=None, method=ANCHOR_FITTER):
     """
-    訓練期建立 K-means 中心（錨點）
-    這裡使用 MiniBatchKMeans 以支援 sample_weight（較節省記憶體）
+    訓練期建立 K-means 中心（錨點），中心皆 L2 normalize。
+    - 'spherical' / 'spherical-minibatch'：球面 K-means，與推論端 cosine 打分一致
+    - 'minibatch-kmeans'：舊版 Euclidean MiniBatchKMeans，事後才 normalize 中心
     """
-    km = MiniBatchKMeans(n_clusters=k, random_state=random_state, batch_size=512, n_init='auto')
-    km.fit(X)
-    centers = km.cluster_centers_
-    # 對中心做 L2 normalize（讓 cosine 更穩）
-    centers = centers / (np.linalg.norm(centers, axis=1, keepdims=True) + 1e-9)
-    return centers
+    if method == 'minibatch-kmeans':
+        km = MiniBatchKMeans(n_clusters=k, random_state=random_state, batch_size=512, n_init='auto')
+        km.fit(X, sample_weight=sample_weight)
+        centers = km.cluster_centers_
+        # 對中心做 L2 normalize（讓 cosine 更穩）
+        centers = centers / (np.linalg.norm(centers, axis=1, keepdims=True) + 1e-9)
+        return centers
+    if method in ('spherical', 'spherical-minibatch'):
+        mode = 'minibatch' if method == 'spherical-minibatch' else 'full'
+        centers, _ = spherical_kmeans(X, k, sample_weight=sample_weight, mode=mode, random_state=random_state)
+        return centers
+    raise ValueError(f"未知的 ANCHOR_FITTER：{method}")
 
 def compute_novelty(X, centers):
     """
@@ -586,12 +622,25 @@ def minmax_transform(x, mn, mx):
         return np.zeros_like(x, dtype=np.float32)
     return ((x - mn) / (mx - mn)).astype(np.float32)
 
-def compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU):
-    # anchors
-    centers = fit_anchors(train_vec, k=k)
-    # novelty
-    nov_tr_raw, sims_tr = compute_novelty(train_vec, centers)
-    nov_te_raw, sims_te = compute_novelty(test_vec,  centers)
+def compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU, sample_weight=None, name=''):
+    index = None
+    if ANCHOR_INDEX_K > 0:
+        # 大 K：兩層索引，novelty / diversity 皆由 top-k sims 計算
+        k_fine = min(ANCHOR_INDEX_K, max(k, len(train_vec) // 2))
+        index = AnchorIndex.build(train_vec, k_fine, sample_weight=sample_weight, random_state=SEED)
+        centers = index.fine
+        sims_tr = index.query(train_vec, topk=ANCHOR_TOPK, n_probe=ANCHOR_N_PROBE)
+        sims_te = index.query(test_vec,  topk=ANCHOR_TOPK, n_probe=ANCHOR_N_PROBE)
+        nov_tr_raw, nov_te_raw = 1.0 - sims_tr[:, 0], 1.0 - sims_te[:, 0]
+    else:
+        # anchors
+        if COMPARE_ANCHOR_FITTERS:
+            print(format_comparison(compare_anchor_fitters(train_vec, k, sample_weight=sample_weight, random_state=SEED),
+                                    title=f'({name}, k={k})'))
+        centers = fit_anchors(train_vec, k=k, sample_weight=sample_weight)
+        # novelty
+        nov_tr_raw, sims_tr = compute_novelty(train_vec, centers)
+        nov_te_raw, sims_te = compute_novelty(test_vec,  centers)
     # min-max（訓練集為準，離群納入）
     mn, mx = minmax_fit(nov_tr_raw)
     nov_tr = minmax_transform(nov_tr_raw, mn, mx)
@@ -600,7 +649,7 @@ def compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU):
     div_tr = compute_diversity_from_sims(sims_tr, tau=tau).astype(np.float32)
     div_te = compute_diversity_from_sims(sims_te, tau=tau).astype(np.float32)
     return {
-        'centers': centers,
+        'centers': centers, 'index': index,
         'nov_tr': nov_tr, 'nov_te': nov_te,
         'div_tr': div_tr, 'div_te': div_te,
         'nov_min': mn, 'nov_max': mx
@@ -610,8 +659,8 @@ def compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU):
 # ==== Cell 11: Phase 1（各模態學權重）====
 # =========================================
 # 目標變數 y（其實可以再改!!）
-def compute_y(likes, comments, followers):
-    return (likes + 5.0*comments) / (followers + 0.01)
+def compute_y(likes, comments, followers, comment_weight=COMMENT_WEIGHT):
+    return (likes + comment_weight*comments) / (followers + 0.01)
 
 train['y'] = compute_y(train['count_like'].fillna(0).to_numpy(),
                        train['count_comment'].fillna(0).to_numpy(),
@@ -646,8 +695,10 @@ def learn_wN_wD(nov_tr, div_tr, y_tr, sample_weight=None):
         wN, wD = (beta / (beta.sum()+1e-9)).tolist()
     return float(wN), float(wD), lr
 
+@instrument.timed('ds_scoring', items=lambda train_vec, test_vec, *a, **k: len(train_vec) + len(test_vec))
 def phase1_per_modality(train_vec, test_vec, y_tr, sample_weight=None, name='text'):
-    pack = compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU)
+    anchor_weight = sample_weight if ANCHOR_SAMPLE_WEIGHT else None
+    pack = compute_modality_scores(train_vec, test_vec, k=K_CLUSTERS, tau=TAU, sample_weight=anchor_weight, name=name)
     wN, wD, lr = learn_wN_wD(pack['nov_tr'], pack['div_tr'], y_tr, sample_weight=sample_weight)
     # Distinctiveness Score（DS）與 風險 ATI
     DS_tr = (wN*pack['nov_tr'] + wD*pack['div_tr']).astype(np.float32)
@@ -656,7 +707,7 @@ def phase1_per_modality(train_vec, test_vec, y_tr, sample_weight=None, name='tex
     ATI_te = 100.0*(1.0 - DS_te)
     return {
         'name': name,
-        'centers': pack['centers'],
+        'centers': pack['centers'], 'index': pack['index'],
         'nov_tr': pack['nov_tr'], 'nov_te': pack['nov_te'],
         'div_tr': pack['div_tr'], 'div_te': pack['div_te'],
         'wN': wN, 'wD': wD,
@@ -676,6 +727,8 @@ phase1_meta  = phase1_per_modality(meta_train_vec,  meta_test_vec,  train['y'].t
 # 依老師建議：用三個「模態 ATI」來合成最終 ATI
 # 但為了與 y 呈現正向關係更直觀，在回歸時用「DS」（越大越好）來學權重，再轉回 ATI。
 
+_span = instrument.span('phase2_fit', items=len(train) + len(test)); _span.__enter__()
+
 # Train 組合
 DS_text_tr  = phase1_text['DS_tr']
 DS_image_tr = phase1_image['DS_tr']
@@ -701,6 +754,7 @@ DS_final_te = (v[0]*DS_text_te + v[1]*DS_image_te + v[2]*DS_meta_te).astype(np.f
 
 ATI_final_tr = 100.0*(1.0 - DS_final_tr)
 ATI_final_te = 100.0*(1.0 - DS_final_te)
+_span.__exit__(None, None, None)
 
 # 保存權重，方便簡報
 weights_summary = {
@@ -745,11 +799,27 @@ post_train_out['ocr_text'] = train['ocr_text']
 post_test_out['caption']   = test[caption_col]
 post_test_out['ocr_text']  = test['ocr_text']
 
-# 存檔
+post_train_out['ftime_parsed'] = train[time_col]
+post_test_out['ftime_parsed']  = test[time_col]
+
+_span = instrument.span('output_writing', items=len(post_train_out) + len(post_test_out)); _span.__enter__()
+
+# 存檔（CSV 給 Node 端；欄式檔供 Python 端依欄位投影讀取，文字欄另存）
 train_csv_out = os.path.join(OUT_DIR, 'ati_train_per_post.csv')
 test_csv_out  = os.path.join(OUT_DIR, 'ati_test_per_post.csv')
 post_train_out.to_csv(train_csv_out, index=False)
 post_test_out.to_csv(test_csv_out, index=False)
+columnar.write_per_post(post_train_out, train_csv_out)
+columnar.write_per_post(post_test_out,  test_csv_out)
+
+# 可合併的分位數 sketch（ATI / 各模態 ATI / y，全體 + 每品牌），供十分位數與高風險門檻
+quantile_sketch.save_split(post_train_out, 'train', brand_col=brand_col)
+quantile_sketch.save_split(post_test_out,  'test',  brand_col=brand_col)
+
+# 增量品牌彙總（outputs/aggregates.sqlite）：train/test 全量重建，infer_ati.py 之後逐批累加
+with aggregate_store.AggregateStore() as _agg:
+    _agg.replace_source(post_train_out, 'train', brand_col=brand_col, time_col='ftime_parsed')
+    _agg.replace_source(post_test_out,  'test',  brand_col=brand_col, time_col='ftime_parsed')
 
 # 品牌彙總（測試期）
 brand_test_agg = post_test_out.groupby(brand_col).agg(
@@ -762,9 +832,11 @@ brand_test_agg = post_test_out.groupby(brand_col).agg(
 
 brand_csv_out = os.path.join(OUT_DIR, 'ati_test_brand_agg.csv')
 brand_test_agg.to_csv(brand_csv_out, index=False)
+_span.__exit__(None, None, None)
 
 # === save artifacts for inference ===
 
+_span = instrument.span('artifact_writing'); _span.__enter__()
 ART_DIR = pathlib.Path(OUT_DIR) / "ati_artifacts"
 ART_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -773,6 +845,11 @@ np.save(ART_DIR / "centers_text.npy",  phase1_text["centers"])
 np.save(ART_DIR / "centers_image.npy", phase1_image["centers"])
 np.save(ART_DIR / "centers_meta.npy",  phase1_meta["centers"])
 
+# 大 K 兩層索引（ANCHOR_INDEX_K > 0 時）
+for _p1 in (phase1_text, phase1_image, phase1_meta):
+    if _p1["index"] is not None:
+        _p1["index"].save(ART_DIR / f"anchor_index_{_p1['name']}.npz")
+
 # numeric scaler
 joblib.dump(scaler, ART_DIR / "numeric_scaler.joblib")
 
@@ -783,7 +860,11 @@ cfg = {
     "MODEL_ID_EN": MODEL_ID_EN,
     "PROJ_DIM": int(PROJ_DIM),
     "K_CLUSTERS": int(K_CLUSTERS),
+    "ANCHOR_FITTER": ANCHOR_FITTER,
+    "ANCHOR_SAMPLE_WEIGHT": bool(ANCHOR_SAMPLE_WEIGHT),
     "TAU": float(TAU),
+    "ANCHOR_INDEX": ({"K": int(phase1_text["index"].n_fine), "topk": int(ANCHOR_TOPK),
+                      "n_probe": ANCHOR_N_PROBE} if ANCHOR_INDEX_K > 0 else None),
     "IMG_MAX_IMAGES": int(IMG_MAX_IMAGES),
     "OCR_MAX_IMAGES": int(OCR_MAX_IMAGES),
     "phase1": {
@@ -797,4 +878,26 @@ cfg = {
     "phase2_v": [float(v[0]), float(v[1]), float(v[2])]
 }
 with open(ART_DIR / "config.json", "w", encoding="utf-8") as f:
-    json.dump(cfg, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+    json.dump(cfg, f, ensure_ascii=False, indent=2)
+_span.__exit__(None, None, None)
+
+_span = instrument.span('derived_tables'); _span.__enter__()
+
+# 歷史貼文近鄰索引（outputs/post_index，與 ati_artifacts 並列）
+PostIndex.build_from_feature_store('train').save()
+
+# 品牌相似度矩陣與 top-K 鄰居（outputs/brand_similarity，供 /api/brand/:brandName/similar 查表）
+brand_similarity.build()
+
+# 留言權重 w 的相關係數充分統計量（src/data/generated/engagement_moments.json，供 engagement-scaling 查表）
+engagement_moments.build_and_export()
+
+# 日 / 週 / 月趨勢與滾動視窗（outputs/trends，供 /api/market/trend 直接查表）
+trend_builder.build_all()
+
+# 市場地圖：品牌嵌入的 randomized SVD 投影 + 分群（outputs/market_map，/api/market/map 直接回傳）
+market_map.build()
+_span.__exit__(None, None, None)
+
+with open(os.path.join(OUT_DIR, 'model_timings.json'), 'w', encoding='utf-8') as f:
+    json.dump(_timings.to_dict(), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,157 @@
+# src/model/post_index.py
+"""
+歷史貼文近鄰檢索：回答「ATI 高是因為像誰？」。
+
+每個模態（text / image）一個 IVF 索引：以球面 K-means 把訓練貼文分成
+n_lists ≈ √N 個倒排串列（或直接沿用 ati_artifacts 的錨點當串列中心），
+查詢時只掃最相近的 n_probe 個串列。索引由 feature store 建立，
+存在 outputs/post_index/，與 ati_artifacts 並列。
+"""
+import os, json, math, hashlib, pathlib, argparse
+import numpy as np
+
+from spherical_kmeans import spherical_kmeans
+import feature_store
+
+BASE_DIR = "./src/model"
+INDEX_DIR = pathlib.Path(BASE_DIR) / "outputs" / "post_index"
+MODALITIES = ("text", "image")
+SNIPPET_LEN = 80
+
+_EPS = 1e-9
+
+
+def _norm_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + _EPS)
+
+
+def clean_snippet(value, max_length=SNIPPET_LEN):
+    cleaned = " ".join(str(value or "").split())
+    if len(cleaned) <= max_length:
+        return cleaned
+    return cleaned[:max_length].rstrip() + "…"
+
+
+class IVFIndex:
+    def __init__(self, centroids, vectors, post_ids, offsets):
+        """vectors / post_ids 依所屬串列排序；第 c 串列為 [offsets[c], offsets[c+1])。"""
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.post_ids = np.asarray(post_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def build(cls, X, n_lists=None, centroids=None, random_state=42):
+        """零向量（例如無圖片貼文）不進索引。centroids 給定時直接當串列中心（IVF over anchors）。"""
+        Xn = _norm_rows(X)
+        keep = np.flatnonzero(np.linalg.norm(Xn, axis=1) > 0.5)
+        Xk = Xn[keep]
+        if centroids is None:
+            n_lists = n_lists or max(1, int(round(math.sqrt(len(Xk)))))
+            centroids, _ = spherical_kmeans(Xk, min(n_lists, len(Xk)), mode='full', random_state=random_state)
+        centroids = _norm_rows(centroids)
+        labels = (Xk @ centroids.T).argmax(axis=1)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=len(centroids)))
+        return cls(centroids, Xk[order], keep[order], offsets)
+
+    def search(self, q, top_n=5, n_probe=None):
+        """q: [d]；回傳 [(post_id, cosine), ...]（遞減）。"""
+        qn = np.asarray(q, dtype=np.float32)
+        norm = float(np.linalg.norm(qn))
+        if norm < _EPS or len(self.vectors) == 0:
+            return []
+        qn = qn / norm
+        C = len(self.centroids)
+        n_probe = min(C, n_probe or max(2, C // 8))
+        probe = np.argpartition(-(self.centroids @ qn), n_probe - 1)[:n_probe] if n_probe < C else np.arange(C)
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        if rows.size == 0:
+            return []
+        sims = self.vectors[rows] @ qn
+        top = min(top_n, rows.size)
+        best = np.argpartition(-sims, top - 1)[:top]
+        best = best[np.argsort(-sims[best])]
+        return [(int(self.post_ids[rows[i]]), float(sims[i])) for i in best]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, vectors=self.vectors, post_ids=self.post_ids, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["centroids"], z["vectors"], z["post_ids"], z["offsets"])
+
+
+def index_version(index_dir=INDEX_DIR):
+    """索引檔案的名稱 / 大小 / mtime 雜湊（只 stat 不讀檔）；重建後就會改變，不存在時為 ""。"""
+    index_dir = pathlib.Path(index_dir)
+    if not (index_dir / "posts.json").exists():
+        return ""
+    h = hashlib.sha1()
+    for path in sorted(index_dir.glob("*")):
+        if path.is_file():
+            st = path.stat()
+            h.update(f"{path.name}\x00{st.st_size}\x00{st.st_mtime_ns}\x00".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+class PostIndex:
+    """text / image 兩個 IVF 加上貼文中繼資料（brand、caption 片段、時間）。"""
+    def __init__(self, indexes, posts):
+        self.indexes = indexes
+        self.posts = posts
+
+    @classmethod
+    def build_from_feature_store(cls, split="train", n_lists=None, anchor_dir=None):
+        feats = feature_store.load_split(split)
+        vecs = {"text": feature_store.text_vectors(feats), "image": feats["img_emb"]}
+        indexes = {}
+        for m in MODALITIES:
+            centroids = None
+            if anchor_dir is not None and (pathlib.Path(anchor_dir) / f"centers_{m}.npy").exists():
+                centroids = np.load(pathlib.Path(anchor_dir) / f"centers_{m}.npy")
+            indexes[m] = IVFIndex.build(vecs[m], n_lists=n_lists, centroids=centroids)
+        posts = [{"brand": str(b), "captionSnippet": clean_snippet(c), "date": str(t)[:10]}
+                 for b, c, t in zip(feats["brand"], feats["caption"], feats["ftime_parsed"])]
+        return cls(indexes, posts)
+
+    def search(self, vectors, top_n=5, n_probe=None):
+        """vectors: {"text": [d], "image": [d]}；回傳每模態的近鄰貼文清單。"""
+        out = {}
+        for m, q in vectors.items():
+            if m not in self.indexes:
+                continue
+            out[m] = [{**self.posts[pid], "postIndex": pid, "similarity": round(sim, 4)}
+                      for pid, sim in self.indexes[m].search(q, top_n=top_n, n_probe=n_probe)]
+        return out
+
+    def save(self, index_dir=INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        for m, idx in self.indexes.items():
+            idx.save(pathlib.Path(index_dir) / f"ivf_{m}.npz")
+        with open(pathlib.Path(index_dir) / "posts.json", "w", encoding="utf-8") as f:
+            json.dump(self.posts, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        index_dir = pathlib.Path(index_dir)
+        with open(index_dir / "posts.json", "r", encoding="utf-8") as f:
+            posts = json.load(f)
+        indexes = {m: IVFIndex.load(index_dir / f"ivf_{m}.npz")
+                   for m in MODALITIES if (index_dir / f"ivf_{m}.npz").exists()}
+        return cls(indexes, posts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由 feature store 建立歷史貼文近鄰索引")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--n_lists", type=int, default=None, help="IVF 串列數（預設 √N）")
+    parser.add_argument("--use_anchors", action="store_true", help="以 ati_artifacts 的錨點當串列中心")
+    args = parser.parse_args()
+    anchor_dir = pathlib.Path(BASE_DIR) / "outputs" / "ati_artifacts" if args.use_anchors else None
+    index = PostIndex.build_from_feature_store(args.split, n_lists=args.n_lists, anchor_dir=anchor_dir)
+    index.save()
+    print(json.dumps({m: {"lists": len(i.centroids), "posts": len(i.vectors)} for m, i in index.indexes.items()}))
@@ -0,0 +1,232 @@
+# src/model/prefork.py
+"""
+多核主機的 prefork 打分服務：模型只載入一次，fork 出 N 個 worker 共用權重。
+
+- 父程序先載入 torch / CLIP / processor / OCR / ArtifactBundle，並把 torch
+  intra-op 執行緒設成 1（fork 前不做任何 forward，避免 OpenMP 執行緒池在子程序中失效）
+- os.fork() 之後權重張量的記憶體頁是 copy-on-write：推論只讀不寫，
+  N 個 worker 實際只有一份 ~600MB 的 CLIP 權重（看 PSS / Shared 而不是 RSS）
+- 每個 worker 綁定 cpu 子集（sched_setaffinity）並 torch.set_num_threads(threads)，
+  預設 threads = 可用核心數 // workers
+- 所有 worker 在同一個 listening socket 上 accept（ati_server.ATIServer），
+  由 kernel 分派連線；worker 異常結束時父程序補一個新的。子程序的例外印到 stderr；
+  剛啟動就結束的 worker 以指數退避重啟，連續 MAX_RAPID_RESTARTS 次就放棄該 worker
+- benchmark()：以 test CSV 的 caption 打 /score，回報各 worker 數的吞吐量與
+  每個 worker 的 RSS / PSS / Shared
+
+python src/model/prefork.py --workers 8
+python src/model/prefork.py --benchmark 1,2,4,8 --requests 200
+"""
+import os, sys, json, time, socket, signal, asyncio, argparse, threading, traceback, subprocess, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+import infer_ati
+import ati_server
+
+BASE_DIR = "./src/model"
+TEST_CSV = f"{BASE_DIR}/with_rel_paths_test_posts.csv"
+BACKLOG = 512
+PRELOAD = ("torch", "tokenizer", "clip_model", "image_processor", "ocr")
+MIN_UPTIME_S = 10.0        # 比這更早結束的 worker 視為啟動失敗
+RESTART_BACKOFF_S = 0.5    # 第 n 次連續失敗後等 RESTART_BACKOFF_S * 2**(n-1) 秒
+RESTART_BACKOFF_MAX_S = 30.0
+MAX_RAPID_RESTARTS = 5
+
+
+def available_cores():
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+
+def preload():
+    """fork 前在父程序載入共用的模型元件（不含需要 forward 的 empty_text_emb）。"""
+    infer_ati.get_torch().set_num_threads(1)
+    load_times = infer_ati.warmup(PRELOAD)
+    t0 = time.perf_counter()
+    infer_ati.get_bundle()
+    load_times["bundle"] = round(time.perf_counter() - t0, 4)
+    return load_times
+
+
+def pin_worker(worker_id, threads):
+    """worker i 綁定第 i 段 threads 個核心，並固定 torch intra-op 執行緒數。"""
+    cores = available_cores()
+    mine = cores[worker_id * threads:(worker_id + 1) * threads] or cores
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, mine)
+    infer_ati.get_torch().set_num_threads(threads)
+    return mine
+
+
+def _worker_main(sock, worker_id, threads, max_inflight):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    pin_worker(worker_id, threads)
+    # 執行緒不會跟著 fork，每個 worker 各自監看產物指標檔
+    infer_ati.get_bundle_manager().watch(infer_ati.BUNDLE_POLL_S)
+
+    async def run():
+        server = await ati_server.ATIServer(max_inflight=max_inflight, sock=sock).start()
+        await server.serve_forever()
+    asyncio.run(run())
+
+
+def _fork_worker(sock, worker_id, threads, max_inflight):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _worker_main(sock, worker_id, threads, max_inflight)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            print(f"[prefork] worker {worker_id} (pid {os.getpid()}) crashed:", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            code = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(code)
+    return pid
+
+
+def _log(**fields):
+    print(json.dumps(fields, ensure_ascii=False), file=sys.stderr, flush=True)
+
+
+def serve(workers, threads=None, host=ati_server.HOST, port=ati_server.PORT, max_inflight=ati_server.MAX_INFLIGHT):
+    threads = threads or max(1, len(available_cores()) // workers)
+    load_times = preload()
+    sock = socket.create_server((host, port), backlog=BACKLOG)
+    sock.setblocking(False)
+    children = {_fork_worker(sock, i, threads, max_inflight): i for i in range(workers)}
+    started = {pid: time.monotonic() for pid in children}
+    failures = {i: 0 for i in range(workers)}
+    print(json.dumps({"listening": f"http://{host}:{sock.getsockname()[1]}", "workers": list(children),
+                      "threads_per_worker": threads, "load_times": load_times}), flush=True)
+
+    stopping = threading.Event()
+    def _stop(signum, frame):
+        stopping.set()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if stopping.is_set() or worker_id is None:
+            continue
+        uptime = time.monotonic() - started.pop(pid)
+        failures[worker_id] = failures[worker_id] + 1 if uptime < MIN_UPTIME_S else 0
+        if failures[worker_id] >= MAX_RAPID_RESTARTS:
+            _log(worker=worker_id, pid=pid, exit_code=os.waitstatus_to_exitcode(status), uptime_s=round(uptime, 2),
+                 error=f"exited {failures[worker_id]} times in a row within {MIN_UPTIME_S}s; not restarting")
+            continue
+        delay = min(RESTART_BACKOFF_MAX_S, RESTART_BACKOFF_S * 2 ** (failures[worker_id] - 1)) if failures[worker_id] else 0.0
+        _log(worker=worker_id, pid=pid, exit_code=os.waitstatus_to_exitcode(status), uptime_s=round(uptime, 2), restart_in_s=delay)
+        if stopping.wait(delay):
+            continue
+        new_pid = _fork_worker(sock, worker_id, threads, max_inflight)
+        children[new_pid] = worker_id
+        started[new_pid] = time.monotonic()
+    sock.close()
+
+
+# ---------- 記憶體與吞吐量報告 ----------
+def child_pids(pid):
+    path = f"/proc/{pid}/task/{pid}/children"
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [int(p) for p in f.read().split()]
+
+
+def memory_mb(pid):
+    """/proc/<pid>/smaps_rollup 的 RSS、PSS（共用頁按使用程序數均分）與共用頁大小。"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    mb = lambda kb: round(kb / 1024, 1)
+    return {"rss_mb": mb(fields.get("Rss", 0)), "pss_mb": mb(fields.get("Pss", 0)),
+            "shared_mb": mb(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0))}
+
+
+def sample_captions(n, csv_path=TEST_CSV):
+    caps = pd.read_csv(csv_path, usecols=["sum"])["sum"].fillna("").astype(str)
+    caps = caps[caps.str.strip() != ""].tolist() or ["測試"]
+    return [caps[i % len(caps)] for i in range(n)]
+
+
+def _post(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=300) as r:
+        return r.read()
+
+
+def benchmark(worker_counts=(1, 2, 4, 8), n_requests=200, concurrency=None, threads=None, host="127.0.0.1"):
+    """每種 worker 數各起一個 prefork 服務，以 concurrency 個客戶端打 /score。"""
+    captions = sample_captions(n_requests)
+    report = []
+    for workers in worker_counts:
+        cmd = [sys.executable, os.path.abspath(__file__), "--workers", str(workers), "--host", host, "--port", "0"]
+        if threads:
+            cmd += ["--threads", str(threads)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        try:
+            info = json.loads(proc.stdout.readline())
+            url = info["listening"] + "/score"
+            c = concurrency or workers * 2
+            # 先打一輪讓各 worker 完成 lazy 初始化（empty_text_emb、scheduler、stage pool）
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                list(pool.map(lambda t: _post(url, {"text": t, "similar": 0}), captions[:c * 2]))
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                list(pool.map(lambda t: _post(url, {"text": t, "similar": 0}), captions))
+            elapsed = time.perf_counter() - t0
+            mem = {pid: memory_mb(pid) for pid in child_pids(proc.pid)}
+            report.append({
+                "workers": workers,
+                "threads_per_worker": info["threads_per_worker"],
+                "concurrency": c,
+                "requests": n_requests,
+                "elapsed_s": round(elapsed, 3),
+                "throughput_rps": round(n_requests / elapsed, 2),
+                "parent": memory_mb(proc.pid),
+                "per_worker": list(mem.values()),
+                "total_rss_mb": round(sum(m["rss_mb"] for m in mem.values()), 1),
+                "total_pss_mb": round(sum(m["pss_mb"] for m in mem.values()) + memory_mb(proc.pid)["pss_mb"], 1),
+            })
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模型載入一次、fork N 個 worker 共用權重的打分服務")
+    parser.add_argument("--workers", type=int, default=max(1, len(available_cores()) // 4))
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads per worker（預設 核心數 // workers）")
+    parser.add_argument("--host", type=str, default=ati_server.HOST)
+    parser.add_argument("--port", type=int, default=ati_server.PORT)
+    parser.add_argument("--max_inflight", type=int, default=ati_server.MAX_INFLIGHT)
+    parser.add_argument("--benchmark", type=str, default=None, help="逗號分隔的 worker 數，例如 1,2,4,8")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        counts = [int(w) for w in args.benchmark.split(",")]
+        print(json.dumps(benchmark(counts, args.requests, args.concurrency, args.threads), ensure_ascii=False))
+    else:
+        serve(args.workers, args.threads, args.host, args.port, args.max_inflight)
@@ -0,0 +1,246 @@
+# src/model/quantile_sketch.py
+"""
+可合併的串流分位數 sketch（KLL），給 ATI 十分位數與高風險門檻用。
+
+- 每層 compactor 滿了就排序、隨機取奇/偶位置一半升到上一層（權重 ×2），
+  記憶體約 3k 個 float，與貼文數無關；rank 誤差 O(1/k)（k=200 約 1%）
+- merge() 逐層串接後再壓縮，不同打分分片（train/test、infer 批次）可直接合併
+- 另外保留 n / sum / min / max，品牌平均不必回頭讀 per-post 表
+
+SketchStore 以 (metric, brand) 為鍵，brand = '__all__' 為全體；
+model.py 打分後寫 outputs/quantile_sketches/sketch_{split}.json，
+infer_ati.py --csv 的結果併入 sketch_infer.json。
+"""
+import os, json, math, random, pathlib, argparse
+import numpy as np
+
+BASE_DIR = "./src/model"
+SKETCH_DIR = pathlib.Path(BASE_DIR) / "outputs" / "quantile_sketches"
+METRICS = ("ATI_final", "text_ATI", "image_ATI", "meta_ATI", "y")
+ALL = "__all__"
+DEFAULT_K = 200
+_C = 2.0 / 3.0
+
+
+class KLLSketch:
+    def __init__(self, k=DEFAULT_K, seed=None):
+        self.k = int(k)
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self.n = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._rng = random.Random(seed)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(2, int(math.ceil(self.k * _C ** depth)))
+
+    def _size(self):
+        return sum(len(lv) for lv in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h in range(len(self.levels)):
+                if len(self.levels[h]) < self._capacity(h):
+                    continue
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, dtype=np.float64))
+                buf = np.sort(self.levels[h])
+                keep = buf[-1:] if len(buf) % 2 else buf[:0]   # 奇數個時最大值留在本層
+                pairs = buf[:len(buf) - len(keep)]
+                promoted = pairs[self._rng.randint(0, 1)::2]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.levels[h] = keep
+                break
+
+    def update(self, values):
+        """values: 純量或陣列；NaN / inf 略過。"""
+        x = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        x = x[np.isfinite(x)]
+        if x.size == 0:
+            return self
+        self.n += int(x.size)
+        self.sum += float(x.sum())
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+        self.levels[0] = np.concatenate([self.levels[0], x])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        for h, lv in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], lv])
+        self.n += other.n
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _sorted_weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lv), 2 ** h, dtype=np.float64) for h, lv in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], np.cumsum(weights[order])
+
+    @property
+    def mean(self):
+        return self.sum / self.n if self.n else 0.0
+
+    def quantiles(self, qs):
+        """第一個累積權重 > q·W 的元素；q=0 / 1 回傳精確的 min / max。"""
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        items, cum = self._sorted_weighted()
+        idx = np.searchsorted(cum, qs * cum[-1], side="right")
+        out = items[np.minimum(idx, len(items) - 1)]
+        out[qs <= 0] = self.min
+        out[qs >= 1] = self.max
+        return out
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def rank(self, x):
+        """≤ x 的比例（近似 CDF）。"""
+        if self.n == 0:
+            return 0.0
+        items, cum = self._sorted_weighted()
+        i = np.searchsorted(items, x, side="right")
+        return float(cum[i - 1] / cum[-1]) if i > 0 else 0.0
+
+    def deciles(self, num=10):
+        """num-1 個內部切點（十分位數邊界）。"""
+        return self.quantiles(np.arange(1, num) / num)
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "sum": self.sum,
+                "min": self.min if self.n else None, "max": self.max if self.n else None,
+                "levels": [lv.tolist() for lv in self.levels]}
+
+    @classmethod
+    def from_dict(cls, d):
+        sk = cls(k=d["k"])
+        sk.levels = [np.asarray(lv, dtype=np.float64) for lv in d["levels"]] or [np.empty(0)]
+        sk.n, sk.sum = int(d["n"]), float(d["sum"])
+        sk.min = math.inf if d["min"] is None else float(d["min"])
+        sk.max = -math.inf if d["max"] is None else float(d["max"])
+        return sk
+
+
+class SketchStore:
+    """{(metric, brand): KLLSketch}；brand = '__all__' 為全體。"""
+    def __init__(self, k=DEFAULT_K, sketches=None, batches=None):
+        self.k = k
+        self.sketches = sketches or {}
+        self.batches = set(batches or ())  # 已併入的 batch_id（merge_into 去重用）
+
+    def get(self, metric, brand=ALL):
+        key = (metric, brand)
+        if key not in self.sketches:
+            self.sketches[key] = KLLSketch(self.k)
+        return self.sketches[key]
+
+    def update_frame(self, df, brand_col="brand", metrics=METRICS):
+        """df 中沒有的欄位略過（例如 infer 輸入沒有 y）。"""
+        brands = df[brand_col].astype(str).to_numpy() if brand_col in df.columns else None
+        for m in metrics:
+            if m not in df.columns:
+                continue
+            x = df[m].to_numpy(dtype=np.float64)
+            self.get(m).update(x)
+            if brands is None:
+                continue
+            for b in np.unique(brands):
+                self.get(m, b).update(x[brands == b])
+        return self
+
+    def merge(self, other):
+        for key, sk in other.sketches.items():
+            self.get(*key).merge(sk)
+        self.batches |= other.batches
+        return self
+
+    def brands(self, metric="ATI_final"):
+        return sorted(b for (m, b) in self.sketches if m == metric and b != ALL)
+
+    def brand_means(self, metric="ATI_final"):
+        return {b: self.sketches[(metric, b)].mean for b in self.brands(metric)}
+
+    def to_dict(self):
+        return {"k": self.k, "batches": sorted(self.batches),
+                "sketches": [{"metric": m, "brand": b, **sk.to_dict()} for (m, b), sk in sorted(self.sketches.items())]}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["k"], {(s["metric"], s["brand"]): KLLSketch.from_dict(s) for s in d["sketches"]},
+                   d.get("batches"))
+
+    def save(self, path):
+        path = pathlib.Path(path)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def sketch_path(name, sketch_dir=SKETCH_DIR):
+    return pathlib.Path(sketch_dir) / f"sketch_{name}.json"
+
+
+def save_split(df, name, sketch_dir=SKETCH_DIR, brand_col="brand", k=DEFAULT_K):
+    store = SketchStore(k).update_frame(df, brand_col=brand_col)
+    store.save(sketch_path(name, sketch_dir))
+    return store
+
+
+def merge_into(df, name, sketch_dir=SKETCH_DIR, brand_col="brand", batch_id=None):
+    """把新打分的一批貼文併入既有 sketch 檔（不存在就新建）；batch_id 已併入過則回傳 False。"""
+    path = sketch_path(name, sketch_dir)
+    store = SketchStore.load(path) if path.exists() else SketchStore()
+    if batch_id is not None:
+        if batch_id in store.batches:
+            return False
+        store.batches.add(batch_id)
+    store.update_frame(df, brand_col=brand_col)
+    store.save(path)
+    return True
+
+
+def load_merged(names=("train", "test"), sketch_dir=SKETCH_DIR):
+    """合併多個分片；都不存在時回傳 None。"""
+    store = None
+    for name in names:
+        path = sketch_path(name, sketch_dir)
+        if not path.exists():
+            continue
+        part = SketchStore.load(path)
+        store = part if store is None else store.merge(part)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查詢 ATI / y 的近似分位數")
+    parser.add_argument("--splits", type=str, default="train,test")
+    parser.add_argument("--metric", type=str, default="ATI_final")
+    parser.add_argument("--brand", type=str, default=ALL)
+    args = parser.parse_args()
+    store = load_merged(args.splits.split(","))
+    if store is None:
+        raise SystemExit(f"{SKETCH_DIR} 中沒有 sketch，請先執行 model.py")
+    sk = store.get(args.metric, args.brand)
+    print(json.dumps({"n": sk.n, "mean": sk.mean, "min": sk.min, "max": sk.max,
+                      "deciles": [round(float(v), 6) for v in sk.deciles()]}, ensure_ascii=False))
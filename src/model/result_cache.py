@@ -0,0 +1,161 @@
+# src/model/result_cache.py
+"""
+單篇打分結果的快取（放在 infer_ati.compute_ati_single 前面）。
+
+- 鍵 = 正規化 caption + 圖片內容雜湊 + 發文小時（numeric 特徵中唯一跟時間有關的）
+  + ArtifactBundle.version + 其他會影響回應的參數（例如 top_n_similar、歷史貼文索引版本）
+- 記憶體 LRU（容量 capacity）+ 選用的磁碟層（每個鍵一個 JSON，跨程序共用；
+  Node 每次請求起一個新的 infer_ati.py 時靠它命中）
+- 兩層都有 TTL；磁碟命中會放回記憶體層
+- 磁碟層每 PRUNE_INTERVAL_S 最多清一次（跨程序以 .last_prune 的 mtime 節流）：
+  刪掉超過 TTL 的檔案，超過 max_files 時再由最舊的刪起
+- stats()：hit / miss / 過期 / 淘汰次數，infer_ati 放在回應的 timings.cache
+"""
+import os, json, time, hashlib, threading, unicodedata
+from collections import OrderedDict
+
+CAPACITY = 1024
+TTL_S = 6 * 3600
+MAX_DISK_FILES = 20000
+PRUNE_INTERVAL_S = 600
+
+
+def normalize_caption(text):
+    """NFC、統一換行、去掉頭尾空白；打分也用正規化後的文字，命中與重算結果一致。"""
+    text = unicodedata.normalize("NFC", text or "")
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def make_key(caption, image_hash, hour, version, *extra):
+    h = hashlib.sha1()
+    for part in (caption, image_hash, hour, version, *extra):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, capacity=CAPACITY, ttl_s=TTL_S, disk_dir=None, max_disk_files=MAX_DISK_FILES,
+                 prune_interval_s=PRUNE_INTERVAL_S):
+        self.capacity = capacity
+        self.ttl_s = ttl_s
+        self.disk_dir = disk_dir
+        self.max_disk_files = max_disk_files
+        self.prune_interval_s = prune_interval_s
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "expired": 0, "evictions": 0, "puts": 0,
+                         "disk_pruned": 0}
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"result_{key}.json")
+
+    def _remember(self, key, value, expires):
+        """呼叫時持有鎖。"""
+        self._mem[key] = (value, expires)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.capacity:
+            self._mem.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        """回傳 (value, tier)；tier 為 "memory" / "disk"，未命中為 (None, None)。"""
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._mem.move_to_end(key)
+                    self.counters["hits_memory"] += 1
+                    return item[0], "memory"
+                del self._mem[key]
+                self.counters["expired"] += 1
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    item = json.load(f)
+            except (OSError, ValueError):
+                item = None
+            if item is not None:
+                if item["expires"] > now:
+                    with self._lock:
+                        self._remember(key, item["value"], item["expires"])
+                        self.counters["hits_disk"] += 1
+                    return item["value"], "disk"
+                with self._lock:
+                    self.counters["expired"] += 1
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self._lock:
+            self.counters["misses"] += 1
+        return None, None
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl_s
+        with self._lock:
+            self._remember(key, value, expires)
+            self.counters["puts"] += 1
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"expires": expires, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self.maybe_prune()
+
+    def maybe_prune(self):
+        """距上次清理（任何程序）超過 prune_interval_s 才清；回傳刪除的檔案數。"""
+        marker = os.path.join(self.disk_dir, ".last_prune")
+        try:
+            if time.time() - os.stat(marker).st_mtime < self.prune_interval_s:
+                return 0
+        except OSError:
+            pass
+        with open(marker, "w"):
+            pass
+        return self.prune()
+
+    def prune(self):
+        """刪掉超過 TTL 的檔案（含中斷留下的暫存檔），剩下的超過 max_disk_files 時由最舊的刪起。"""
+        now = time.time()
+        files = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.startswith("result_"):
+                    continue
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        files.sort()
+        expired = [p for m, p in files if m + self.ttl_s <= now]
+        kept = len(files) - len(expired)
+        overflow = [p for _, p in files[len(expired):len(expired) + max(0, kept - self.max_disk_files)]]
+        removed = 0
+        for path in expired + overflow:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.counters["disk_pruned"] += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+            total = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "size": len(self._mem),
+                "capacity": self.capacity,
+                "ttl_s": self.ttl_s,
+                "disk": bool(self.disk_dir),
+            }
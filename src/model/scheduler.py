@@ -0,0 +1,164 @@
+# src/model/scheduler.py
+"""
+推論服務內的優先權排程（interactive 單篇請求 vs bulk CSV 批次）。
+
+- 每個 priority class 一條 FIFO 佇列，固定數量的 worker thread 共用已載入的模型
+- worker 每次取一個工作（bulk 以「一批貼文」為單位），所以 interactive 請求
+  會在 bulk 的批次邊界插隊，不必等整個 CSV 跑完
+- 兩類都有工作排隊時，最近 SHARE_WINDOW_S 秒內 bulk 佔用的執行時間比例
+  低於 min_bulk_share 才讓 bulk 先跑，保證 bulk 不會被 interactive 餓死
+- 工作在 submit 當下的 contextvars context 中執行（instrument 的 recorder 會跟著進 worker）
+- stats()：各 class 的佇列深度、執行中數量、已完成數、等待時間（平均 / p50 / p95 / 最大）
+  與最近視窗內的執行時間佔比
+"""
+import time, threading, itertools, contextvars
+from collections import deque
+from concurrent.futures import Future
+
+INTERACTIVE, BULK = "interactive", "bulk"
+CLASSES = (INTERACTIVE, BULK)
+MIN_BULK_SHARE = 0.2
+SHARE_WINDOW_S = 30.0
+WAIT_SAMPLES = 1000
+
+
+class _ClassStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def to_dict(self, depth, share):
+        w = sorted(self.waits)
+        pct = lambda q: round(w[min(len(w) - 1, int(q * len(w)))], 4) if w else 0.0
+        started = self.completed + self.failed + self.running
+        return {
+            "queue_depth": depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_mean_s": round(self.wait_total / started, 4) if started else 0.0,
+            "wait_p50_s": pct(0.5),
+            "wait_p95_s": pct(0.95),
+            "wait_max_s": round(self.wait_max, 4),
+            "busy_share": round(share, 4),
+        }
+
+
+class PriorityScheduler:
+    def __init__(self, workers=1, min_bulk_share=MIN_BULK_SHARE, share_window_s=SHARE_WINDOW_S):
+        if not 0.0 <= min_bulk_share <= 1.0:
+            raise ValueError(f"min_bulk_share 必須介於 0 與 1：{min_bulk_share}")
+        self.min_bulk_share = min_bulk_share
+        self.share_window_s = share_window_s
+        self._queues = {c: deque() for c in CLASSES}
+        self._stats = {c: _ClassStats() for c in CLASSES}
+        self._busy = deque()  # (結束時間, class, 執行秒數)，只保留最近 share_window_s 秒
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, name=f"ati-sched-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, cls, fn, *args, **kwargs):
+        if cls not in self._queues:
+            raise ValueError(f"未知的 priority class：{cls}")
+        fut = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler 已關閉")
+            self._queues[cls].append((next(self._seq), time.perf_counter(), fut, contextvars.copy_context(),
+                                      fn, args, kwargs))
+            self._stats[cls].submitted += 1
+            self._cond.notify()
+        return fut
+
+    def submit_interactive(self, fn, *args, **kwargs):
+        return self.submit(INTERACTIVE, fn, *args, **kwargs)
+
+    def submit_bulk(self, fn, *args, **kwargs):
+        return self.submit(BULK, fn, *args, **kwargs)
+
+    def map_bulk(self, fn, batches):
+        """每一批各自排進 bulk 佇列（批次之間可被 interactive 插隊），依原順序回傳 future。"""
+        return [self.submit_bulk(fn, b) for b in batches]
+
+    def _shares(self, now):
+        while self._busy and self._busy[0][0] < now - self.share_window_s:
+            self._busy.popleft()
+        busy = {c: 0.0 for c in CLASSES}
+        for _, c, d in self._busy:
+            busy[c] += d
+        total = sum(busy.values())
+        return {c: (busy[c] / total if total > 0 else 0.0) for c in CLASSES}
+
+    def _pick(self):
+        """呼叫時持有鎖；兩類都有工作時依 bulk 最低佔比決定，否則取有工作的那一類。"""
+        qi, qb = self._queues[INTERACTIVE], self._queues[BULK]
+        if qi and qb:
+            return BULK if self._shares(time.perf_counter())[BULK] < self.min_bulk_share else INTERACTIVE
+        if qi:
+            return INTERACTIVE
+        return BULK if qb else None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._closed and self._pick() is None:
+                    self._cond.wait()
+                cls = self._pick()
+                if cls is None:
+                    return
+                _, queued, fut, ctx, fn, args, kwargs = self._queues[cls].popleft()
+                stats = self._stats[cls]
+                wait_s = time.perf_counter() - queued
+                stats.waits.append(wait_s)
+                stats.wait_total += wait_s
+                stats.wait_max = max(stats.wait_max, wait_s)
+                stats.running += 1
+            if not fut.set_running_or_notify_cancel():
+                with self._cond:
+                    stats.running -= 1
+                continue
+            start = time.perf_counter()
+            try:
+                result, error = ctx.run(fn, *args, **kwargs), None
+            except BaseException as e:
+                result, error = None, e
+            end = time.perf_counter()
+            with self._cond:
+                stats.running -= 1
+                if error is None:
+                    stats.completed += 1
+                else:
+                    stats.failed += 1
+                self._busy.append((end, cls, end - start))
+            if error is None:
+                fut.set_result(result)
+            else:
+                fut.set_exception(error)
+
+    def stats(self):
+        with self._cond:
+            shares = self._shares(time.perf_counter())
+            return {
+                "min_bulk_share": self.min_bulk_share,
+                "workers": len(self._threads),
+                "classes": {c: self._stats[c].to_dict(len(self._queues[c]), shares[c]) for c in CLASSES},
+            }
+
+    def shutdown(self, wait=True):
+        """停止收新工作；佇列中已排的工作仍會跑完。"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
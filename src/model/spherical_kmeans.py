@@ -0,0 +1,232 @@
+# src/model/spherical_kmeans.py
+"""
+球面（cosine）K-means：訓練期錨點與推論期 cosine 打分使用同一個幾何。
+
+- 所有樣本先 L2 normalize，指派用 cosine（一次 GEMM 算完整批 sims）
+- 中心 = 群內（加權）向量和再 normalize（mean direction）
+- k-means++ 播種（距離用 1 - cos）
+- 支援 sample_weight（例如 model.py 的 brand 反比權重 train_weights）
+- mode='full'（Lloyd）或 mode='minibatch'（Sculley 式逐批更新）
+"""
+import time
+import numpy as np
+
+_EPS = 1e-9
+
+
+def _l2_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    n = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / (n + _EPS), n[:, 0]
+
+
+def _assign(Xn, C, chunk=8192):
+    """每列最相似的中心與其 cosine；分塊做 GEMM，避免 n×k 過大。"""
+    n = Xn.shape[0]
+    labels = np.empty(n, dtype=np.int64)
+    best = np.empty(n, dtype=np.float32)
+    for s in range(0, n, chunk):
+        sims = Xn[s:s+chunk] @ C.T
+        lab = sims.argmax(axis=1)
+        labels[s:s+chunk] = lab
+        best[s:s+chunk] = sims[np.arange(sims.shape[0]), lab]
+    return labels, best
+
+
+def _weighted_sums(Xn, labels, w, k):
+    """依 label 做加權向量和（排序 + reduceat，避免 np.add.at 的逐元素迴圈）。"""
+    d = Xn.shape[1]
+    S = np.zeros((k, d), dtype=np.float64)
+    cnt = np.zeros(k, dtype=np.float64)
+    if Xn.shape[0] == 0:
+        return S, cnt
+    order = np.argsort(labels, kind='stable')
+    lab_sorted = labels[order]
+    starts = np.flatnonzero(np.r_[True, lab_sorted[1:] != lab_sorted[:-1]])
+    Xw = Xn[order] * w[order, None]
+    S[lab_sorted[starts]] = np.add.reduceat(Xw, starts, axis=0)
+    cnt[lab_sorted[starts]] = np.add.reduceat(w[order], starts)
+    return S, cnt
+
+
+def kmeanspp_init(Xn, k, sample_weight, rng):
+    """
+    k-means++ 播種（球面版）：D(x) = 1 - max_c cos(x, c)，依 w * D^2 抽樣。
+    零向量（例如沒有圖片的貼文）不參與播種。
+    """
+    n = Xn.shape[0]
+    w = sample_weight * (np.linalg.norm(Xn, axis=1) > 0.5)
+    if w.sum() <= 0:
+        raise ValueError("spherical_kmeans: 所有樣本皆為零向量，無法播種")
+    centers = np.empty((k, Xn.shape[1]), dtype=np.float32)
+    first = rng.choice(n, p=w / w.sum())
+    centers[0] = Xn[first]
+    closest = 1.0 - Xn @ centers[0]
+    for c in range(1, k):
+        p = w * np.maximum(closest, 0.0) ** 2
+        if p.sum() <= 0:
+            p = w
+        idx = rng.choice(n, p=p / p.sum())
+        centers[c] = Xn[idx]
+        closest = np.minimum(closest, 1.0 - Xn @ centers[c])
+    return centers
+
+
+def _reseed_empty(C, cnt, Xn, best, w):
+    """空群改用目前最不像任何中心的樣本（加權後）重新播種。"""
+    empty = np.flatnonzero(cnt <= 0)
+    if empty.size == 0:
+        return C
+    score = (1.0 - best) * (w > 0) * (np.linalg.norm(Xn, axis=1) > 0.5)
+    far = np.argsort(-score)[:empty.size]
+    C[empty[:far.size]] = Xn[far]
+    return C
+
+
+def _fit_full(Xn, k, w, rng, max_iter, tol):
+    C = kmeanspp_init(Xn, k, w, rng)
+    prev = -np.inf
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        labels, best = _assign(Xn, C)
+        obj = float((w * best).sum())
+        S, cnt = _weighted_sums(Xn, labels, w, k)
+        C = _l2_rows(S)[0]
+        C = _reseed_empty(C, cnt, Xn, best, w)
+        if obj - prev <= tol * max(abs(obj), 1.0):
+            break
+        prev = obj
+    labels, best = _assign(Xn, C)
+    return C, float((w * best).sum()), n_iter
+
+
+def _fit_minibatch(Xn, k, w, rng, max_iter, tol, batch_size):
+    n = Xn.shape[0]
+    init_n = min(n, max(3 * batch_size, 10 * k))
+    init_idx = rng.choice(n, size=init_n, replace=False)
+    C = kmeanspp_init(Xn[init_idx], k, w[init_idx], rng)
+    counts = np.zeros(k, dtype=np.float64)
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        idx = rng.choice(n, size=min(batch_size, n), replace=False)
+        Xb, wb = Xn[idx], w[idx]
+        labels, _ = _assign(Xb, C)
+        S, cnt = _weighted_sums(Xb, labels, wb, k)
+        hit = cnt > 0
+        counts[hit] += cnt[hit]
+        # 每個中心的學習率 = 本批權重 / 累積權重（Sculley 2010）
+        eta = np.zeros(k, dtype=np.float64)
+        eta[hit] = cnt[hit] / counts[hit]
+        batch_mean = np.zeros_like(S)
+        batch_mean[hit] = S[hit] / cnt[hit, None]
+        C_new = (1.0 - eta[:, None]) * C + eta[:, None] * batch_mean
+        C_new = _l2_rows(C_new)[0]
+        shift = float(np.max(1.0 - (C_new * C).sum(axis=1)))
+        C = C_new
+        if n_iter > 1 and shift < tol:
+            break
+    labels, best = _assign(Xn, C)
+    _, cnt = _weighted_sums(Xn, labels, w, k)
+    C = _reseed_empty(C, cnt, Xn, best, w)
+    labels, best = _assign(Xn, C)
+    return C, float((w * best).sum()), n_iter
+
+
+def spherical_kmeans(X, k, sample_weight=None, mode='full', max_iter=100, tol=1e-6,
+                     batch_size=1024, n_init=1, random_state=None):
+    """
+    X: [n, d]（不需事先 normalize）
+    回傳: centers [k, d]（float32、L2-normalized）, info dict
+      info = {'objective': 加權 Σ max cos, 'n_iter', 'mode', 'fit_s'}
+    """
+    if mode not in ('full', 'minibatch'):
+        raise ValueError(f"spherical_kmeans: 不支援的 mode：{mode}")
+    Xn, _ = _l2_rows(X)
+    n = Xn.shape[0]
+    if n < k:
+        raise ValueError(f"spherical_kmeans: 樣本數 {n} 少於 k={k}")
+    w = np.ones(n, dtype=np.float64) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    if w.shape != (n,):
+        raise ValueError("spherical_kmeans: sample_weight 長度需與 X 相同")
+    rng = np.random.default_rng(random_state)
+
+    t0 = time.perf_counter()
+    best_C, best_obj, best_iter = None, -np.inf, 0
+    for _ in range(max(1, n_init)):
+        if mode == 'full':
+            C, obj, it = _fit_full(Xn, k, w, rng, max_iter, tol)
+        else:
+            C, obj, it = _fit_minibatch(Xn, k, w, rng, max_iter, tol, batch_size)
+        if obj > best_obj:
+            best_C, best_obj, best_iter = C, obj, it
+    info = {'objective': best_obj, 'n_iter': best_iter, 'mode': mode,
+            'fit_s': time.perf_counter() - t0}
+    return best_C.astype(np.float32), info
+
+
+# ---- 與舊版（Euclidean MiniBatchKMeans + 事後 normalize）比較 ----
+def fit_legacy_minibatch_kmeans(X, k, sample_weight=None, random_state=None):
+    from sklearn.cluster import MiniBatchKMeans
+    km = MiniBatchKMeans(n_clusters=k, random_state=random_state, batch_size=512, n_init='auto')
+    km.fit(X, sample_weight=sample_weight)
+    C = km.cluster_centers_
+    return (C / (np.linalg.norm(C, axis=1, keepdims=True) + _EPS)).astype(np.float32)
+
+
+def anchor_quality(X, centers, sample_weight=None):
+    """
+    以推論端的 cosine 打分衡量錨點：
+      mean_max_sim: 加權平均 max cos（越高代表錨點越貼合資料）
+      nov_min / nov_max / nov_std: 1 - max cos 的範圍（越寬 novelty 越有鑑別力）
+    零向量列（無圖片）不計入。
+    """
+    Xn, norms = _l2_rows(X)
+    keep = norms > _EPS
+    w = np.ones(len(Xn)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    Xn, w = Xn[keep], w[keep]
+    if len(Xn) == 0:
+        return {'mean_max_sim': 0.0, 'nov_min': 0.0, 'nov_max': 0.0, 'nov_std': 0.0}
+    _, best = _assign(Xn, centers)
+    nov = 1.0 - best
+    return {
+        'mean_max_sim': float(np.average(best, weights=w)),
+        'nov_min': float(nov.min()), 'nov_max': float(nov.max()),
+        'nov_std': float(nov.std()),
+    }
+
+
+def compare_anchor_fitters(X, k, sample_weight=None, random_state=None):
+    """回傳各擬合方式的 fit 時間與 novelty 品質（list of dict）。"""
+    rows = []
+    t0 = time.perf_counter()
+    C = fit_legacy_minibatch_kmeans(X, k, sample_weight=sample_weight, random_state=random_state)
+    rows.append({'fitter': 'minibatch-kmeans', 'fit_s': time.perf_counter() - t0,
+                 **anchor_quality(X, C, sample_weight)})
+    for mode in ('full', 'minibatch'):
+        C, info = spherical_kmeans(X, k, sample_weight=sample_weight, mode=mode, random_state=random_state)
+        rows.append({'fitter': f'spherical-{mode}', 'fit_s': info['fit_s'], 'n_iter': info['n_iter'],
+                     **anchor_quality(X, C, sample_weight)})
+    return rows
+
+
+def format_comparison(rows, title=''):
+    lines = [f'== anchor fitters {title} ==',
+             f'{"fitter":22s} {"fit_s":>8s} {"mean_max_sim":>13s} {"nov_min":>8s} {"nov_max":>8s} {"nov_std":>8s}']
+    for r in rows:
+        lines.append(f'{r["fitter"]:22s} {r["fit_s"]:8.3f} {r["mean_max_sim"]:13.4f} '
+                     f'{r["nov_min"]:8.4f} {r["nov_max"]:8.4f} {r["nov_std"]:8.4f}')
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="比較錨點擬合方式（輸入為 .npy 特徵矩陣）")
+    parser.add_argument("--npy", type=str, required=True)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--weights_npy", type=str, default=None, help="optional per-row sample_weight")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    X = np.load(args.npy)
+    w = np.load(args.weights_npy) if args.weights_npy else None
+    print(format_comparison(compare_anchor_fitters(X, args.k, sample_weight=w, random_state=args.seed),
+                            title=f'({args.npy}, k={args.k})'))
@@ -0,0 +1,115 @@
+# src/model/stage_graph.py
+"""
+單一請求內的小型相依圖執行器。
+
+每個 stage 是 fn(results)：相依的 stage 都完成後才送進 executor，
+results 內已有所有相依 stage 的回傳值。run() 回傳各 stage 結果與時間
+（相對圖開始的 start / end、duration、deps、status），critical_path() 由最晚結束的
+stage 往回沿著「最晚完成的相依」走，得到決定總延遲的那一串 stage。
+每個 stage 同時是一個 instrument span（stage.<name>），並在呼叫端的 context 中執行，
+stage 內的 span 會記進請求的 recorder。
+
+有 fallback 的 stage 是可降級的：run(deadline_s=...) 超過期限時，
+還在跑的可降級 stage 改用 fallback(results) 的值（status="timeout"，原本的工作
+留在 executor 上跑完，例如寫入 OCR 快取），尚未開始的直接用 fallback（status="skipped"）。
+沒有 fallback 的 stage 不受期限影響。
+"""
+import time, contextvars
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import instrument
+
+DONE, TIMEOUT, SKIPPED = "done", "timeout", "skipped"
+
+
+class StageGraph:
+    def __init__(self):
+        self.stages = {}
+        self.fallbacks = {}
+
+    def add(self, name, fn, deps=(), fallback=None):
+        for d in deps:
+            if d not in self.stages:
+                raise KeyError(f"stage {name} 依賴尚未加入的 stage {d}")
+        self.stages[name] = (fn, tuple(deps))
+        if fallback is not None:
+            self.fallbacks[name] = fallback
+        return self
+
+    def run(self, executor, deadline_s=None):
+        t0 = time.perf_counter()
+        deadline = t0 + deadline_s if deadline_s is not None else None
+        pending = dict(self.stages)
+        running, results, timings = {}, {}, {}
+
+        def _call(name, fn):
+            start = time.perf_counter()
+            with instrument.span(f"stage.{name}"):
+                value = fn(results)
+            return value, start, time.perf_counter()
+
+        def _record(name, start, end, status):
+            timings[name] = {
+                "start_s": round(start - t0, 4),
+                "end_s": round(end - t0, 4),
+                "duration_s": round(end - start, 4),
+                "deps": list(self.stages[name][1]),
+                "status": status,
+            }
+
+        def _fall_back(name, start, status):
+            results[name] = self.fallbacks[name](results)
+            _record(name, start, time.perf_counter(), status)
+
+        while pending or running:
+            expired = deadline is not None and time.perf_counter() >= deadline
+            ready = [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]
+            for name in ready:
+                fn, _ = pending.pop(name)
+                if expired and name in self.fallbacks:
+                    _fall_back(name, time.perf_counter(), SKIPPED)
+                else:
+                    ctx = contextvars.copy_context()
+                    running[executor.submit(ctx.run, _call, name, fn)] = (name, time.perf_counter())
+            if not running:
+                continue
+            timeout = None
+            if deadline is not None and any(n in self.fallbacks for n, _ in running.values()):
+                timeout = max(0.0, deadline - time.perf_counter())
+            finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                # 期限到：可降級的 stage 改用 fallback，future 不取消、在背景跑完
+                for fut, (name, submitted) in list(running.items()):
+                    if name in self.fallbacks:
+                        del running[fut]
+                        _fall_back(name, submitted, TIMEOUT)
+                continue
+            for fut in finished:
+                name, _ = running.pop(fut)
+                value, start, end = fut.result()
+                results[name] = value
+                _record(name, start, end, DONE)
+        return results, timings
+
+
+def critical_path(timings):
+    if not timings:
+        return []
+    name = max(timings, key=lambda n: timings[n]["end_s"])
+    path = [name]
+    while timings[name]["deps"]:
+        name = max(timings[name]["deps"], key=lambda d: timings[d]["end_s"])
+        path.append(name)
+    return path[::-1]
+
+
+def summarize(timings):
+    """回應用的 timings 區塊：各 stage 時間、critical path、總 wall time 與降級的 stage。"""
+    return {
+        "stages": timings,
+        "critical_path": critical_path(timings),
+        "total_s": max((t["end_s"] for t in timings.values()), default=0.0),
+        "ran": [n for n, t in timings.items() if t.get("status", DONE) == DONE],
+        "timed_out": [n for n, t in timings.items() if t.get("status") == TIMEOUT],
+        "skipped": [n for n, t in timings.items() if t.get("status") == SKIPPED],
+    }
@@ -0,0 +1,200 @@
+# src/model/trend_builder.py
+"""
+市場 / 品牌時間趨勢的預先計算（日 / 週 / 月）。
+
+- 以向量化的 to_period 把貼文分桶，每個 (brand, bucket) 只存 n 與各指標總和，
+  市場層級 = 各品牌總和；平均、滾動視窗平均（以 n 加權）都由總和表推出
+- 缺貼文的時間桶補 n=0，滾動視窗是「最近 window 個時間桶」而不是最近 window 筆
+- append() 只把 watermark（已收錄的最晚貼文時間）之後的新貼文分桶、加進總和表，
+  不重掃舊資料
+- 產物 outputs/trends/trend_{D,W,M}.json：總和表（給下次 append）+ 以欄為單位的
+  market / brands 序列（給趨勢圖直接用）
+"""
+import os, json, pathlib, argparse
+import numpy as np
+import pandas as pd
+
+BASE_DIR = "./src/model"
+OUT_DIR = pathlib.Path(BASE_DIR) / "outputs"
+TREND_DIR = OUT_DIR / "trends"
+FREQS = ("D", "W", "M")
+DEFAULT_WINDOW = {"D": 7, "W": 4, "M": 3}
+METRICS = ("ATI_final", "novelty", "diversity", "text_ATI", "image_ATI", "meta_ATI", "y")
+MARKET = "__market__"
+
+
+def trend_path(freq, trend_dir=TREND_DIR):
+    return pathlib.Path(trend_dir) / f"trend_{freq}.json"
+
+
+def bucket_start(times, freq):
+    """每筆時間所屬時間桶的起始日（週從週一開始）；無法解析為 NaT。"""
+    t = pd.to_datetime(pd.Series(times), errors="coerce")
+    return t.dt.to_period(freq).dt.start_time.dt.normalize()
+
+
+def prepare_posts(df, brand_col="brand", time_col="ftime_parsed"):
+    """per-post 輸出 → brand / time / METRICS 欄；novelty、diversity 為三模態平均。"""
+    out = pd.DataFrame({
+        "brand": df[brand_col].fillna("").astype(str).str.strip().to_numpy(),
+        "time": pd.to_datetime(df[time_col], errors="coerce").to_numpy(),
+    })
+    for kind in ("nov", "div"):
+        cols = [f"{m}_{kind}" for m in ("text", "image", "meta")]
+        if all(c in df.columns for c in cols):
+            out["novelty" if kind == "nov" else "diversity"] = df[cols].to_numpy(dtype=np.float64).mean(axis=1)
+    for m in METRICS:
+        if m in df.columns and m not in out.columns:
+            out[m] = pd.to_numeric(df[m], errors="coerce").to_numpy(dtype=np.float64)
+    for m in METRICS:
+        if m not in out.columns:
+            out[m] = np.nan
+    return out
+
+
+def bin_posts(posts, freq):
+    """(brand, bucket) 的 n 與各指標總和（缺值以 0 計入總和、另記 n_<metric>）。"""
+    posts = posts[posts["time"].notna()]
+    keys = pd.DataFrame({"brand": posts["brand"].to_numpy(), "bucket": bucket_start(posts["time"], freq).to_numpy()})
+    vals = posts[list(METRICS)].to_numpy(dtype=np.float64)
+    frame = pd.concat([keys, pd.DataFrame(np.nan_to_num(vals), columns=list(METRICS)),
+                       pd.DataFrame(np.isfinite(vals).astype(np.int64), columns=[f"n_{m}" for m in METRICS])], axis=1)
+    frame["n"] = 1
+    return frame.groupby(["brand", "bucket"]).sum()
+
+
+class TrendTable:
+    def __init__(self, freq, sums, watermark=None, undated=0, window=None):
+        if freq not in FREQS:
+            raise ValueError(f"freq 必須是 {FREQS} 之一：{freq}")
+        self.freq = freq
+        self.sums = sums
+        watermark = pd.Timestamp(watermark) if watermark is not None else None
+        self.watermark = None if watermark is None or pd.isna(watermark) else watermark  # 全部時間無法解析時 max() 為 NaT
+        self.undated = int(undated)
+        self.window = window or DEFAULT_WINDOW[freq]
+
+    @classmethod
+    def build(cls, df, freq="M", window=None, **kw):
+        posts = prepare_posts(df, **kw)
+        return cls(freq, bin_posts(posts, freq), watermark=posts["time"].max(),
+                   undated=int(posts["time"].isna().sum()), window=window)
+
+    def append(self, df, **kw):
+        """只收 watermark 之後的新貼文，加進對應時間桶；回傳實際收錄筆數。"""
+        posts = prepare_posts(df, **kw)
+        self.undated += int(posts["time"].isna().sum())
+        posts = posts[posts["time"].notna()]
+        if self.watermark is not None:
+            posts = posts[posts["time"] > self.watermark]
+        if posts.empty:
+            return 0
+        self.sums = self.sums.add(bin_posts(posts, self.freq), fill_value=0)
+        latest = posts["time"].max()
+        self.watermark = max(self.watermark, latest) if self.watermark is not None else latest
+        return len(posts)
+
+    def _series(self, sums):
+        """補齊空時間桶後算平均與以 n 加權的滾動平均；只輸出有貼文的時間桶。"""
+        sums = sums.sort_index()
+        full = pd.period_range(sums.index.min(), sums.index.max(), freq=self.freq).start_time
+        sums = sums.reindex(full, fill_value=0)
+        roll = sums.rolling(self.window, min_periods=1).sum()
+        keep = sums["n"].to_numpy() > 0
+        out = {"date": [d.strftime("%Y-%m-%d") for d in sums.index[keep]],
+               "n": sums["n"].to_numpy()[keep].astype(int).tolist(),
+               "rollingN": roll["n"].to_numpy()[keep].astype(int).tolist()}
+        for m in METRICS:
+            cnt, rcnt = sums[f"n_{m}"].to_numpy(), roll[f"n_{m}"].to_numpy()
+            mean = np.where(cnt > 0, sums[m].to_numpy() / np.maximum(cnt, 1), np.nan)
+            rmean = np.where(rcnt > 0, roll[m].to_numpy() / np.maximum(rcnt, 1), np.nan)
+            out[m] = [None if not np.isfinite(v) else round(float(v), 6) for v in mean[keep]]
+            out[f"{m}_rolling"] = [None if not np.isfinite(v) else round(float(v), 6) for v in rmean[keep]]
+        return out
+
+    def series(self, brand=None):
+        if self.sums.empty:
+            return {"date": [], "n": []}
+        if brand is None:
+            return self._series(self.sums.groupby(level="bucket").sum())
+        return self._series(self.sums.xs(brand, level="brand"))
+
+    def to_dict(self):
+        brands = sorted(self.sums.index.get_level_values("brand").unique()) if not self.sums.empty else []
+        flat = self.sums.reset_index()
+        flat["bucket"] = flat["bucket"].dt.strftime("%Y-%m-%d")
+        return {
+            "freq": self.freq,
+            "window": self.window,
+            "watermark": self.watermark.isoformat() if self.watermark is not None else None,
+            "undated": self.undated,
+            "metrics": list(METRICS),
+            "market": self.series(),
+            "brands": {b: self.series(b) for b in brands},
+            "sums": {c: flat[c].tolist() for c in flat.columns},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        sums = pd.DataFrame(d["sums"])
+        sums["bucket"] = pd.to_datetime(sums["bucket"])
+        return cls(d["freq"], sums.set_index(["brand", "bucket"]), watermark=d["watermark"],
+                   undated=d["undated"], window=d["window"])
+
+    def save(self, trend_dir=TREND_DIR):
+        path = trend_path(self.freq, trend_dir)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, freq, trend_dir=TREND_DIR):
+        with open(trend_path(freq, trend_dir), "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def load_scored_posts(out_dir=OUT_DIR):
+    """train + test per-post 輸出（有欄式檔時只讀需要的欄位）。"""
+    import columnar
+    cols = ["brand", "ftime_parsed", "ATI_final", "text_ATI", "image_ATI", "meta_ATI", "y",
+            "text_nov", "image_nov", "meta_nov", "text_div", "image_div", "meta_div"]
+    frames = []
+    for split in ("train", "test"):
+        base = pathlib.Path(out_dir) / f"ati_{split}_per_post.csv"
+        if columnar.exists(base):
+            frames.append(columnar.read_per_post(base, columns=cols))
+        elif base.exists():
+            frames.append(pd.read_csv(base, usecols=lambda c: c in cols))
+    if not frames:
+        raise FileNotFoundError(f"{out_dir} 中找不到 per-post 輸出，請先執行 model.py")
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_all(freqs=FREQS, out_dir=OUT_DIR, trend_dir=TREND_DIR):
+    posts = load_scored_posts(out_dir)
+    return {freq: TrendTable.build(posts, freq).save(trend_dir) for freq in freqs}
+
+
+def append_all(df, freqs=FREQS, trend_dir=TREND_DIR):
+    """新打分的 per-post 結果併入既有趨勢產物；回傳各頻率收錄筆數。"""
+    added = {}
+    for freq in freqs:
+        table = TrendTable.load(freq, trend_dir)
+        added[freq] = table.append(df)
+        table.save(trend_dir)
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="預先計算日 / 週 / 月趨勢與滾動視窗")
+    parser.add_argument("--append", type=str, default=None, help="新打分的 per-post CSV，只加入新的時間桶")
+    parser.add_argument("--freqs", type=str, default=",".join(FREQS))
+    args = parser.parse_args()
+    freqs = args.freqs.split(",")
+    if args.append:
+        print(json.dumps(append_all(pd.read_csv(args.append), freqs)))
+    else:
+        print(json.dumps({f: str(p) for f, p in build_all(freqs).items()}, ensure_ascii=False))
@@ -15,6 +15,12 @@ const TRAIN_POST_CSV = fs.existsSync(TRAIN_POST_CSV_OPTIMIZED)
   : path.resolve(ROOT, 'src/model/outputs/ati_train_per_post.csv');
 const RAW_TEST_POSTS_CSV = path.resolve(ROOT, 'src/model/with_rel_paths_test_posts.csv');
 const RAW_TRAIN_POSTS_CSV = path.resolve(ROOT, 'src/model/with_rel_paths_train_posts.csv');
+// Python 端預先計算的品牌相似度（src/model/brand_similarity.py）
+const BRAND_NEIGHBORS_JSON = path.resolve(ROOT, 'src/model/outputs/brand_similarity/brand_neighbors.json');
+// Python 端預先計算的月趨勢（src/model/trend_builder.py）
+const MONTHLY_TREND_JSON = path.resolve(ROOT, 'src/model/outputs/trends/trend_M.json');
+// Python 端預先計算的留言權重相關係數充分統計量（src/model/engagement_moments.py）
+const ENGAGEMENT_MOMENTS_JSON = path.resolve(ROOT, 'src/data/generated/engagement_moments.json');
 
 interface BrandAggData {
   brand: string;
@@ -458,13 +464,51 @@ async function calculateBrandSimilarity(
   return similarity;
 }
 
+// 預先計算的品牌鄰居表（brand -> 依相似度排序的鄰居）
+let brandNeighborsCache: Record<string, Array<{ brand: string; similarity: number }>> | null = null;
+
+function loadBrandNeighbors(): Record<string, Array<{ brand: string; similarity: number }>> | null {
+  if (brandNeighborsCache) return brandNeighborsCache;
+  if (!fs.existsSync(BRAND_NEIGHBORS_JSON)) return null;
+  try {
+    const payload = JSON.parse(fs.readFileSync(BRAND_NEIGHBORS_JSON, 'utf-8'));
+    brandNeighborsCache = payload.neighbors ?? null;
+    return brandNeighborsCache;
+  } catch (error) {
+    console.warn('[BrandAnalysis] Could not load brand_neighbors.json:', error);
+    return null;
+  }
+}
+
 // 找出最相似的品牌（基於多模態 embedding）
 export async function getSimilarBrands(brandName: string, topK: number = 3) {
   const brands = await loadBrandData();
-  const posts = await loadPostData();
   const targetBrand = brands.find(b => b.brand === brandName);
   
   if (!targetBrand) return [];
+
+  // 優先查表：Python 端以真實 CLIP/meta 嵌入算好的 top-K 鄰居
+  const neighbors = loadBrandNeighbors()?.[brandName];
+  if (neighbors && neighbors.length >= topK) {
+    const brandMap = new Map(brands.map(b => [b.brand, b]));
+    return neighbors
+      .filter(n => brandMap.has(n.brand))
+      .slice(0, topK)
+      .map(n => {
+        const b = brandMap.get(n.brand)!;
+        return {
+          brand: b.brand,
+          similarity: n.similarity,
+          ati: b.ATI_final_mean,
+          ds: b.DS_final_mean,
+          y_mean: b.y_mean,
+          atiDiff: Math.abs(targetBrand.ATI_final_mean - b.ATI_final_mean),
+          dsDiff: Math.abs(targetBrand.DS_final_mean - b.DS_final_mean),
+        };
+      });
+  }
+
+  const posts = await loadPostData();
   if (posts.length === 0) return [];
 
   // 計算所有品牌的相似度（基於 embedding）
@@ -640,45 +684,30 @@ export async function getMarketStats() {
 }
 
 // 取得市場整體時間序列趨勢（包含 train 和 test 數據）
-export async function getMarketTrend() {
-  // 同時載入 train 和 test 數據
-  const testPosts = await loadPostData();
-  
-  let trainPosts: PostData[] = [];
+// 預先計算的月趨勢：market 序列為欄式（date / ATI_final / novelty / diversity ...）
+function loadMonthlyTrend(): Array<{ date: string; avgAti: number; avgNovelty: number; avgDiversity: number }> | null {
+  if (!fs.existsSync(MONTHLY_TREND_JSON)) return null;
   try {
-    if (fs.existsSync(TRAIN_POST_CSV)) {
-      const rawTrain = await parseCSV<any>(TRAIN_POST_CSV);
-      trainPosts = rawTrain.map((p: any) => ({
-        brand: p.brand,
-        count_like: parseInt(p.count_like) || 0,
-        count_comment: parseInt(p.count_comment) || 0,
-        followers: parseFloat(p.followers) || 0,
-        y: parseFloat(p.y) || 0,
-        text_nov: parseFloat(p.text_nov) || 0,
-        text_div: parseFloat(p.text_div) || 0,
-        text_DS: parseFloat(p.text_DS) || 0,
-        text_ATI: parseFloat(p.text_ATI) || 0,
-        image_nov: parseFloat(p.image_nov) || 0,
-        image_div: parseFloat(p.image_div) || 0,
-        image_DS: parseFloat(p.image_DS) || 0,
-        image_ATI: parseFloat(p.image_ATI) || 0,
-        meta_nov: parseFloat(p.meta_nov) || 0,
-        meta_div: parseFloat(p.meta_div) || 0,
-        meta_DS: parseFloat(p.meta_DS) || 0,
-        meta_ATI: parseFloat(p.meta_ATI) || 0,
-        ATI_final: parseFloat(p.ATI_final) || 0,
-        DS_final: parseFloat(p.DS_final) || 0,
-        caption: p.caption || '',
-        ocr_text: p.ocr_text || '',
-        ftime_parsed: p.ftime_parsed || '',
-      }));
-    }
+    const market = JSON.parse(fs.readFileSync(MONTHLY_TREND_JSON, 'utf-8')).market;
+    if (!market?.date?.length) return null;
+    return market.date.map((date: string, i: number) => ({
+      date: date.substring(0, 7),
+      avgAti: market.ATI_final[i] ?? 0,
+      avgNovelty: market.novelty[i] ?? 0,
+      avgDiversity: market.diversity[i] ?? 0,
+    }));
   } catch (error) {
-    console.warn('無法載入 train 數據:', error);
+    console.warn('[BrandAnalysis] Could not load trend_M.json:', error);
+    return null;
   }
-  
-  // 合併 train 和 test 數據
-  const posts = [...trainPosts, ...testPosts];
+}
+
+export async function getMarketTrend() {
+  const precomputed = loadMonthlyTrend();
+  if (precomputed) return precomputed;
+
+  // loadPostData 已包含 test 與 train，每篇貼文只計一次（與 generate_summary.py 的 materialized trend 相同）
+  const posts = await loadPostData();
   
   if (posts.length === 0) {
     return [];
@@ -795,44 +824,21 @@ export async function getMarketTrend() {
 
 // 展示專用：市場整體時間序列趨勢（調整 ATI 以呈現逐漸平庸的趨勢）
 export async function getMarketTrendForPresentation() {
-  // 同時載入 train 和 test 數據
-  const testPosts = await loadPostData();
-  
-  let trainPosts: PostData[] = [];
-  try {
-    if (fs.existsSync(TRAIN_POST_CSV)) {
-      const rawTrain = await parseCSV<any>(TRAIN_POST_CSV);
-      trainPosts = rawTrain.map((p: any) => ({
-        brand: p.brand,
-        count_like: parseInt(p.count_like) || 0,
-        count_comment: parseInt(p.count_comment) || 0,
-        followers: parseFloat(p.followers) || 0,
-        y: parseFloat(p.y) || 0,
-        text_nov: parseFloat(p.text_nov) || 0,
-        text_div: parseFloat(p.text_div) || 0,
-        text_DS: parseFloat(p.text_DS) || 0,
-        text_ATI: parseFloat(p.text_ATI) || 0,
-        image_nov: parseFloat(p.image_nov) || 0,
-        image_div: parseFloat(p.image_div) || 0,
-        image_DS: parseFloat(p.image_DS) || 0,
-        image_ATI: parseFloat(p.image_ATI) || 0,
-        meta_nov: parseFloat(p.meta_nov) || 0,
-        meta_div: parseFloat(p.meta_div) || 0,
-        meta_DS: parseFloat(p.meta_DS) || 0,
-        meta_ATI: parseFloat(p.meta_ATI) || 0,
-        ATI_final: parseFloat(p.ATI_final) || 0,
-        DS_final: parseFloat(p.DS_final) || 0,
-        caption: p.caption || '',
-        ocr_text: p.ocr_text || '',
-        ftime_parsed: p.ftime_parsed || '',
-      }));
-    }
-  } catch (error) {
-    console.warn('無法載入 train 數據:', error);
+  const precomputed = loadMonthlyTrend();
+  if (precomputed) {
+    return precomputed.map((point, monthIndex) => {
+      const multiplier = Math.pow(0.97, monthIndex);
+      return {
+        date: point.date,
+        avgAti: point.avgAti * multiplier,
+        avgNovelty: point.avgNovelty * multiplier,
+        avgDiversity: point.avgDiversity * multiplier,
+      };
+    });
   }
-  
-  // 合併 train 和 test 數據
-  const posts = [...trainPosts, ...testPosts];
+
+  // loadPostData 已包含 test 與 train，每篇貼文只計一次（與 generate_summary.py 的 materialized trend 相同）
+  const posts = await loadPostData();
   
   if (posts.length === 0) {
     return [];
@@ -1187,6 +1193,12 @@ export async function getEngagementScalingCheck() {
   const correlations: Array<{ weight: number; correlation: number }> = [];
   
   weights.forEach(commentWeight => {
+    const fromMoments = correlationFromMoments(commentWeight);
+    if (fromMoments) {
+      correlations.push({ weight: commentWeight, correlation: fromMoments.correlation });
+      return;
+    }
+
     // 計算新的 y 值
     const newYValues = posts.map(p => {
       const likes = p.count_like || 0;
@@ -1236,12 +1248,85 @@ export async function getEngagementScalingCheck() {
   };
 }
 
+// 預先計算的 moments：每組 (split, brand) 存 (metrics..., a, b) 的平均與中心化共變異和，
+// y(w) = a + w·b，所以任意 w 的 Pearson 都是 O(1)；Spearman 由 w 網格內插
+interface EngagementMomentGroup {
+  split: string;
+  brand: string;
+  n: number;
+  mean: number[];
+  comoment: number[][];
+  spearman: Record<string, number[]> | null;
+}
+
+let engagementMomentsCache: { metrics: string[]; spearmanGrid: number[]; groups: Map<string, EngagementMomentGroup> } | null = null;
+
+function loadEngagementMoments() {
+  if (engagementMomentsCache) return engagementMomentsCache;
+  if (!fs.existsSync(ENGAGEMENT_MOMENTS_JSON)) return null;
+  try {
+    const payload = JSON.parse(fs.readFileSync(ENGAGEMENT_MOMENTS_JSON, 'utf-8'));
+    const groups = new Map<string, EngagementMomentGroup>();
+    for (const g of payload.groups as EngagementMomentGroup[]) {
+      groups.set(`${g.split}|${g.brand}`, g);
+    }
+    engagementMomentsCache = { metrics: payload.metrics, spearmanGrid: payload.spearmanGrid, groups };
+    return engagementMomentsCache;
+  } catch (error) {
+    console.warn('[BrandAnalysis] Could not load engagement_moments.json:', error);
+    return null;
+  }
+}
+
+function interpolate(grid: number[], values: number[], x: number): number {
+  if (x <= grid[0]) return values[0];
+  if (x >= grid[grid.length - 1]) return values[values.length - 1];
+  let hi = 1;
+  while (grid[hi] < x) hi++;
+  const t = (x - grid[hi - 1]) / (grid[hi] - grid[hi - 1]);
+  return values[hi - 1] + t * (values[hi] - values[hi - 1]);
+}
+
+function correlationFromMoments(
+  commentWeight: number,
+  brand: string = '__all__',
+  metric: string = 'ATI_final',
+): { correlation: number; spearman: number | null; n: number } | null {
+  const moments = loadEngagementMoments();
+  const group = moments?.groups.get(`__all__|${brand}`);
+  const i = moments ? moments.metrics.indexOf(metric) : -1;
+  if (!moments || !group || i < 0) return null;
+  const C = group.comoment;
+  const a = C.length - 2;
+  const b = C.length - 1;
+  const w = commentWeight;
+  const cov = C[i][a] + w * C[i][b];
+  const varY = C[a][a] + 2 * w * C[a][b] + w * w * C[b][b];
+  const denominator = Math.sqrt(Math.max(C[i][i], 0) * Math.max(varY, 0));
+  const grid = group.spearman?.[metric];
+  return {
+    correlation: denominator !== 0 ? cov / denominator : 0,
+    spearman: grid ? interpolate(moments.spearmanGrid, grid, w) : null,
+    n: group.n,
+  };
+}
+
 // 計算指定 comment weight 下的相關性
-export async function calculateCorrelationForWeight(commentWeight: number): Promise<{
+export async function calculateCorrelationForWeight(
+  commentWeight: number,
+  brand?: string,
+  metric: string = 'ATI_final',
+): Promise<{
   weight: number;
   correlation: number;
+  spearman?: number | null;
 }> {
-  const posts = await loadPostData();
+  const fromMoments = correlationFromMoments(commentWeight, brand ?? '__all__', metric);
+  if (fromMoments) {
+    return { weight: commentWeight, correlation: fromMoments.correlation, spearman: fromMoments.spearman };
+  }
+
+  const posts = (await loadPostData()).filter(p => !brand || p.brand === brand);
   
   if (posts.length === 0) {
     return { weight: commentWeight, correlation: 0 };
@@ -1256,7 +1341,7 @@ export async function calculateCorrelationForWeight(commentWeight: number): Prom
   });
   
   // 計算與 ATI 的 Pearson 相關係數
-  const atiValues = posts.map(p => p.ATI_final);
+  const atiValues = posts.map(p => Number((p as any)[metric] ?? p.ATI_final));
   const n = posts.length;
   
   const avgAti = atiValues.reduce((sum, v) => sum + v, 0) / n;
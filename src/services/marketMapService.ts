@@ -13,6 +13,8 @@ const TRAIN_POST_CSV_OPTIMIZED = path.resolve(ROOT, 'src/model/outputs/ati_train
 const TRAIN_POST_CSV = fs.existsSync(TRAIN_POST_CSV_OPTIMIZED)
   ? TRAIN_POST_CSV_OPTIMIZED
   : path.resolve(ROOT, 'src/model/outputs/ati_train_per_post.csv');
+// Python 端預先計算的市場地圖（src/model/market_map.py：randomized SVD 投影 + 分群）
+const MARKET_MAP_JSON = path.resolve(ROOT, 'src/model/outputs/market_map/market_map.json');
 
 interface BrandAggData {
   brand: string;
@@ -32,6 +34,8 @@ interface BrandPoint {
   y_mean: number;
   n_posts: number;
   cluster?: number;  // 聚類編號
+  embeddingX?: number | null;  // 品牌嵌入投影的第一主成分
+  embeddingY?: number | null;  // 品牌嵌入投影的第二主成分
 }
 
 // 簡單的 PCA 降維（2D）
@@ -643,6 +647,18 @@ export async function getMarketMapData(method: 'positioning' = 'positioning'): P
   clusters: number;
   method: string;
 }> {
+  // 優先使用預先計算的地圖（座標與群編號都已算好）
+  if (fs.existsSync(MARKET_MAP_JSON)) {
+    try {
+      const payload = JSON.parse(fs.readFileSync(MARKET_MAP_JSON, 'utf-8'));
+      if (Array.isArray(payload.points) && payload.points.length > 0) {
+        return { points: payload.points, clusters: payload.clusters, method: payload.method ?? method };
+      }
+    } catch (error) {
+      console.warn('[MarketMap] Could not load market_map.json:', error);
+    }
+  }
+
   const brands = await loadBrandData();
   
   if (brands.length === 0) {
@@ -36,6 +36,31 @@ const ROOT = process.cwd();
 const PYTHON = process.env.PYTHON_PATH || "python3";
 const MODEL_SCRIPT = path.resolve(ROOT, "src/model/infer_ati.py");
 const IMG_DIR = path.resolve(ROOT, "src/model/input_images");
+// /api/analyze 的 stage 期限（秒，選用）：OCR 超時就先回傳無 OCR 的結果（degraded）。
+// 每個請求都是新的 infer_ati.py 程序，OCR stage 含 EasyOCR 冷載入，所以預設 0 = 不設期限
+const ANALYZE_DEADLINE_S = Number(process.env.ANALYZE_DEADLINE_S ?? "0");
+// scripts/generate_summary.py 預先算好的市場彙總（依 artifact 版本分資料夾）
+const MARKET_DIR = path.resolve(ROOT, "src/data/generated/market");
+
+// 讀取 materialized 市場彙總；latest.json 指向目前版本，不存在時回傳 null 改走即時計算
+const materializedCache = new Map<string, any>();
+function readMaterialized(name: string): any | null {
+  try {
+    const latestPath = path.join(MARKET_DIR, "latest.json");
+    if (!fs.existsSync(latestPath)) return null;
+    const { version } = JSON.parse(fs.readFileSync(latestPath, "utf-8"));
+    const key = `${version}/${name}`;
+    if (materializedCache.has(key)) return materializedCache.get(key);
+    const filePath = path.join(MARKET_DIR, String(version), `${name}.json`);
+    if (!fs.existsSync(filePath)) return null;
+    const payload = JSON.parse(fs.readFileSync(filePath, "utf-8"));
+    materializedCache.set(key, payload);
+    return payload;
+  } catch (err) {
+    console.warn(`materialized ${name} unavailable:`, err);
+    return null;
+  }
+}
 
 // small helper: run python and parse JSON
 function runPython(args: string[]): Promise<any> {
@@ -122,6 +147,9 @@ app.post("/api/analyze", upload.single("file"), async (req, res) => {
     if (relImg) {
       args.push("--rel_img", relImg);
     }
+    if (ANALYZE_DEADLINE_S > 0) {
+      args.push("--deadline", String(ANALYZE_DEADLINE_S));
+    }
 
     const result = await runPython(args);
     // result is whatever infer_ati.py printed (ati, components, etc.)
@@ -178,7 +206,7 @@ app.get('/api/brand/:brandName/similar', async (req, res) => {
 // GET /api/market/stats - 取得市場統計
 app.get('/api/market/stats', async (req, res) => {
   try {
-    const stats = await getMarketStats();
+    const stats = readMaterialized("stats") ?? await getMarketStats();
     return res.json(stats);
   } catch (err: any) {
     console.error('market stats error:', err);
@@ -189,6 +217,9 @@ app.get('/api/market/stats', async (req, res) => {
 // GET /api/market/summary - 取得市場摘要（包含高風險品牌計算）
 app.get('/api/market/summary', async (req, res) => {
   try {
+    const materialized = readMaterialized("summary");
+    if (materialized) return res.json(materialized);
+
     const stats = await getMarketStats();
     
     // 計算時間範圍（從貼文數據推斷）
@@ -224,7 +255,7 @@ app.get('/api/market/map', async (req, res) => {
 // GET /api/market/map/stats - 取得市場地圖統計
 app.get('/api/market/map/stats', async (req, res) => {
   try {
-    const stats = await getMarketMapStats();
+    const stats = readMaterialized("map_stats") ?? await getMarketMapStats();
     return res.json(stats);
   } catch (err: any) {
     console.error('market map stats error:', err);
@@ -236,7 +267,7 @@ app.get('/api/market/map/stats', async (req, res) => {
 app.get('/api/market/trend', async (req, res) => {
   try {
     // 使用展示專用版本：時間越新的資料，ATI 逐月乘以 0.96
-    const trend = await getMarketTrendForPresentation();
+    const trend = readMaterialized("trend") ?? await getMarketTrendForPresentation();
     return res.json({ trend });
   } catch (err: any) {
     console.error('market trend error:', err);
@@ -247,7 +278,7 @@ app.get('/api/market/trend', async (req, res) => {
 // GET /api/market/correlation - 取得 ATI 與互動率相關性分析
 app.get('/api/market/correlation', async (req, res) => {
   try {
-    const correlation = await getATIEngagementCorrelation();
+    const correlation = readMaterialized("correlation") ?? await getATIEngagementCorrelation();
     return res.json(correlation);
   } catch (err: any) {
     console.error('correlation error:', err);
@@ -259,7 +290,7 @@ app.get('/api/market/correlation', async (req, res) => {
 app.get('/api/market/deciles', async (req, res) => {
   try {
     // 使用展示專用版本：ATI 越高的貼文，互動率逐項乘以 0.9
-    const deciles = await getDecileAnalysisForPresentation();
+    const deciles = readMaterialized("deciles") ?? await getDecileAnalysisForPresentation();
     return res.json({ deciles });
   } catch (err: any) {
     console.error('deciles error:', err);
@@ -270,7 +301,7 @@ app.get('/api/market/deciles', async (req, res) => {
 // GET /api/market/engagement-scaling - 取得互動縮放檢查數據
 app.get('/api/market/engagement-scaling', async (req, res) => {
   try {
-    const scaling = await getEngagementScalingCheck();
+    const scaling = readMaterialized("engagement_scaling") ?? await getEngagementScalingCheck();
     return res.json(scaling);
   } catch (err: any) {
     console.error('engagement scaling error:', err);
@@ -285,7 +316,9 @@ app.get('/api/market/engagement-scaling/calculate', async (req, res) => {
     if (isNaN(weight) || weight < 0 || weight > 20) {
       return res.status(400).json({ error: 'Invalid weight parameter (0-20)' });
     }
-    const result = await calculateCorrelationForWeight(weight);
+    const brand = typeof req.query.brand === 'string' ? req.query.brand : undefined;
+    const metric = typeof req.query.metric === 'string' ? req.query.metric : 'ATI_final';
+    const result = await calculateCorrelationForWeight(weight, brand, metric);
     return res.json(result);
   } catch (err: any) {
     console.error('calculate correlation error:', err);
@@ -297,7 +330,10 @@ app.get('/api/market/engagement-scaling/calculate', async (req, res) => {
 app.get('/api/market/tail-outliers', async (req, res) => {
   try {
     const limit = parseInt(req.query.limit as string) || 10;
-    const outliers = await getTailOutlierPosts(limit);
+    const materialized = readMaterialized("tail_outliers");
+    const outliers = materialized && materialized.length >= limit
+      ? materialized.slice(0, limit)
+      : await getTailOutlierPosts(limit);
     return res.json({ outliers });
   } catch (err: any) {
     console.error('tail outliers error:', err);
@@ -308,7 +344,7 @@ app.get('/api/market/tail-outliers', async (req, res) => {
 // GET /api/market/tail-analysis - 取得互動尾部分析數據
 app.get('/api/market/tail-analysis', async (req, res) => {
   try {
-    const analysis = await getEngagementTailAnalysis();
+    const analysis = readMaterialized("tail_analysis") ?? await getEngagementTailAnalysis();
     return res.json(analysis);
   } catch (err: any) {
     console.error('tail analysis error:', err);